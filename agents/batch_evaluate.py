@@ -0,0 +1,349 @@
+"""
+Bulk evaluation of completed visits.
+Completed visits without an evaluation are streamed page by page (with transcripts) from
+the Next.js API and evaluated concurrently through the agent's GigaChat client: the same
+token cache, HTTP pool, resilience and shared rate limiter, at background priority, so a
+cohort is graded as fast as the account limit allows without slowing live sessions.
+Results are written back in bulk. Every result is first appended to a checkpoint file,
+so an interrupted run resumes without evaluating the same visits again.
+
+Usage:
+    python batch_evaluate.py --concurrency 8
+    python batch_evaluate.py --user <rep user id> --limit 100
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from telemetry import setup_logging
+
+setup_logging()
+
+from http_pool import http_pool
+from gigachat_auth import gigachat_tokens
+from gigachat_resilience import gigachat_resilience
+from rate_limiter import gigachat_rate_limiter
+
+logger = logging.getLogger("shadowmed.batch_evaluate")
+
+NEXTJS_API_URL = os.getenv("NEXTJS_API_URL", "http://localhost:3000")
+EVALUATION_CONCURRENCY = int(os.getenv("EVALUATION_CONCURRENCY", "4"))
+EVALUATION_PAGE_SIZE = int(os.getenv("EVALUATION_PAGE_SIZE", "50"))
+# Evaluations per bulk POST (the API accepts up to 100)
+EVALUATION_BATCH_SIZE = int(os.getenv("EVALUATION_BATCH_SIZE", "20"))
+EVALUATION_CHECKPOINT_PATH = os.getenv(
+    "EVALUATION_CHECKPOINT_PATH",
+    os.path.join(tempfile.gettempdir(), "shadowmed-evaluations.jsonl"),
+)
+EVALUATION_MAX_TOKENS = 1000
+
+# Same criteria and prompt as the per-visit evaluation (lib/gigachat/client.ts)
+EVALUATION_CRITERIA = [
+    "Communication clarity and professionalism",
+    "Product knowledge demonstration",
+    "Active listening and empathy",
+    "Problem-solving and objection handling",
+    "Call structure and organization",
+    "Confidence and rapport building",
+]
+EVALUATION_SYSTEM_PROMPT = "You are a medical training evaluation expert. Always respond with valid JSON."
+
+
+def _service_headers() -> dict:
+    service_token = os.getenv("AGENT_SERVICE_TOKEN")
+    return {"x-service-token": service_token} if service_token else {}
+
+
+def build_evaluation_prompt(visit: dict) -> str:
+    doctor_name = (visit.get("doctor") or {}).get("name") or "Doctor"
+    transcript = "\n\n".join(
+        f"{'Medical Rep' if m['role'] == 'user' else f'Dr. {doctor_name}'}: {m['content']}"
+        for m in visit.get("messages", [])
+    )
+    criteria = "\n".join(EVALUATION_CRITERIA)
+    return (
+        "You are an expert medical training evaluator. Analyze the following pharmaceutical sales "
+        "visit transcript and provide:\n\n"
+        "1. Overall score (0-100)\n"
+        "2. Detailed feedback on performance\n"
+        "3. Specific recommendations for improvement\n"
+        "4. Metrics breakdown by evaluation criteria\n\n"
+        f"Evaluation Criteria:\n{criteria}\n\n"
+        f"Transcript:\n{transcript}\n\n"
+        "Provide your response in JSON format with keys: score, feedback, recommendations (array), metrics (object)"
+    )
+
+
+def parse_evaluation(text: str) -> dict:
+    """Evaluation fields from the model reply (a JSON object, possibly in a code block)."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        result = json.loads(match.group(0) if match else text)
+        if not isinstance(result, dict):
+            raise ValueError("not an object")
+    except ValueError:
+        # Same fallback as the per-visit evaluation
+        return {
+            "score": 70,
+            "feedback": "Visit evaluation completed. Some technical issues occurred during detailed analysis.",
+            "recommendations": [
+                "Continue practicing pharmaceutical sales conversations",
+                "Focus on building rapport with healthcare professionals",
+            ],
+            "metrics": {"technical_error": True},
+        }
+    try:
+        score = float(result.get("score") or 0)
+    except (TypeError, ValueError):
+        score = 0.0
+    recommendations = result.get("recommendations")
+    return {
+        "score": max(0, min(100, round(score))),
+        "feedback": result.get("feedback") or "Evaluation completed",
+        "recommendations": recommendations if isinstance(recommendations, list) else [],
+        "metrics": result.get("metrics") if isinstance(result.get("metrics"), dict) else {},
+    }
+
+
+class Checkpoint:
+    """Append-only log of evaluated and saved visits (JSON lines)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # visit id -> evaluation not yet confirmed as saved
+        self.unsaved: dict = {}
+        self.saved: set = set()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line of an interrupted run
+                    continue
+                if "evaluation" in entry:
+                    self.unsaved[entry["visitId"]] = entry["evaluation"]
+                for visit_id in entry.get("saved", []):
+                    self.saved.add(visit_id)
+                    self.unsaved.pop(visit_id, None)
+        logger.info(f"Checkpoint {self.path}: {len(self.saved)} saved, {len(self.unsaved)} to save")
+
+    def _append(self, entry: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def done(self, visit_id: str) -> bool:
+        return visit_id in self.saved or visit_id in self.unsaved
+
+    def record(self, evaluation: dict):
+        self.unsaved[evaluation["visitId"]] = evaluation
+        self._append({"visitId": evaluation["visitId"], "evaluation": evaluation})
+
+    def mark_saved(self, visit_ids: list):
+        for visit_id in visit_ids:
+            self.saved.add(visit_id)
+            self.unsaved.pop(visit_id, None)
+        self._append({"saved": visit_ids})
+
+    def clear(self):
+        """Remove the checkpoint after a run that saved everything."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BatchEvaluator:
+    """Pending visits -> bounded concurrent GigaChat evaluations -> bulk saves."""
+
+    def __init__(
+        self,
+        checkpoint: Checkpoint,
+        api_url: str = NEXTJS_API_URL,
+        concurrency: int = EVALUATION_CONCURRENCY,
+        page_size: int = EVALUATION_PAGE_SIZE,
+        batch_size: int = EVALUATION_BATCH_SIZE,
+        user_id: Optional[str] = None,
+        limit: Optional[int] = None,
+    ):
+        self.checkpoint = checkpoint
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.user_id = user_id
+        self.limit = limit
+        self.counters = {"fetched": 0, "evaluated": 0, "saved": 0, "skipped": 0, "failed": 0, "resumed": 0}
+        self.evaluation_seconds: list = []
+
+    async def fetch_pending(self):
+        """Yield completed, unevaluated visits page by page."""
+        after = None
+        while True:
+            params = {"limit": str(self.page_size)}
+            if after:
+                params["after"] = after
+            if self.user_id:
+                params["userId"] = self.user_id
+            async with http_pool.get(
+                f"{self.api_url}/api/evaluations/pending",
+                params=params,
+                headers=_service_headers(),
+            ) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Failed to fetch pending evaluations: {resp.status} - {await resp.text()}")
+                data = await resp.json()
+            for visit in data.get("visits", []):
+                yield visit
+            after = data.get("nextCursor")
+            if not after:
+                return
+
+    async def evaluate(self, visit: dict) -> dict:
+        # Late import: doctor_agent loads the LiveKit plugins
+        from doctor_agent import call_gigachat_api
+
+        reply = await call_gigachat_api(
+            messages=[{"role": "user", "content": build_evaluation_prompt(visit)}],
+            system_prompt=EVALUATION_SYSTEM_PROMPT,
+            visit_id=visit["id"],
+            max_tokens=EVALUATION_MAX_TOKENS,
+            priority="background",
+            session_id=f"{visit['id']}:evaluation",
+            temperature=0.3,
+        )
+        return {"visitId": visit["id"], **parse_evaluation(reply)}
+
+    async def save(self, batch: list):
+        async with http_pool.post(
+            f"{self.api_url}/api/evaluations/bulk",
+            json={"evaluations": batch},
+            headers=_service_headers(),
+        ) as resp:
+            if resp.status not in (200, 201):
+                raise Exception(f"Failed to save evaluations: {resp.status} - {await resp.text()}")
+            data = await resp.json()
+        self.counters["saved"] += data.get("inserted", 0)
+        self.counters["skipped"] += data.get("skipped", 0)
+        self.checkpoint.mark_saved([evaluation["visitId"] for evaluation in batch])
+
+    async def run(self) -> dict:
+        started = time.perf_counter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def produce():
+            async for visit in self.fetch_pending():
+                if self.checkpoint.done(visit["id"]):
+                    continue
+                if self.limit is not None and self.counters["fetched"] >= self.limit:
+                    break
+                self.counters["fetched"] += 1
+                # Bounded queue: pages are fetched only as fast as visits are evaluated
+                await queue.put(visit)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def evaluate_worker():
+            while (visit := await queue.get()) is not None:
+                evaluation_started = time.perf_counter()
+                try:
+                    evaluation = await self.evaluate(visit)
+                except Exception as e:
+                    # Left unevaluated: the next run picks the visit up again
+                    self.counters["failed"] += 1
+                    logger.warning(f"Evaluation of visit {visit['id']} failed: {e}")
+                    continue
+                self.evaluation_seconds.append(time.perf_counter() - evaluation_started)
+                self.counters["evaluated"] += 1
+                self.checkpoint.record(evaluation)
+                await results.put(evaluation)
+
+        async def write_back():
+            batch: list = []
+            while (evaluation := await results.get()) is not None:
+                batch.append(evaluation)
+                if len(batch) >= self.batch_size:
+                    await self.save(batch)
+                    batch = []
+            if batch:
+                await self.save(batch)
+
+        # Results of an interrupted run are saved first, without evaluating again
+        resumed = list(self.checkpoint.unsaved.values())
+        self.counters["resumed"] = len(resumed)
+        for i in range(0, len(resumed), self.batch_size):
+            await self.save(resumed[i:i + self.batch_size])
+
+        writer = asyncio.create_task(write_back())
+        try:
+            await asyncio.gather(produce(), *[evaluate_worker() for _ in range(self.concurrency)])
+            await results.put(None)
+            await writer
+        finally:
+            if not writer.done():
+                writer.cancel()
+
+        wall_time = time.perf_counter() - started
+        return {
+            **self.counters,
+            "wall_time": wall_time,
+            "evaluations_per_minute": self.counters["evaluated"] * 60 / wall_time if wall_time else 0.0,
+            "gigachat_resilience": gigachat_resilience.stats(),
+            "rate_limiter": gigachat_rate_limiter.stats(),
+        }
+
+
+async def run_batch(args) -> dict:
+    checkpoint = Checkpoint(args.checkpoint)
+    evaluator = BatchEvaluator(
+        checkpoint,
+        concurrency=args.concurrency,
+        page_size=args.page_size,
+        batch_size=args.batch_size,
+        user_id=args.user,
+        limit=args.limit,
+    )
+    http_pool.acquire()
+    try:
+        summary = await evaluator.run()
+    finally:
+        await gigachat_tokens.aclose()
+        await http_pool.release()
+    if not checkpoint.unsaved and not summary["failed"]:
+        checkpoint.clear()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate completed visits in bulk through GigaChat")
+    parser.add_argument("--concurrency", type=int, default=EVALUATION_CONCURRENCY, help="Evaluations in flight")
+    parser.add_argument("--page-size", type=int, default=EVALUATION_PAGE_SIZE, help="Visits fetched per page")
+    parser.add_argument("--batch-size", type=int, default=EVALUATION_BATCH_SIZE, help="Evaluations per bulk save")
+    parser.add_argument("--user", help="Only visits of this rep (user id)")
+    parser.add_argument("--limit", type=int, help="Evaluate at most this many visits")
+    parser.add_argument("--checkpoint", default=EVALUATION_CHECKPOINT_PATH, help="Progress file for resuming")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_batch(args))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
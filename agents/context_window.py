@@ -0,0 +1,114 @@
+"""
+Bounded GigaChat context for long visits.
+Recent turns are sent verbatim; older turns are folded into a running summary that is
+generated in the background, so prompt size (and per-turn latency) stays flat.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("shadowmed.context_window")
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_KEEP_RECENT = int(os.getenv("CONTEXT_KEEP_RECENT", "8"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+
+# Rough GigaChat tokenizer ratio for Russian text, plus per-message role overhead
+CHARS_PER_TOKEN = 3.0
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "Краткое содержание предыдущей части разговора:"
+
+# (previous_summary, messages_to_fold) -> new summary
+SummarizeFn = Callable[[str, list], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of GigaChat tokens in a text."""
+    if not text:
+        return 0
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def estimate_messages_tokens(messages: list) -> int:
+    """Estimate the number of tokens a message list takes in the prompt."""
+    return sum(estimate_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class ContextWindow:
+    """Keeps the prompt within a token budget using a rolling summary of older turns."""
+
+    def __init__(
+        self,
+        summarize: SummarizeFn,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        keep_recent: int = CONTEXT_KEEP_RECENT,
+    ):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.summary = ""
+        # Number of leading transcript messages already folded into the summary
+        self.summarized_upto = 0
+        self._summary_task: Optional[asyncio.Task] = None
+
+    def system_message(self, system_prompt: str) -> dict:
+        content = system_prompt
+        if self.summary:
+            content = f"{system_prompt}\n\n{SUMMARY_HEADER}\n{self.summary}"
+        return {"role": "system", "content": content}
+
+    def build(self, messages: list, system_prompt: str) -> list:
+        """Return the messages to send for this turn (system message first)."""
+        # A restored or reset transcript can be shorter than what was summarized
+        if self.summarized_upto > len(messages):
+            self.summary, self.summarized_upto = "", 0
+
+        system = self.system_message(system_prompt)
+        recent = messages[self.summarized_upto:]
+        total = estimate_messages_tokens([system] + recent)
+
+        if total > self.token_budget:
+            self._schedule_summary(messages)
+
+            # Until the summary catches up, drop the oldest verbatim turns so this
+            # turn's prompt stays within budget
+            min_recent = min(len(recent), self.keep_recent)
+            while len(recent) > min_recent and total > self.token_budget:
+                total -= estimate_messages_tokens(recent[:1])
+                recent = recent[1:]
+
+        return [system] + recent
+
+    def _schedule_summary(self, messages: list):
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+        # Fold in batches of at least keep_recent messages, not on every turn
+        fold_upto = len(messages) - self.keep_recent
+        if fold_upto - self.summarized_upto < max(1, self.keep_recent):
+            return
+        to_fold = messages[self.summarized_upto:fold_upto]
+        self._summary_task = asyncio.create_task(self._summarize(to_fold, fold_upto))
+
+    async def _summarize(self, to_fold: list, fold_upto: int):
+        try:
+            summary = await self.summarize(self.summary, to_fold)
+        except Exception as e:
+            logger.warning(f"Failed to summarize conversation: {e}")
+            return
+        if summary:
+            self.summary = summary.strip()
+            self.summarized_upto = fold_upto
+            logger.info(f"Conversation summarized up to message {fold_upto} (~{estimate_tokens(self.summary)} tokens)")
+
+    async def aclose(self):
+        """Cancel a pending background summary."""
+        task, self._summary_task = self._summary_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
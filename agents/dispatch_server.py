@@ -0,0 +1,156 @@
+"""
+Local dispatch endpoint for a long-lived doctor agent worker.
+Accepts (visit_id, room, doctor_name) over HTTP and creates an explicit LiveKit agent
+dispatch, so the visit runs in one of the worker's already-warm job processes instead
+of a freshly started interpreter.
+
+    POST   /dispatch                      {"visit_id", "room", "doctor_name", "visit"?}
+    DELETE /dispatch/{room}/{dispatch_id}
+    POST   /drain
+    GET    /health
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from aiohttp import web
+from livekit import api
+
+from load_control import admission_control
+
+logger = logging.getLogger("shadowmed.dispatch_server")
+
+AGENT_NAME = os.getenv("AGENT_NAME", "doctor-agent")
+AGENT_DISPATCH_HOST = os.getenv("AGENT_DISPATCH_HOST", "127.0.0.1")
+AGENT_DISPATCH_PORT = int(os.getenv("AGENT_DISPATCH_PORT", "8081"))
+
+
+class DispatchServer:
+    """Small aiohttp app that turns local dispatch requests into LiveKit agent dispatches."""
+
+    def __init__(
+        self,
+        agent_name: str = AGENT_NAME,
+        host: str = AGENT_DISPATCH_HOST,
+        port: int = AGENT_DISPATCH_PORT,
+    ):
+        self.agent_name = agent_name
+        self.host = host
+        self.port = port
+        self.service_token = os.getenv("AGENT_SERVICE_TOKEN")
+        self._lkapi: Optional[api.LiveKitAPI] = None
+        self._thread: Optional[threading.Thread] = None
+        self.dispatched_total = 0
+
+    def _authorized(self, request: web.Request) -> bool:
+        return not self.service_token or request.headers.get("x-service-token") == self.service_token
+
+    def _api(self) -> api.LiveKitAPI:
+        if self._lkapi is None:
+            # Reads LIVEKIT_URL / LIVEKIT_API_KEY / LIVEKIT_API_SECRET
+            self._lkapi = api.LiveKitAPI()
+        return self._lkapi
+
+    async def handle_dispatch(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Invalid JSON"}, status=400)
+
+        visit_id = body.get("visit_id")
+        room = body.get("room")
+        if not visit_id or not room:
+            return web.json_response({"error": "visit_id and room are required"}, status=400)
+
+        if admission_control.draining:
+            return web.json_response({"error": "Worker is draining"}, status=503)
+
+        metadata = {
+            "visit_id": visit_id,
+            "doctor_name": body.get("doctor_name") or "Доктор",
+        }
+        # Optional resolved visit/doctor payload, so the job starts without an API call
+        if body.get("visit"):
+            metadata["visit"] = body["visit"]
+            doctor = body["visit"].get("doctor") or {}
+            metadata["doctor_id"] = doctor.get("id")
+            metadata["doctor_version"] = doctor.get("updatedAt")
+
+        try:
+            dispatch = await self._api().agent_dispatch.create_dispatch(
+                api.CreateAgentDispatchRequest(
+                    agent_name=self.agent_name,
+                    room=room,
+                    metadata=json.dumps(metadata, ensure_ascii=False),
+                )
+            )
+        except Exception as e:
+            logger.error(f"Error creating agent dispatch for visit {visit_id}: {e}")
+            return web.json_response({"error": "Failed to dispatch agent", "details": str(e)}, status=502)
+
+        self.dispatched_total += 1
+        logger.info(f"Dispatched {self.agent_name} to room {room} for visit {visit_id}: {dispatch.id}")
+        return web.json_response({"dispatch_id": dispatch.id, "room": room, "visit_id": visit_id})
+
+    async def handle_delete(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        room = request.match_info["room"]
+        dispatch_id = request.match_info["dispatch_id"]
+        try:
+            await self._api().agent_dispatch.delete_dispatch(dispatch_id, room)
+        except Exception as e:
+            return web.json_response({"error": "Failed to delete dispatch", "details": str(e)}, status=502)
+        return web.json_response({"dispatch_id": dispatch_id, "room": room})
+
+    async def handle_drain(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        admission_control.start_draining()
+        return web.json_response({"draining": True})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "draining" if admission_control.draining else "ok",
+            "agent_name": self.agent_name,
+            "dispatched_total": self.dispatched_total,
+            "load": admission_control.last_load,
+        })
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/dispatch", self.handle_dispatch)
+        app.router.add_delete("/dispatch/{room}/{dispatch_id}", self.handle_delete)
+        app.router.add_post("/drain", self.handle_drain)
+        app.router.add_get("/health", self.handle_health)
+        return app
+
+    async def serve(self):
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Agent dispatch endpoint listening on http://{self.host}:{self.port}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if self._lkapi is not None:
+                await self._lkapi.aclose()
+            await runner.cleanup()
+
+    def start_in_thread(self):
+        """Run the endpoint on its own event loop next to the worker's (cli.run_app owns the main loop)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=lambda: asyncio.run(self.serve()),
+            name="agent-dispatch-server",
+            daemon=True,
+        )
+        self._thread.start()
@@ -5,239 +5,817 @@ Handles voice conversations with medical representatives using STT, LLM (GigaCha
 """
 
 import asyncio
+import hashlib
+import logging
 import os
 import json
-import aiohttp
-from typing import Annotated, Optional
+import time
+import uuid
+from collections import deque
+from typing import Optional
 from dotenv import load_dotenv
 
 from livekit import agents, rtc
 from livekit.agents import (
     AutoSubscribe,
     JobContext,
+    JobProcess,
     WorkerOptions,
     cli,
     llm,
-    voice_assistant,
     AgentSession,
     Agent,
     RoomInputOptions,
+    APIConnectOptions,
+    DEFAULT_API_CONNECT_OPTIONS,
     stt,
     tts,
+    tokenize,
 )
-from livekit.plugins import openai, silero
+from livekit.agents.metrics import TTSMetrics
+
+from http_pool import http_pool
+from gigachat_auth import gigachat_tokens
+import visit_cache
+from inference_pool import (
+    inference_pool,
+    silero_tts_available,
+    use_shared_vad_executor,
+    SileroTTS,
+    SILERO_TTS_MODEL,
+)
+from tts_cache import CachedTTS, COMMON_DOCTOR_PHRASES
+from load_control import process_load
+from metrics import GIGACHAT_REQUESTS, GIGACHAT_TOKENS, GIGACHAT_PROMPT_CACHE, JobStartTimer, startup_stats
+from telemetry import TurnTracer, setup_logging
+from context_window import ContextWindow, CONTEXT_KEEP_RECENT, CONTEXT_SUMMARY_MAX_TOKENS
+from message_journal import message_journal
+from rate_limiter import gigachat_rate_limiter, estimate_request_tokens
+from gigachat_resilience import gigachat_resilience, GigaChatAPIError, GIGACHAT_FALLBACK_REPLY
+from speculation import SpeculativeGenerator, GIGACHAT_SPECULATIVE
+from stt_gate import VADGatedSTT, STT_VAD_GATE, vad_options
 
 # Load environment variables
 load_dotenv()
+setup_logging()
+
+logger = logging.getLogger("shadowmed.doctor_agent")
 
 # Configuration
 LIVEKIT_URL = os.getenv("LIVEKIT_URL")
 LIVEKIT_API_KEY = os.getenv("LIVEKIT_API_KEY")
 LIVEKIT_API_SECRET = os.getenv("LIVEKIT_API_SECRET")
 GIGACHAT_API_URL = os.getenv("GIGACHAT_API_URL", "https://gigachat.devices.sberbank.ru/api/v1")
-GIGACHAT_OAUTH_URL = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
-GIGACHAT_AUTHORIZATION_KEY = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
 NEXTJS_API_URL = os.getenv("NEXTJS_API_URL", "http://localhost:3000")
 USE_SILERO_TTS = os.getenv("USE_SILERO_TTS", "true").lower() == "true"
 USE_OPENAI_STT = os.getenv("USE_OPENAI_STT", "true").lower() == "true"
+GIGACHAT_STREAM = os.getenv("GIGACHAT_STREAM", "true").lower() == "true"
+# Minimum sentence length (chars) handed to TTS while the reply is still streaming
+TTS_MIN_SENTENCE_LEN = int(os.getenv("TTS_MIN_SENTENCE_LEN", "20"))
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_PRESYNTHESIZE = os.getenv("TTS_PRESYNTHESIZE", "false").lower() == "true"
+# Send X-Session-ID per visit so GigaChat can reuse the cached prompt prefix between turns
+GIGACHAT_SESSION_CACHE = os.getenv("GIGACHAT_SESSION_CACHE", "true").lower() == "true"
+# Delay after the end of an utterance before the turn is committed (turn endpointing), seconds
+AGENT_MIN_ENDPOINTING_DELAY = float(os.getenv("AGENT_MIN_ENDPOINTING_DELAY", "0.5"))
+AGENT_MAX_ENDPOINTING_DELAY = float(os.getenv("AGENT_MAX_ENDPOINTING_DELAY", "3.0"))
 
-# GigaChat Access Token cache
-_gigachat_token: Optional[str] = None
-_token_expiry: float = 0
-
+# Token usage reported by GigaChat in this process (see record_gigachat_usage)
+gigachat_usage = {
+    "responses": 0,
+    "cache_hits": 0,
+    "prompt_tokens": 0,
+    "precached_prompt_tokens": 0,
+    "completion_tokens": 0,
+}
 
 async def get_gigachat_token() -> str:
-    """Get or refresh GigaChat access token."""
-    global _gigachat_token, _token_expiry
-    import time
-    import uuid
-
-    # Check if token is still valid (with 5 minute buffer)
-    if _gigachat_token and time.time() < _token_expiry - 300:
-        return _gigachat_token
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            GIGACHAT_OAUTH_URL,
-            headers={
-                "Authorization": f"Bearer {GIGACHAT_AUTHORIZATION_KEY}",
-                "Content-Type": "application/x-www-form-urlencoded",
-                "RqUID": str(uuid.uuid4()),
-            },
-            data={"scope": os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")},
-            ssl=False,
-        ) as resp:
-            if resp.status != 200:
-                error_text = await resp.text()
-                raise Exception(f"Failed to get GigaChat token: {resp.status} - {error_text}")
-            
-            data = await resp.json()
-            _gigachat_token = data.get("access_token")
-            expires_in = data.get("expires_at", 1800)
-            _token_expiry = time.time() + expires_in
-            
-            return _gigachat_token
-
-
-async def call_gigachat_api(messages: list, system_prompt: str, visit_id: str) -> str:
-    """Call GigaChat API to generate doctor's response."""
-    token = await get_gigachat_token()
-    
-    # Prepare messages for GigaChat (combine system prompt with messages)
+    """Get GigaChat access token (cached, shared between workers, refreshed in background)."""
+    return await gigachat_tokens.get_token()
+
+
+def record_gigachat_usage(mode: str, usage: Optional[dict]):
+    """Count prompt, precached and completion tokens from a response `usage` field."""
+    if not usage:
+        return
+    prompt = usage.get("prompt_tokens") or 0
+    precached = usage.get("precached_prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    gigachat_usage["responses"] += 1
+    gigachat_usage["cache_hits"] += 1 if precached else 0
+    gigachat_usage["prompt_tokens"] += prompt
+    gigachat_usage["precached_prompt_tokens"] += precached
+    gigachat_usage["completion_tokens"] += completion
+    GIGACHAT_TOKENS.labels(mode, "prompt").inc(prompt)
+    GIGACHAT_TOKENS.labels(mode, "precached").inc(precached)
+    GIGACHAT_TOKENS.labels(mode, "completion").inc(completion)
+    GIGACHAT_PROMPT_CACHE.labels(mode, "hit" if precached else "miss").inc()
+
+
+def _gigachat_headers(token: str, session_id: Optional[str], stream: bool = False) -> dict:
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+    }
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    if session_id and GIGACHAT_SESSION_CACHE:
+        headers["X-Session-ID"] = session_id
+    return headers
+
+
+def build_gigachat_messages(messages: list, system_prompt: str) -> list:
+    """Prepare messages for GigaChat (combine system prompt with messages)."""
     giga_messages = messages.copy()
     # Insert system message at the beginning if not already there
     if not any(msg.get("role") == "system" for msg in giga_messages):
         giga_messages.insert(0, {"role": "system", "content": system_prompt})
+    return giga_messages
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            f"{GIGACHAT_API_URL}/chat/completions",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "GigaChat",
-                "messages": giga_messages,
-                "temperature": 0.7,
-                "max_tokens": 1024,
-            },
-            ssl=False,
-        ) as resp:
-            if resp.status != 200:
-                error_text = await resp.text()
-                raise Exception(f"GigaChat API error {resp.status}: {error_text}")
-            
-            data = await resp.json()
-            if "choices" not in data or len(data["choices"]) == 0:
-                raise Exception(f"Invalid GigaChat response: {data}")
-            
-            return data["choices"][0]["message"]["content"]
 
+async def call_gigachat_api(
+    messages: list,
+    system_prompt: str,
+    visit_id: str,
+    max_tokens: int = 1024,
+    priority: str = "live",
+    session_id: Optional[str] = None,
+    temperature: float = 0.7,
+) -> str:
+    """Call GigaChat API to generate doctor's response (rate-limited, with deadline, hedging and retries).
+
+    priority is "live" for conversational turns or "background" (summaries, evaluations).
+    session_id (X-Session-ID, the visit by default) should only be shared by requests whose
+    messages extend each other, so GigaChat can reuse the cached prefix.
+    """
+    session_id = session_id or visit_id
+    giga_messages = build_gigachat_messages(messages, system_prompt)
+    admission = gigachat_rate_limiter.admission(estimate_request_tokens(giga_messages, max_tokens), priority)
+
+    async def attempt() -> str:
+        token = await get_gigachat_token()
+        with process_load.track_gigachat():
+            try:
+                response_text, usage = await _post_gigachat_completion(
+                    token, giga_messages, max_tokens, session_id, temperature
+                )
+            except asyncio.CancelledError:
+                GIGACHAT_REQUESTS.labels("blocking", "cancelled").inc()
+                raise
+            except Exception:
+                GIGACHAT_REQUESTS.labels("blocking", "error").inc()
+                raise
+        GIGACHAT_REQUESTS.labels("blocking", "ok").inc()
+        record_gigachat_usage("blocking", usage)
+        admission.settle((usage or {}).get("total_tokens"))
+        return response_text
 
-async def save_message_to_db(visit_id: str, role: str, content: str):
-    """Save conversation message to database via Next.js API."""
+    return await gigachat_resilience.call(attempt, admission)
+
+
+def _api_error(status: int, error_text: str, headers) -> GigaChatAPIError:
+    """Build the error for a failed response; a 429 also pauses the shared rate limiter."""
+    retry_after = None
     try:
-        service_token = os.getenv("AGENT_SERVICE_TOKEN")
-        headers = {"Content-Type": "application/json"}
-        if service_token:
-            headers["x-service-token"] = service_token
+        retry_after = float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        pass
+    if status == 429:
+        gigachat_rate_limiter.on_rate_limited(retry_after)
+    return GigaChatAPIError(status, f"GigaChat API error {status}: {error_text}", retry_after=retry_after)
+
+
+async def _post_gigachat_completion(
+    token: str, giga_messages: list, max_tokens: int, session_id: Optional[str] = None, temperature: float = 0.7
+) -> tuple:
+    """Return the reply text and the reported token usage."""
+    async with http_pool.post(
+        f"{GIGACHAT_API_URL}/chat/completions",
+        headers=_gigachat_headers(token, session_id),
+        json={
+            "model": "GigaChat",
+            "messages": giga_messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+        ssl=False,
+    ) as resp:
+        if resp.status != 200:
+            error_text = await resp.text()
+            raise _api_error(resp.status, error_text, resp.headers)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{NEXTJS_API_URL}/api/visits/{visit_id}/messages",
-                headers=headers,
-                json={
-                    "role": role,
-                    "content": content,
-                    "metadata": {"source": "livekit-agent"},
-                },
-            ) as resp:
-                if resp.status not in (200, 201):
-                    error_text = await resp.text()
-                    print(f"Warning: Failed to save message to DB: {resp.status} - {error_text}")
-    except Exception as e:
-        print(f"Error saving message to DB: {e}")
+        data = await resp.json()
+        if "choices" not in data or len(data["choices"]) == 0:
+            raise Exception(f"Invalid GigaChat response: {data}")
+        
+        return data["choices"][0]["message"]["content"], data.get("usage")
+
+
+async def stream_gigachat_api(
+    messages: list,
+    system_prompt: str,
+    visit_id: str,
+    priority: str = "live",
+    session_id: Optional[str] = None,
+):
+    """Stream doctor's response from GigaChat (SSE), yielding content deltas as they arrive.
+
+    The deadline, hedging and retries of gigachat_resilience apply until the first token.
+    """
+    session_id = session_id or visit_id
+    giga_messages = build_gigachat_messages(messages, system_prompt)
+    admission = gigachat_rate_limiter.admission(estimate_request_tokens(giga_messages, 1024), priority)
+
+    def on_usage(usage: dict):
+        record_gigachat_usage("stream", usage)
+        admission.settle(usage.get("total_tokens"))
+
+    async def attempt():
+        token = await get_gigachat_token()
+        with process_load.track_gigachat():
+            try:
+                async for content in _stream_gigachat_completion(token, giga_messages, session_id, on_usage):
+                    yield content
+            except asyncio.CancelledError:
+                # Interrupted reply or the losing hedged request; the connection is released
+                GIGACHAT_REQUESTS.labels("stream", "cancelled").inc()
+                raise
+            except Exception:
+                GIGACHAT_REQUESTS.labels("stream", "error").inc()
+                raise
+        GIGACHAT_REQUESTS.labels("stream", "ok").inc()
+
+    async for content in gigachat_resilience.stream(attempt, admission):
+        yield content
+
+
+async def _stream_gigachat_completion(
+    token: str, giga_messages: list, session_id: Optional[str] = None, on_usage=None
+):
+    """Yield content deltas; the usage sent with the last chunk is passed to on_usage."""
+    async with http_pool.post(
+        f"{GIGACHAT_API_URL}/chat/completions",
+        headers=_gigachat_headers(token, session_id, stream=True),
+        json={
+            "model": "GigaChat",
+            "messages": giga_messages,
+            "temperature": 0.7,
+            "max_tokens": 1024,
+            "stream": True,
+        },
+        ssl=False,
+        timeout=http_pool.stream_timeout,
+    ) as resp:
+        if resp.status != 200:
+            error_text = await resp.text()
+            raise _api_error(resp.status, error_text, resp.headers)
+
+        # SSE body: "data: {json}" lines separated by blank lines, terminated by "data: [DONE]"
+        async for raw_line in resp.content:
+            line = raw_line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            try:
+                chunk = json.loads(payload)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed GigaChat SSE chunk: {payload[:100]}")
+                continue
+            if chunk.get("usage") and on_usage is not None:
+                on_usage(chunk["usage"])
+            for choice in chunk.get("choices", []):
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+
+async def summarize_conversation(visit_id: str, previous_summary: str, messages: list) -> str:
+    """Fold older turns of a visit into a short running summary (runs off the reply path)."""
+    transcript = "\n".join(
+        f"{'Врач' if m['role'] == 'assistant' else 'Медицинский представитель'}: {m['content']}"
+        for m in messages
+    )
+    prompt = (
+        "Обнови краткое содержание разговора врача с медицинским представителем. "
+        "Сохрани упомянутые препараты, факты, вопросы врача и договорённости. "
+        "Пиши кратко, от третьего лица, не более нескольких предложений.\n\n"
+        f"Текущее содержание:\n{previous_summary or '(пусто)'}\n\n"
+        f"Новые реплики:\n{transcript}"
+    )
+    return await call_gigachat_api(
+        messages=[{"role": "user", "content": prompt}],
+        system_prompt="Ты составляешь краткие содержания диалогов.",
+        visit_id=visit_id,
+        max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+        priority="background",
+        # Its own session: the summary prompt does not share the visit's prefix
+        session_id=f"{visit_id}:summary",
+    )
+
+
+def message_key(visit_id: str, role: str, ordinal: int, content: str) -> str:
+    """Stable idempotency key for the Nth message of a role in a visit transcript."""
+    raw = f"{visit_id}\n{role}\n{ordinal}\n{content.strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+async def save_message_to_db(
+    visit_id: str,
+    role: str,
+    content: str,
+    key: Optional[str] = None,
+    metadata: Optional[dict] = None,
+):
+    """Queue conversation message for saving to database via Next.js API.
+
+    Returns immediately: messages are written behind by message_journal in per-visit batches.
+    """
+    metadata = {"source": "livekit-agent", **(metadata or {})}
+    if key:
+        metadata["messageKey"] = key
+    message_journal.enqueue(visit_id, role, content, metadata)
+
+
+async def get_visit_messages(visit_id: str) -> list:
+    """Get already persisted transcript of a visit (oldest first)."""
+    service_token = os.getenv("AGENT_SERVICE_TOKEN")
+    headers = {}
+    if service_token:
+        headers["x-service-token"] = service_token
+
+    async with http_pool.get(
+        f"{NEXTJS_API_URL}/api/visits/{visit_id}/messages",
+        headers=headers,
+    ) as resp:
+        if resp.status != 200:
+            error_text = await resp.text()
+            raise Exception(f"Failed to get visit messages: {resp.status} - {error_text}")
+
+        data = await resp.json()
+        # API returns newest first
+        return list(reversed(data.get("messages", [])))
 
 
-async def get_visit_data(visit_id: str) -> dict:
-    """Get visit and doctor data from Next.js API."""
+DEFAULT_DOCTOR_PROMPT = "Ты опытный врач. Веди профессиональную беседу с медицинским представителем на русском языке."
+
+async def get_visit_data(visit_id: str, use_cache: bool = True) -> dict:
+    """Get visit and doctor data from Next.js API (cached on the worker host)."""
+    if use_cache:
+        cached = await asyncio.to_thread(visit_cache.visit_payloads.get, visit_id)
+        if cached is not None:
+            return cached
+
     # Use service token if available
     service_token = os.getenv("AGENT_SERVICE_TOKEN")
     headers = {}
     if service_token:
         headers["x-service-token"] = service_token
     
-    async with aiohttp.ClientSession() as session:
-        # Try agent endpoint first, fallback to regular endpoint
-        async with session.get(
+    # Try agent endpoint first, fallback to regular endpoint
+    data = None
+    # Remembered once the agent endpoint is known to be missing, so later jobs skip the 404 round-trip
+    if not await asyncio.to_thread(visit_cache.api_flags.get, "agent_endpoint_missing"):
+        async with http_pool.get(
             f"{NEXTJS_API_URL}/api/visits/{visit_id}/agent",
             headers=headers,
         ) as resp:
-            if resp.status == 404:
-                # Fallback to regular endpoint
-                async with session.get(f"{NEXTJS_API_URL}/api/visits/{visit_id}") as fallback_resp:
-                    if fallback_resp.status != 200:
-                        error_text = await fallback_resp.text()
-                        raise Exception(f"Failed to get visit data: {fallback_resp.status} - {error_text}")
-                    return await fallback_resp.json()
-            
-            if resp.status != 200:
+            if resp.status == 404 and "Visit not found" not in await resp.text():
+                await asyncio.to_thread(visit_cache.api_flags.set, "agent_endpoint_missing", True)
+            elif resp.status != 200:
                 error_text = await resp.text()
                 raise Exception(f"Failed to get visit data: {resp.status} - {error_text}")
-            
-            return await resp.json()
+            else:
+                data = await resp.json()
+
+    if data is None:
+        # Fallback to regular endpoint
+        async with http_pool.get(f"{NEXTJS_API_URL}/api/visits/{visit_id}") as fallback_resp:
+            if fallback_resp.status != 200:
+                error_text = await fallback_resp.text()
+                raise Exception(f"Failed to get visit data: {fallback_resp.status} - {error_text}")
+            data = await fallback_resp.json()
+
+    # Agent endpoint wraps the payload as {"visit": {...}}
+    visit = data.get("visit", data)
+    await asyncio.to_thread(visit_cache.remember_visit, visit_id, visit)
+    return visit
+
+
+async def resolve_doctor(visit_id: str, metadata: dict) -> dict:
+    """Resolve the doctor persona without HTTP when the dispatcher embedded it or it is cached."""
+    embedded_visit = metadata.get("visit")
+    if embedded_visit:
+        return await asyncio.to_thread(visit_cache.remember_visit, visit_id, embedded_visit)
+
+    doctor = await asyncio.to_thread(visit_cache.cached_doctor, metadata.get("doctor_id"), metadata.get("doctor_version"))
+    if doctor is not None:
+        return doctor
+
+    visit = await get_visit_data(visit_id)
+    return visit_cache.normalize_doctor(visit.get("doctor"))
+
+
+def build_system_prompt(doctor_name: str, doctor: dict) -> str:
+    """Build (or reuse the precompiled) system prompt for a doctor persona."""
+    cache_key = (doctor.get("id"), doctor.get("updated_at"), doctor_name)
+    if doctor.get("id"):
+        cached = visit_cache.system_prompts.get(cache_key)
+        if cached is not None:
+            return cached
+
+    system_prompt = f"""{doctor.get("prompt_template") or DEFAULT_DOCTOR_PROMPT}
+
+Ты - {doctor_name}, опытный врач. Веди профессиональную беседу с медицинским представителем.
+Отвечай на русском языке, будь вежливым но требовательным к деталям.
+Фокусируйся на медицинских аспектах препаратов и лечения.
+
+Тип личности: {doctor.get("personality_type", "rational")}
+Уровень эмпатии: {doctor.get("empathy_level", 5)}/10
+
+Будь естественным в разговоре, задавай вопросы о препаратах, их применении и эффективности."""
+
+    if doctor.get("id"):
+        visit_cache.system_prompts.set(cache_key, system_prompt)
+    return system_prompt
+
+
+def parse_job_metadata(ctx: JobContext) -> dict:
+    """Merge room metadata (automatic dispatch) with job metadata (explicit dispatch)."""
+    metadata = {}
+    room = getattr(ctx.job, "room", None)
+    for raw in (getattr(room, "metadata", None), ctx.job.metadata):
+        if not raw:
+            continue
+        try:
+            parsed = json.loads(raw) if isinstance(raw, str) else raw
+        except (TypeError, ValueError):
+            continue
+        if isinstance(parsed, dict):
+            metadata.update(parsed)
+
+    # Room metadata written by the Next.js dispatcher uses camelCase
+    if "visitId" in metadata and "visit_id" not in metadata:
+        metadata["visit_id"] = metadata["visitId"]
+    return metadata
 
 
 class GigaChatLLM(llm.LLM):
     """Custom LLM implementation using GigaChat API."""
     
-    def __init__(self, visit_id: str, doctor_prompt: str, *args, **kwargs):
+    def __init__(self, visit_id: str, doctor_prompt: str, *args, streaming: bool = GIGACHAT_STREAM, **kwargs):
         super().__init__(*args, **kwargs)
         self.visit_id = visit_id
         self.doctor_prompt = doctor_prompt
-        self.conversation_history: list = []
-    
-    async def chat(
-        self,
-        chat_ctx: llm.ChatContext,
-        fnc_ctx: Optional[llm.FunctionContext] = None,
-        fnc_ctx_fill_mode: Optional[llm.FunctionContext.FillMode] = None,
-    ) -> Annotated[llm.ChatContext, "messages"]:
-        """Generate response using GigaChat."""
-        
-        # Convert chat context to GigaChat format
+        self.streaming = streaming
+        # Only recent replies are kept here; older context lives in the running summary
+        self.conversation_history: deque = deque(maxlen=CONTEXT_KEEP_RECENT)
+        self.context_window = ContextWindow(
+            summarize=lambda summary, messages: summarize_conversation(visit_id, summary, messages),
+        )
+        # Persistence watermark: how many messages of each role are already saved,
+        # plus their idempotency keys, so every message is written exactly once
+        self._persisted_counts = {"user": 0, "assistant": 0}
+        self._persisted_keys: set = set()
+        # Per-turn latency spans, set by the entrypoint for live sessions
+        self.tracer: Optional[TurnTracer] = None
+        # Replies started before the turn is committed (GIGACHAT_SPECULATIVE), set by the entrypoint
+        self.speculation: Optional[SpeculativeGenerator] = None
+        # In a live session replies are saved once played out (on_reply_spoken), so an
+        # interrupted reply is saved only up to where the rep cut in
+        self.persist_spoken_replies = False
+        self._fallback_pending = False
+
+    def _mark(self, stage: str):
+        if self.tracer is not None:
+            self.tracer.mark(stage)
+
+    async def restore_transcript(self) -> list:
+        """Load the saved transcript (e.g. after a reconnect) and advance the watermark past it."""
+        try:
+            saved = await get_visit_messages(self.visit_id)
+        except Exception as e:
+            logger.warning(f"Failed to restore transcript: {e}")
+            return []
+
+        history = []
+        for msg in saved:
+            role = msg.get("role")
+            content = msg.get("content") or ""
+            if role not in self._persisted_counts or not content:
+                continue
+            ordinal = self._persisted_counts[role]
+            self._persisted_keys.add(message_key(self.visit_id, role, ordinal, content))
+            self._persisted_counts[role] = ordinal + 1
+            history.append({"role": role, "content": content})
+            if role == "assistant":
+                self.conversation_history.append({"role": role, "content": content})
+
+        if history:
+            logger.info(f"Restored {len(history)} transcript messages for visit {self.visit_id}")
+        return history
+
+    async def _persist(self, role: str, ordinal: int, content: str, metadata: Optional[dict] = None):
+        """Save the Nth message of a role unless it has already been persisted."""
+        if ordinal < self._persisted_counts[role]:
+            return
+        self._persisted_counts[role] = ordinal + 1
+        key = message_key(self.visit_id, role, ordinal, content)
+        if key in self._persisted_keys:
+            return
+        self._persisted_keys.add(key)
+        await save_message_to_db(self.visit_id, role, content, key=key, metadata=metadata)
+
+    def _collect_messages(self, chat_ctx: llm.ChatContext) -> list:
+        """Convert chat context to GigaChat messages (nothing is persisted).
+
+        System/developer items (the agent instructions) are skipped: the context window sends
+        the doctor prompt as the single system message, so the prefix stays byte-identical
+        between turns and GigaChat can reuse its cached computation.
+        """
         messages = []
-        for msg in chat_ctx.messages:
-            if isinstance(msg, llm.ChatMessage):
-                role = "assistant" if msg.role == llm.ChatRole.ASSISTANT else "user"
-                content = msg.content or ""
-                messages.append({"role": role, "content": content})
-                
-                # Save user messages to DB when they appear in chat context
-                if msg.role == llm.ChatRole.USER and content:
-                    await save_message_to_db(self.visit_id, "user", content)
-                    print(f"User message saved: {content[:50]}...")
-        
-        # Call GigaChat API
-        response_text = await call_gigachat_api(
-            messages=messages,
+        for msg in chat_ctx.items:
+            if isinstance(msg, llm.ChatMessage) and msg.role in ("user", "assistant"):
+                messages.append({"role": msg.role, "content": msg.text_content or ""})
+        return messages
+
+    async def _prepare_messages(self, chat_ctx: llm.ChatContext) -> list:
+        """Convert chat context to GigaChat format, bounded by the context window."""
+        user_ordinal = 0
+        for msg in chat_ctx.items:
+            if isinstance(msg, llm.ChatMessage) and msg.role == "user":
+                content = msg.text_content or ""
+                # Save user messages past the watermark; earlier ones were saved on previous turns
+                if content:
+                    if user_ordinal >= self._persisted_counts["user"]:
+                        await self._persist("user", user_ordinal, content)
+                        logger.debug(f"User message saved: {content[:50]}...")
+                    user_ordinal += 1
+
+        # Recent turns verbatim, older ones as a running summary in the system message
+        return self.context_window.build(self._collect_messages(chat_ctx), self.doctor_prompt)
+
+    def _speculate(self, messages: list):
+        """Stream a reply for a transcript that is not committed yet (see speculation.py)."""
+        return stream_gigachat_api(
+            messages=self.context_window.build(messages, self.doctor_prompt),
             system_prompt=self.doctor_prompt,
             visit_id=self.visit_id,
         )
-        
+
+    def _take_speculative(self, chat_ctx: llm.ChatContext):
+        """Tokens of a matching speculative reply for this turn, or None."""
+        if self.speculation is None:
+            return None
+        return self.speculation.take(self._collect_messages(chat_ctx))
+
+    async def _on_response(self, response_text: str):
+        """Persist a completed assistant reply (unless it is saved once spoken)."""
+        if self.persist_spoken_replies:
+            return
+        await self._save_reply(response_text)
+
+    async def on_reply_spoken(self, text: str, interrupted: bool):
+        """Persist the part of a reply that was actually played out (live sessions)."""
+        if self._fallback_pending:
+            # The canned "one moment" reply is not a doctor reply
+            self._fallback_pending = False
+            return
+        if text:
+            await self._save_reply(text, {"interrupted": True} if interrupted else None)
+
+    async def _save_reply(self, text: str, metadata: Optional[dict] = None):
         # Save assistant message to DB
-        await save_message_to_db(self.visit_id, "assistant", response_text)
+        await self._persist("assistant", self._persisted_counts["assistant"], text, metadata)
+        self._mark("persisted")
         
         # Add to conversation history
-        self.conversation_history.append({"role": "assistant", "content": response_text})
-        
-        # Return as ChatContext
-        chat_ctx.messages.append(
-            llm.ChatMessage(
-                role=llm.ChatRole.ASSISTANT,
-                content=response_text,
+        self.conversation_history.append({"role": "assistant", "content": text})
+
+    def _fallback(self, error: Exception) -> str:
+        self._fallback_pending = self.persist_spoken_replies
+        return gigachat_resilience.fallback(error)
+
+    def chat(
+        self,
+        *,
+        chat_ctx: llm.ChatContext,
+        tools: Optional[list] = None,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+        **kwargs,
+    ):
+        """Generate response using GigaChat.
+
+        Always returns a GigaChatLLMStream: in streaming mode it yields tokens as they arrive,
+        otherwise the whole reply of one non-streaming request as a single chunk.
+        """
+        return GigaChatLLMStream(self, chat_ctx=chat_ctx, conn_options=conn_options)
+
+    async def _complete(self, messages: list):
+        """The reply of one non-streaming request, as a one-chunk token stream."""
+        yield await call_gigachat_api(
+            messages=messages,
+            system_prompt=self.doctor_prompt,
+            visit_id=self.visit_id,
+        )
+
+
+class GigaChatLLMStream(llm.LLMStream):
+    """Streams GigaChat tokens into the agents pipeline as they are generated (or the whole reply)."""
+
+    def __init__(self, llm_instance: GigaChatLLM, *, chat_ctx: llm.ChatContext, conn_options: APIConnectOptions):
+        super().__init__(llm_instance, chat_ctx=chat_ctx, tools=[], conn_options=conn_options)
+        self._giga_llm = llm_instance
+
+    async def _run(self):
+        messages = await self._giga_llm._prepare_messages(self._chat_ctx)
+        # A reply already streaming since the end of speech, if it matches this turn
+        tokens = self._giga_llm._take_speculative(self._chat_ctx)
+        request_id = str(uuid.uuid4())
+        parts = []
+
+        try:
+            self._giga_llm._mark("llm_request")
+            if tokens is None and self._giga_llm.streaming:
+                tokens = stream_gigachat_api(
+                    messages=messages,
+                    system_prompt=self._giga_llm.doctor_prompt,
+                    visit_id=self._giga_llm.visit_id,
+                )
+            elif tokens is None:
+                tokens = self._giga_llm._complete(messages)
+            async for token in tokens:
+                if not parts:
+                    self._giga_llm._mark("llm_first_token")
+                parts.append(token)
+                self._send(request_id, token)
+        except asyncio.CancelledError:
+            # Barge-in: the pipeline cancels the reply; the GigaChat request is aborted below
+            # and only what was played out is saved (GigaChatLLM.on_reply_spoken)
+            logger.debug(f"GigaChat reply cancelled after {len(parts)} chunks")
+            raise
+        except Exception as e:
+            if not parts:
+                # Canned "one moment" reply instead of silence; it is not saved as a doctor reply
+                self._send(request_id, self._giga_llm._fallback(e))
+                return
+            # The part already spoken is kept as the reply
+            logger.error(f"GigaChat stream broke off after {len(parts)} chunks: {e}")
+        finally:
+            await tokens.aclose()
+
+        self._giga_llm._mark("llm_done")
+        await self._giga_llm._on_response("".join(parts))
+
+    def _send(self, request_id: str, content: str):
+        self._event_ch.send_nowait(
+            llm.ChatChunk(
+                id=request_id,
+                delta=llm.ChoiceDelta(role="assistant", content=content),
             )
         )
-        
-        return chat_ctx
+
+
+def load_plugins():
+    """Import the provider plugins of the configured backends.
+
+    Plugins are not imported with this module, so processes that never build a session
+    (the worker's main process, batch evaluation, tools) do not pay for them. LiveKit
+    requires plugins to be registered on the main thread; prewarm() calls this there.
+    """
+    from livekit.plugins import silero  # noqa: F401  (VAD)
+
+    if USE_OPENAI_STT or not (USE_SILERO_TTS and silero_tts_available()):
+        from livekit.plugins import openai  # noqa: F401
+
+
+def create_stt() -> stt.STT:
+    """Create the (non-streaming) STT instance; see gate_stt for live sessions."""
+    from livekit.plugins import openai
+
+    # Setup STT according to LiveKit Agents documentation
+    # https://docs.livekit.io/agents/models/
+    if USE_OPENAI_STT:
+        return openai.STT(language="ru")
+    # Use default STT or another provider
+    return openai.STT(language="ru")
+
+
+def gate_stt(stt_instance: stt.STT, vad) -> stt.STT:
+    """Upload only VAD speech segments of the rep's audio to the STT (see stt_gate.py)."""
+    if not STT_VAD_GATE or stt_instance.capabilities.streaming:
+        return stt_instance
+    return VADGatedSTT(stt_instance, vad)
+
+
+def create_tts() -> tts.TTS:
+    """Create the TTS instance for Russian language, adapted for sentence-level streaming."""
+    voice, model = "nova", "tts-1"
+    if USE_SILERO_TTS and silero_tts_available():
+        # Local Silero TTS; synthesis runs in the inference pool, off the event loop
+        tts_instance = SileroTTS()
+        voice, model = tts_instance.speaker, f"silero-{SILERO_TTS_MODEL}"
+    else:
+        if USE_SILERO_TTS:
+            logger.info("Silero TTS not available (torch is not installed), using OpenAI TTS")
+        from livekit.plugins import openai
+
+        # OpenAI TTS (supports Russian)
+        tts_instance = openai.TTS(voice=voice, model=model)
+    return adapt_tts(tts_instance, voice=voice, model=model)
+
+
+def adapt_tts(tts_instance: tts.TTS, voice: str, model: str) -> tts.TTS:
+    """Wrap a TTS with the audio cache and sentence-level streaming."""
+    # Serve repeated phrases (greetings, clarifying questions) from the on-disk audio cache
+    if TTS_CACHE_ENABLED:
+        tts_instance = CachedTTS(tts_instance, voice=voice, model=model)
+    
+    # Hand the streamed reply to TTS sentence by sentence, so synthesis of the first
+    # sentence starts while GigaChat is still generating the rest
+    if not tts_instance.capabilities.streaming:
+        tts_instance = tts.StreamAdapter(
+            tts=tts_instance,
+            sentence_tokenizer=tokenize.basic.SentenceTokenizer(
+                language="russian",
+                min_sentence_len=TTS_MIN_SENTENCE_LEN,
+            ),
+        )
+    return tts_instance
+
+
+def create_vad():
+    """Load the VAD (Voice Activity Detection) model; its streams share the inference pool threads."""
+    from livekit.plugins import silero
+
+    return use_shared_vad_executor(silero.VAD.load(**vad_options()))
+
+
+def find_wrapped_tts(tts_instance: tts.TTS, cls: type) -> Optional[tts.TTS]:
+    """Find a TTS of the given class inside the StreamAdapter / CachedTTS wrappers."""
+    while tts_instance is not None and not isinstance(tts_instance, cls):
+        # StreamAdapter keeps the wrapped TTS in _wrapped_tts, CachedTTS in _wrapped
+        tts_instance = getattr(tts_instance, "_wrapped_tts", None) or getattr(tts_instance, "_wrapped", None)
+    return tts_instance
+
+
+def presynthesize_opening_lines(tts_instance: tts.TTS, doctor_name: str):
+    """Warm the TTS cache with phrases a doctor is likely to say, in the background."""
+    cached_tts = find_wrapped_tts(tts_instance, CachedTTS)
+    if cached_tts is None:
+        return
+    lines = [f"Здравствуйте, я {doctor_name}.", *COMMON_DOCTOR_PHRASES, GIGACHAT_FALLBACK_REPLY]
+    asyncio.create_task(cached_tts.presynthesize(lines))
+
+
+def prewarm(proc: JobProcess):
+    """Load VAD and TTS models once per worker process; jobs reuse them from proc.userdata."""
+    started = time.perf_counter()
+    proc.userdata["prewarm_started"] = started
+    load_plugins()
+    proc.userdata["vad"] = create_vad()
+    proc.userdata["tts"] = create_tts()
+    # One Silero model copy per process, loaded on its inference thread without holding up
+    # process initialization; a synthesis request arriving earlier queues behind the load
+    if find_wrapped_tts(proc.userdata["tts"], SileroTTS) is not None:
+        inference_pool.warmup("silero_tts", wait=False)
+    proc.userdata["prewarm_finished"] = time.perf_counter()
+    logger.info(f"Worker process prewarmed in {proc.userdata['prewarm_finished'] - started:.3f}s")
 
 
 async def entrypoint(ctx: JobContext):
     """Main entry point for the agent."""
-    print(f"Doctor Agent starting for job: {ctx.job.id}, room: {ctx.job.room_name}")
+    logger.info(f"Doctor Agent starting for job: {ctx.job.id}, room: {ctx.job.room_name}")
+    # Cold vs warm start: was this process idle with its models loaded before the job came?
+    start_timer = JobStartTimer.for_process(ctx.proc.userdata)
+
+    # Share the process-wide HTTP pool and message journal; they are flushed and
+    # closed when the last job shuts down
+    http_pool.acquire()
+    message_journal.acquire()
+    # Get the GigaChat token while the room is being set up, not on the first turn
+    gigachat_tokens.start()
+
+    async def _shutdown():
+        process_load.session_ended()
+        if process_load.active_sessions == 0:
+            await process_load.aclose()
+        await message_journal.release()
+        await gigachat_tokens.aclose()
+        logger.info(f"HTTP pool stats: {http_pool.stats()}")
+        logger.info(f"Job start stats: {startup_stats.snapshot()}")
+        logger.info(f"Inference stats: {inference_pool.stats()}")
+        await http_pool.release()
+
+    ctx.add_shutdown_callback(_shutdown)
+    # Reported to the worker's load function (see load_control.py)
+    process_load.session_started()
     
     # Extract metadata from job or environment
-    # For direct dispatch, metadata comes from job.metadata
+    # For direct dispatch, metadata comes from job.metadata (or room metadata)
     # For environment-based dispatch, use environment variables
-    metadata_str = ctx.job.metadata or "{}"
-    try:
-        if isinstance(metadata_str, str):
-            metadata = json.loads(metadata_str)
-        else:
-            metadata = metadata_str
-    except:
-        metadata = {}
+    metadata = parse_job_metadata(ctx)
     
     visit_id = metadata.get("visit_id") or os.getenv("VISIT_ID")
     doctor_name = metadata.get("doctor_name") or os.getenv("DOCTOR_NAME", "Доктор")
@@ -246,69 +824,30 @@ async def entrypoint(ctx: JobContext):
     if not visit_id:
         raise ValueError("visit_id is required in job metadata or VISIT_ID environment variable")
     
-    # Get visit and doctor data
+    # Get doctor data: embedded by the dispatcher, cached on this host, or fetched
     try:
-        visit_data = await get_visit_data(visit_id)
-        doctor_data = visit_data.get("doctor", {})
-        doctor_prompt = doctor_data.get("prompt_template", "")
-        personality = doctor_data.get("personality_type", "rational")
-        empathy_level = doctor_data.get("empathy_level", 5)
+        doctor = await resolve_doctor(visit_id, metadata)
     except Exception as e:
-        print(f"Warning: Failed to load visit data: {e}")
-        doctor_prompt = "Ты опытный врач. Веди профессиональную беседу с медицинским представителем на русском языке."
+        logger.warning(f"Failed to load visit data: {e}")
+        doctor = visit_cache.normalize_doctor(None)
     
-    # Build system prompt
-    system_prompt = f"""{doctor_prompt}
-
-Ты - {doctor_name}, опытный врач. Веди профессиональную беседу с медицинским представителем.
-Отвечай на русском языке, будь вежливым но требовательным к деталям.
-Фокусируйся на медицинских аспектах препаратов и лечения.
-
-Тип личности: {personality}
-Уровень эмпатии: {empathy_level}/10
-
-Будь естественным в разговоре, задавай вопросы о препаратах, их применении и эффективности."""
+    # Build system prompt (the prompt cache reads files, so off the event loop)
+    system_prompt = await asyncio.to_thread(build_system_prompt, doctor_name, doctor)
     
     # Connect to room (room_name is already set in job context)
     # AutoSubscribe.AUDIO_ONLY означает, что агент автоматически подписывается на все аудио треки
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
-    print(f"Connected to room: {ctx.room.name}")
-    print(f"Waiting for participants to join and publish audio tracks...")
-    
-    # Setup STT according to LiveKit Agents documentation
-    # https://docs.livekit.io/agents/models/
-    if USE_OPENAI_STT:
-        stt_instance = openai.STT(language="ru")
-    else:
-        # Use default STT or another provider
-        stt_instance = openai.STT(language="ru")
-    
-    # Setup TTS for Russian language
-    # Note: Silero plugin may not expose TTS directly in v1.2.17+
-    # Using OpenAI TTS for now, which supports Russian well
-    if USE_SILERO_TTS:
-        # Try to use Silero if available, fallback to OpenAI
-        try:
-            # Check if Silero has TTS class (API may have changed)
-            if hasattr(silero, 'TTS'):
-                tts_instance = silero.TTS(
-                    voice="aidar",
-                    sample_rate=24000,
-                    speaker="ru",
-                )
-            else:
-                # Fallback to OpenAI TTS (supports Russian)
-                print("Silero TTS not available, using OpenAI TTS")
-                tts_instance = openai.TTS(voice="nova", model="tts-1")
-        except Exception as e:
-            print(f"Failed to initialize Silero TTS: {e}, using OpenAI TTS")
-            tts_instance = openai.TTS(voice="nova", model="tts-1")
-    else:
-        # OpenAI TTS (supports Russian)
-        tts_instance = openai.TTS(voice="nova", model="tts-1")
+    logger.info(f"Connected to room: {ctx.room.name}")
+    logger.info(f"Waiting for participants to join and publish audio tracks...")
     
-    # Setup VAD (Voice Activity Detection)
-    vad = openai.VAD.load()
+    # STT/TTS/VAD: reuse the instances loaded by prewarm() for this process when present
+    tts_instance = ctx.proc.userdata.get("tts") or create_tts()
+    vad = ctx.proc.userdata.get("vad") or create_vad()
+    # One gated STT per session: its counters are this visit's audio/endpointing stats
+    stt_instance = gate_stt(create_stt(), vad)
+    start_timer.mark("models_ready")
+    if TTS_PRESYNTHESIZE:
+        presynthesize_opening_lines(tts_instance, doctor_name)
     
     # Create custom LLM with GigaChat
     # Using custom LLM implementation since GigaChat is not in standard plugins
@@ -316,6 +855,10 @@ async def entrypoint(ctx: JobContext):
         visit_id=visit_id,
         doctor_prompt=system_prompt,
     )
+    tracer = TurnTracer(visit_id, doctor.get("personality_type"))
+    custom_llm.tracer = tracer
+    # Save replies as played out: an interrupted reply is saved only up to the barge-in
+    custom_llm.persist_spoken_replies = True
     
     # Use AgentSession according to new LiveKit Agents documentation
     # https://docs.livekit.io/agents/build/
@@ -325,12 +868,31 @@ async def entrypoint(ctx: JobContext):
         llm=custom_llm,
         tts=tts_instance,
         vad=vad,
+        # The built-in preemptive generation would call GigaChatLLM.chat (which saves the
+        # user message) for turns that may still be discarded; see speculation.py instead
+        preemptive_generation=False,
+        min_endpointing_delay=AGENT_MIN_ENDPOINTING_DELAY,
+        max_endpointing_delay=AGENT_MAX_ENDPOINTING_DELAY,
     )
     
+    # Restore an already saved transcript (reconnect / restarted job), so the doctor keeps
+    # the conversation and previously saved messages are not written again
+    initial_ctx = llm.ChatContext()
+    for msg in await custom_llm.restore_transcript():
+        initial_ctx.add_message(role=msg["role"], content=msg["content"])
+    
     # Create agent with instructions
     agent = Agent(
         instructions=system_prompt,
+        chat_ctx=initial_ctx,
     )
+    if GIGACHAT_SPECULATIVE:
+        # Start the reply on the final transcript while end-of-turn detection still waits
+        custom_llm.speculation = SpeculativeGenerator(
+            custom_llm._speculate,
+            context=lambda: custom_llm._collect_messages(agent.chat_ctx),
+        )
+    speculation = custom_llm.speculation
     
     # Start the session
     # AgentSession automatically handles:
@@ -344,22 +906,71 @@ async def entrypoint(ctx: JobContext):
         room_input_options=RoomInputOptions(),
     )
     
-    # Messages are automatically saved in GigaChatLLM.chat() method:
-    # - User messages: saved when they appear in chat context
-    # - Assistant messages: saved after GigaChat generates response
-    print("Agent session started")
+    # Messages are automatically queued in GigaChatLLM.chat() method and written
+    # behind by message_journal (the reply never waits on the Next.js API):
+    # - User messages: queued when they appear in chat context
+    # - Assistant messages: queued after GigaChat generates response
+    start_timer.mark("session_started")
+    logger.info("Agent session started")
+
+    @session.on("agent_state_changed")
+    def _on_agent_state_changed(ev):
+        if ev.new_state == "speaking":
+            start_timer.mark_first_audio()
+            tracer.mark("playout_start")
+
+    # Per-turn latency spans (see telemetry.py)
+    @session.on("user_state_changed")
+    def _on_user_state_changed(ev):
+        if ev.old_state == "speaking" and ev.new_state == "listening":
+            tracer.mark("end_of_speech")
+            if speculation is not None:
+                speculation.on_end_of_speech()
+        elif ev.new_state == "speaking" and speculation is not None:
+            speculation.on_start_of_speech()
+
+    @session.on("user_input_transcribed")
+    def _on_user_input_transcribed(ev):
+        if ev.is_final:
+            tracer.mark("stt_final")
+        if speculation is not None:
+            speculation.on_transcript(ev.transcript, ev.is_final)
+
+    @session.on("conversation_item_added")
+    def _on_conversation_item_added(ev):
+        item = ev.item
+        if isinstance(item, llm.ChatMessage) and item.role == "assistant":
+            asyncio.create_task(_on_reply_spoken(item))
+
+    async def _on_reply_spoken(item: llm.ChatMessage):
+        # The reply is saved once played out, so the turn's span closes after the save
+        await custom_llm.on_reply_spoken(item.text_content or "", item.interrupted)
+        tracer.finish()
+
+    @session.on("metrics_collected")
+    def _on_metrics_collected(ev):
+        if isinstance(ev.metrics, TTSMetrics) and ev.metrics.ttfb >= 0:
+            tracer.record("tts_ttfb", ev.metrics.ttfb)
     
     # Keep agent alive while room is active
-    print("Waiting for conversation...")
+    logger.info("Waiting for conversation...")
     
     try:
         await ctx.wait_for_disconnect()
-        print("Agent disconnected from room")
+        logger.info("Agent disconnected from room")
     except Exception as e:
-        print(f"Error in agent loop: {e}")
+        logger.error(f"Error in agent loop: {e}")
     finally:
         await session.aclose()
-        print("Agent cleaned up")
+        await custom_llm.context_window.aclose()
+        if speculation is not None:
+            await speculation.aclose()
+            logger.info(f"Speculative generation stats: {speculation.stats()}")
+        if isinstance(stt_instance, VADGatedSTT):
+            logger.info(f"STT audio stats: {stt_instance.stats()}")
+        # Persist whatever this visit still has queued before the job goes away
+        await message_journal.flush(visit_id)
+        logger.info("Agent cleaned up")
 
 
 if __name__ == "__main__":
@@ -367,5 +978,5 @@ if __name__ == "__main__":
     # Usage:
     #   python doctor_agent.py dev --room <room_name>  # Connect directly to room
     #   python doctor_agent.py start                    # Run as worker
-    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
+    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
 
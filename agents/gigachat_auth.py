@@ -0,0 +1,257 @@
+"""
+GigaChat OAuth token manager.
+Deduplicates concurrent refreshes, refreshes the token in the background before it
+expires and shares it between worker processes on the host via a locked cache file.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process single-flight only
+    fcntl = None
+
+from http_pool import http_pool
+from metrics import GIGACHAT_TOKEN_REFRESHES
+
+logger = logging.getLogger("shadowmed.gigachat_auth")
+
+GIGACHAT_OAUTH_URL = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+GIGACHAT_AUTHORIZATION_KEY = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
+GIGACHAT_SCOPE = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
+# Refresh this many seconds before the token expires
+GIGACHAT_TOKEN_REFRESH_MARGIN = float(os.getenv("GIGACHAT_TOKEN_REFRESH_MARGIN", "300"))
+# Shortest pause between background refreshes, whatever the token lifetime
+GIGACHAT_TOKEN_MIN_REFRESH_INTERVAL = float(os.getenv("GIGACHAT_TOKEN_MIN_REFRESH_INTERVAL", "5"))
+GIGACHAT_TOKEN_CACHE_DIR = os.getenv("GIGACHAT_TOKEN_CACHE_DIR", tempfile.gettempdir())
+
+
+def parse_token_expiry(data: dict, now: Optional[float] = None) -> float:
+    """Return the token expiry as a unix timestamp in seconds.
+
+    GigaChat returns `expires_at` as an absolute timestamp in milliseconds; plain OAuth
+    servers return a relative `expires_in` in seconds.
+    """
+    now = time.time() if now is None else now
+    expires_at = data.get("expires_at")
+    if expires_at:
+        expires_at = float(expires_at)
+        if expires_at > 1e12:
+            return expires_at / 1000.0
+        if expires_at > 1e9:
+            return expires_at
+        # Not an absolute timestamp; treat as a duration
+        return now + expires_at
+    return now + float(data.get("expires_in", 1800))
+
+
+class GigaChatTokenManager:
+    """Single-flight, proactively refreshed, cross-process GigaChat token cache."""
+
+    def __init__(
+        self,
+        oauth_url: str = GIGACHAT_OAUTH_URL,
+        authorization_key: Optional[str] = GIGACHAT_AUTHORIZATION_KEY,
+        scope: str = GIGACHAT_SCOPE,
+        refresh_margin: float = GIGACHAT_TOKEN_REFRESH_MARGIN,
+        min_refresh_interval: float = GIGACHAT_TOKEN_MIN_REFRESH_INTERVAL,
+        cache_dir: Optional[str] = GIGACHAT_TOKEN_CACHE_DIR,
+    ):
+        self.oauth_url = oauth_url
+        self.authorization_key = authorization_key
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self.min_refresh_interval = min_refresh_interval
+        self.cache_path = None
+        if cache_dir:
+            # One cache file per credential/scope pair
+            key_hash = hashlib.sha256(f"{authorization_key}:{scope}".encode("utf-8")).hexdigest()[:12]
+            self.cache_path = os.path.join(cache_dir, f"shadowmed-gigachat-token-{key_hash}.json")
+        self._token: Optional[str] = None
+        self._expires_at: float = 0
+        self._issued_at: float = 0
+        self._inflight: Optional[asyncio.Future] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refresh_count = 0
+
+    def _margin(self, issued_at: float, expires_at: float) -> float:
+        """Refresh margin, capped at half the lifetime so short-lived tokens are not always stale."""
+        return min(self.refresh_margin, (expires_at - issued_at) / 2)
+
+    def _is_fresh(self, issued_at: float, expires_at: float) -> bool:
+        return time.time() < expires_at - self._margin(issued_at, expires_at)
+
+    async def get_token(self) -> str:
+        """Return a valid access token, refreshing it only when nothing fresh is cached."""
+        if self._token and self._is_fresh(self._issued_at, self._expires_at):
+            self._ensure_background_refresh()
+            return self._token
+
+        cached = self._read_cache()
+        if cached and self._is_fresh(*cached[1:]):
+            self._token, self._issued_at, self._expires_at = cached
+            self._ensure_background_refresh()
+            return self._token
+
+        token = await self.refresh()
+        self._ensure_background_refresh()
+        return token
+
+    def start(self):
+        """Fetch the token ahead of the first request (non-blocking)."""
+        if not (self._token and self._is_fresh(self._issued_at, self._expires_at)):
+            asyncio.ensure_future(self._warm())
+
+    async def _warm(self):
+        try:
+            await self.get_token()
+        except Exception as e:
+            logger.warning(f"Failed to prefetch GigaChat token: {e}")
+
+    async def refresh(self) -> str:
+        """Refresh the token; concurrent callers share one in-flight request."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._refresh_locked())
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh_locked(self) -> str:
+        lock_fd = await self._acquire_file_lock()
+        try:
+            # Another worker may have refreshed while we waited for the lock
+            cached = self._read_cache()
+            if cached and self._is_fresh(*cached[1:]):
+                self._token, self._issued_at, self._expires_at = cached
+                return self._token
+
+            issued_at = time.time()
+            token, expires_at = await self._fetch_token()
+            self._token, self._issued_at, self._expires_at = token, issued_at, expires_at
+            self._write_cache(token, issued_at, expires_at)
+            return token
+        finally:
+            self._release_file_lock(lock_fd)
+
+    async def _fetch_token(self) -> tuple:
+        async with http_pool.post(
+            self.oauth_url,
+            headers={
+                "Authorization": f"Bearer {self.authorization_key}",
+                "Content-Type": "application/x-www-form-urlencoded",
+                "RqUID": str(uuid.uuid4()),
+            },
+            data={"scope": self.scope},
+            ssl=False,
+        ) as resp:
+            if resp.status != 200:
+                GIGACHAT_TOKEN_REFRESHES.labels("error").inc()
+                error_text = await resp.text()
+                raise Exception(f"Failed to get GigaChat token: {resp.status} - {error_text}")
+
+            data = await resp.json()
+            token = data.get("access_token")
+            if not token:
+                # Never cache a missing token: callers would send "Bearer None" until it expires
+                GIGACHAT_TOKEN_REFRESHES.labels("error").inc()
+                raise Exception(f"GigaChat token response has no access_token: {sorted(data)}")
+            self.refresh_count += 1
+            GIGACHAT_TOKEN_REFRESHES.labels("ok").inc()
+            return token, parse_token_expiry(data)
+
+    def _ensure_background_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._background_refresh())
+
+    async def _background_refresh(self):
+        """Keep the token fresh so the OAuth round-trip never lands on a turn."""
+        while True:
+            refresh_at = self._expires_at - self._margin(self._issued_at, self._expires_at)
+            # The floor keeps an already stale or very short-lived token from looping on OAuth
+            await asyncio.sleep(max(self.min_refresh_interval, refresh_at - time.time()))
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Background GigaChat token refresh failed: {e}")
+                await asyncio.sleep(5)
+
+    async def aclose(self):
+        """Stop the background refresh."""
+        task, self._refresh_task = self._refresh_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def _read_cache(self) -> Optional[tuple]:
+        if not self.cache_path:
+            return None
+        try:
+            # Writers replace the file atomically, so readers need no lock
+            with open(self.cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+            expires_at = float(data["expires_at"])
+            # Files written before issued_at was stored: assume the token was just issued
+            issued_at = float(data.get("issued_at", min(time.time(), expires_at)))
+            token = data["access_token"]
+            if not token or not isinstance(token, str):
+                return None
+            return token, issued_at, expires_at
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_cache(self, token: str, issued_at: float, expires_at: float):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"access_token": token, "issued_at": issued_at, "expires_at": expires_at}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to write GigaChat token cache: {e}")
+
+    async def _acquire_file_lock(self) -> Optional[int]:
+        if not self.cache_path or not fcntl:
+            return None
+        try:
+            fd = os.open(f"{self.cache_path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return None
+        # The lock is taken in a thread; if the waiting task is cancelled, the thread may still
+        # get it, so the release is chained to the thread instead of being lost with the task
+        locking = asyncio.ensure_future(asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX))
+        try:
+            await asyncio.shield(locking)
+        except asyncio.CancelledError:
+            locking.add_done_callback(lambda _: self._release_file_lock(fd))
+            raise
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _release_file_lock(self, fd: Optional[int]):
+        if fd is None:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+# Process-wide token manager
+gigachat_tokens = GigaChatTokenManager()
@@ -0,0 +1,329 @@
+"""
+Deadlines, hedged requests, retries and a circuit breaker for GigaChat calls.
+Per-request deadlines follow the observed latency percentiles; a slow request gets a hedged
+twin after the p95 delay (first response wins, the other is cancelled); 429/5xx responses are
+retried with jittered backoff or after the server's Retry-After; and after repeated failures the circuit opens so callers
+answer with a short canned reply instead of waiting on GigaChat.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import aiohttp
+
+from metrics import GIGACHAT_BREAKER_OPEN, GIGACHAT_RESILIENCE_EVENTS, percentile
+
+logger = logging.getLogger("shadowmed.gigachat_resilience")
+
+# Deadline of one attempt: p99 latency x multiplier, clamped to [min, max] seconds.
+# For streams the latency is the time to first token.
+GIGACHAT_TIMEOUT_MIN = float(os.getenv("GIGACHAT_TIMEOUT_MIN", "3"))
+GIGACHAT_TIMEOUT_MAX = float(os.getenv("GIGACHAT_TIMEOUT_MAX", "20"))
+GIGACHAT_TIMEOUT_MULTIPLIER = float(os.getenv("GIGACHAT_TIMEOUT_MULTIPLIER", "3"))
+# Longest pause between two streamed chunks
+GIGACHAT_STREAM_IDLE_TIMEOUT = float(os.getenv("GIGACHAT_STREAM_IDLE_TIMEOUT", "10"))
+GIGACHAT_LATENCY_WINDOW = int(os.getenv("GIGACHAT_LATENCY_WINDOW", "200"))
+# Samples needed before percentiles are trusted (until then: max timeout, no hedging)
+GIGACHAT_LATENCY_MIN_SAMPLES = int(os.getenv("GIGACHAT_LATENCY_MIN_SAMPLES", "20"))
+
+GIGACHAT_HEDGE = os.getenv("GIGACHAT_HEDGE", "true").lower() == "true"
+GIGACHAT_HEDGE_MIN_DELAY = float(os.getenv("GIGACHAT_HEDGE_MIN_DELAY", "0.2"))
+# Upper bound of hedged requests as a share of all requests
+GIGACHAT_HEDGE_MAX_RATIO = float(os.getenv("GIGACHAT_HEDGE_MAX_RATIO", "0.1"))
+
+GIGACHAT_MAX_RETRIES = int(os.getenv("GIGACHAT_MAX_RETRIES", "2"))
+GIGACHAT_RETRY_BASE_DELAY = float(os.getenv("GIGACHAT_RETRY_BASE_DELAY", "0.2"))
+GIGACHAT_RETRY_MAX_DELAY = float(os.getenv("GIGACHAT_RETRY_MAX_DELAY", "2"))
+
+GIGACHAT_BREAKER_FAILURES = int(os.getenv("GIGACHAT_BREAKER_FAILURES", "5"))
+GIGACHAT_BREAKER_COOLDOWN = float(os.getenv("GIGACHAT_BREAKER_COOLDOWN", "15"))
+# Spoken instead of silence while GigaChat is unavailable
+GIGACHAT_FALLBACK_REPLY = os.getenv("GIGACHAT_FALLBACK_REPLY", "Одну минуту, пожалуйста…")
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GigaChatAPIError(Exception):
+    """Error response from the GigaChat API."""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """GigaChat calls are suspended after repeated failures."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, GigaChatAPIError):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+class LatencyTracker:
+    """Rolling window of request latencies with percentile-derived deadline and hedge delay."""
+
+    def __init__(self, window: int = GIGACHAT_LATENCY_WINDOW, min_samples: int = GIGACHAT_LATENCY_MIN_SAMPLES):
+        self.samples: deque = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    @property
+    def ready(self) -> bool:
+        return len(self.samples) >= self.min_samples
+
+    def percentile(self, q: float) -> float:
+        return percentile(list(self.samples), q)
+
+    def deadline(self) -> float:
+        if not self.ready:
+            return GIGACHAT_TIMEOUT_MAX
+        return min(GIGACHAT_TIMEOUT_MAX, max(GIGACHAT_TIMEOUT_MIN, self.percentile(99) * GIGACHAT_TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.ready:
+            return None
+        return max(GIGACHAT_HEDGE_MIN_DELAY, self.percentile(95))
+
+
+class CircuitBreaker:
+    """Opens after N consecutive failures; after the cooldown one trial request is let through."""
+
+    def __init__(self, failure_threshold: int = GIGACHAT_BREAKER_FAILURES, cooldown: float = GIGACHAT_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def check(self):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpenError("GigaChat circuit is open")
+        if state == "half_open":
+            self._trial_in_flight = True
+
+    def end_trial(self):
+        self._trial_in_flight = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("GigaChat circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        GIGACHAT_BREAKER_OPEN.set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"GigaChat circuit opened after {self.failures} consecutive failures")
+            # A failed trial keeps the circuit open for another cooldown
+            self.opened_at = time.monotonic()
+            GIGACHAT_RESILIENCE_EVENTS.labels("breaker_open").inc()
+            GIGACHAT_BREAKER_OPEN.set(1)
+
+
+class GigaChatResilience:
+    """Wraps GigaChat requests of this worker process with deadlines, hedging, retries and a breaker."""
+
+    def __init__(self):
+        self.latency = {"blocking": LatencyTracker(), "stream": LatencyTracker()}
+        self.breaker = CircuitBreaker()
+        self.requests_total = 0
+        self.hedges_total = 0
+        self.hedges_won = 0
+        self.retries_total = 0
+        self.timeouts_total = 0
+        self.fallbacks_total = 0
+
+    def _may_hedge(self) -> bool:
+        return GIGACHAT_HEDGE and self.hedges_total < GIGACHAT_HEDGE_MAX_RATIO * self.requests_total
+
+    async def _race(
+        self,
+        start: Callable[[], Awaitable],
+        tracker: LatencyTracker,
+        deadline: float,
+        discard: Optional[Callable[[object], Awaitable]] = None,
+        admission=None,
+    ):
+        """Run start(), adding a hedged twin after the p95 delay; return the first successful result.
+
+        discard() releases the result of a twin that succeeded at the same moment as the winner.
+        A twin is only sent if the rate limiter has budget for it right away.
+        """
+        started = time.monotonic()
+        primary = asyncio.ensure_future(start())
+        tasks = {primary}
+        hedge_delay = tracker.hedge_delay()
+        try:
+            while True:
+                remaining = deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                hedge_pending = hedge_delay is not None and len(tasks) == 1 and primary in tasks
+                timeout = min(remaining, max(0.0, hedge_delay - (time.monotonic() - started))) if hedge_pending else remaining
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                tasks -= done
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    winner = primary if primary in succeeded else succeeded[0]
+                    tracker.observe(time.monotonic() - started)
+                    if winner is not primary:
+                        self.hedges_won += 1
+                        GIGACHAT_RESILIENCE_EVENTS.labels("hedge_won").inc()
+                    for task in succeeded:
+                        if task is not winner and discard is not None:
+                            await discard(task.result())
+                    return winner.result()
+                if not tasks:
+                    raise next(iter(done)).exception()
+
+                if not done and hedge_pending and self._may_hedge() and (admission is None or admission.try_acquire()):
+                    self.hedges_total += 1
+                    GIGACHAT_RESILIENCE_EVENTS.labels("hedge").inc()
+                    tasks.add(asyncio.ensure_future(start()))
+                elif not done and hedge_pending:
+                    hedge_delay = None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _with_retries(self, start: Callable[[], Awaitable], mode: str, discard=None, admission=None):
+        """Breaker check, deadline and hedging per attempt; retry retryable errors within the max timeout.
+
+        admission (rate_limiter.Admission) is acquired before every attempt; the time spent
+        queueing for it does not count against the deadlines.
+        """
+        self.breaker.check()
+        self.requests_total += 1
+        try:
+            return await self._attempts(start, mode, discard, admission)
+        finally:
+            # A cancelled trial request must not keep a half-open circuit blocked
+            self.breaker.end_trial()
+
+    async def _attempts(self, start: Callable[[], Awaitable], mode: str, discard, admission):
+        started = None
+        attempt = 0
+        while True:
+            if admission is not None:
+                await admission.acquire()
+            if started is None:
+                started = time.monotonic()
+            remaining = GIGACHAT_TIMEOUT_MAX - (time.monotonic() - started)
+            deadline = min(self.latency[mode].deadline(), remaining)
+            try:
+                result = await self._race(start, self.latency[mode], deadline, discard, admission)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts_total += 1
+                    GIGACHAT_RESILIENCE_EVENTS.labels("timeout").inc()
+                delay = self._backoff(e, attempt)
+                if (
+                    not is_retryable(e)
+                    or attempt >= GIGACHAT_MAX_RETRIES
+                    or time.monotonic() - started + delay >= GIGACHAT_TIMEOUT_MAX
+                ):
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                self.retries_total += 1
+                GIGACHAT_RESILIENCE_EVENTS.labels("retry").inc()
+                logger.warning(f"GigaChat {mode} request failed ({str(e) or type(e).__name__}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _backoff(self, error: BaseException, attempt: int) -> float:
+        """Full-jitter exponential backoff, or the server's Retry-After as given.
+
+        A Retry-After beyond the remaining deadline makes the caller give up instead of retrying early.
+        """
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return max(0.0, retry_after)
+        return random.uniform(0, min(GIGACHAT_RETRY_MAX_DELAY, GIGACHAT_RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def call(self, request: Callable[[], Awaitable[str]], admission=None) -> str:
+        """Run a blocking GigaChat request (request() is called once per attempt)."""
+        return await self._with_retries(request, "blocking", admission=admission)
+
+    async def stream(self, open_stream: Callable[[], AsyncIterator[str]], admission=None) -> AsyncIterator[str]:
+        """Stream a GigaChat reply; the deadline, hedging and retries apply until the first token."""
+
+        async def first_token():
+            tokens = open_stream()
+            try:
+                return await tokens.__anext__(), tokens
+            except StopAsyncIteration:
+                return None, tokens
+            except BaseException:
+                await tokens.aclose()
+                raise
+
+        async def discard(result):
+            await result[1].aclose()
+
+        first, tokens = await self._with_retries(first_token, "stream", discard, admission)
+        try:
+            if first is None:
+                return
+            yield first
+            while True:
+                try:
+                    token = await asyncio.wait_for(tokens.__anext__(), GIGACHAT_STREAM_IDLE_TIMEOUT)
+                except StopAsyncIteration:
+                    return
+                yield token
+        finally:
+            await tokens.aclose()
+
+    def fallback(self, error: BaseException) -> str:
+        """Canned reply spoken when GigaChat failed or the circuit is open."""
+        self.fallbacks_total += 1
+        GIGACHAT_RESILIENCE_EVENTS.labels("fallback").inc()
+        if isinstance(error, CircuitOpenError):
+            logger.warning("GigaChat circuit is open, answering with the fallback reply")
+        else:
+            logger.error(f"GigaChat request failed, answering with the fallback reply: {str(error) or type(error).__name__}")
+        return GIGACHAT_FALLBACK_REPLY
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests_total,
+            "hedges": self.hedges_total,
+            "hedges_won": self.hedges_won,
+            "retries": self.retries_total,
+            "timeouts": self.timeouts_total,
+            "fallbacks": self.fallbacks_total,
+            "breaker": self.breaker.state,
+            "deadline": {mode: tracker.deadline() for mode, tracker in self.latency.items()},
+        }
+
+
+# Shared by all sessions of this worker process
+gigachat_resilience = GigaChatResilience()
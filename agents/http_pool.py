@@ -0,0 +1,145 @@
+"""
+Shared keep-alive HTTP connection pool for the doctor agent.
+One aiohttp.ClientSession per worker process, reused by every outbound call
+(GigaChat OAuth, GigaChat completions, Next.js API).
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from metrics import HTTP_ERRORS
+
+# Pool configuration
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "60"))
+
+
+class HttpPool:
+    """Process-wide pooled HTTP client with per-host limits and DNS caching."""
+
+    def __init__(
+        self,
+        limit: int = HTTP_POOL_LIMIT,
+        limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+        dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        total_timeout: float = HTTP_TOTAL_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        # Streamed responses (SSE) may last longer than any total timeout; only a stalled
+        # connection or socket read fails them
+        self.stream_timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._users = 0
+        self._in_flight = 0
+        self._requests_total = 0
+
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it lazily for the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout,
+                enable_cleanup_closed=True,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._loop = loop
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """Perform a request on the shared session, tracking in-flight calls."""
+        self._in_flight += 1
+        self._requests_total += 1
+        host = urlsplit(url).hostname or "unknown"
+        try:
+            async with self.session().request(method, url, **kwargs) as resp:
+                if resp.status >= 400:
+                    HTTP_ERRORS.labels(host, str(resp.status)).inc()
+                yield resp
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            HTTP_ERRORS.labels(host, type(e).__name__).inc()
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def acquire(self):
+        """Register a job that uses the pool (paired with release())."""
+        self._users += 1
+
+    async def release(self):
+        """Unregister a job; the pool is closed when the last job leaves."""
+        self._users = max(0, self._users - 1)
+        if self._users == 0:
+            await self.aclose()
+
+    async def aclose(self):
+        """Close the shared session and all pooled connections."""
+        session, self._session, self._loop = self._session, None, None
+        if session is not None and not session.closed:
+            await session.close()
+            # Give SSL transports a chance to shut down cleanly
+            await asyncio.sleep(0.25)
+
+    def stats(self) -> dict:
+        """Return pool statistics for sizing (open, idle and in-flight connections)."""
+        idle = 0
+        acquired = 0
+        hosts = 0
+        session = self._session
+        if session is not None and not session.closed:
+            connector = session.connector
+            conns = getattr(connector, "_conns", {}) or {}
+            idle = sum(len(c) for c in conns.values())
+            hosts = len(conns)
+            acquired = len(getattr(connector, "_acquired", ()) or ())
+        return {
+            "open": idle + acquired,
+            "idle": idle,
+            "in_use": acquired,
+            "in_flight_requests": self._in_flight,
+            "requests_total": self._requests_total,
+            "hosts": hosts,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "jobs": self._users,
+        }
+
+
+# Process-wide pool shared by every call path in the agent
+http_pool = HttpPool()
@@ -0,0 +1,260 @@
+"""
+Off-loop inference for local (CPU-bound) speech models.
+Every LiveKit job runs in its own process, so each process loads one copy of a model
+and runs it on a single inference thread; requests of the room queue there in order.
+Silero VAD streams use one shared thread instead of a thread per stream. The event loop
+only awaits results, so a long synthesis does not delay the room's audio frames and VAD.
+"""
+
+import asyncio
+import concurrent.futures
+import importlib.util
+import logging
+import os
+import time
+from typing import Any, Optional
+
+from livekit.agents import tts, utils, APIConnectOptions, DEFAULT_API_CONNECT_OPTIONS
+
+logger = logging.getLogger("shadowmed.inference_pool")
+
+# Intra-op torch threads of the inference thread; job processes already run in parallel
+INFERENCE_TORCH_THREADS = int(os.getenv("INFERENCE_TORCH_THREADS", "1"))
+
+SILERO_TTS_MODEL = os.getenv("SILERO_TTS_MODEL", "v4_ru")
+SILERO_TTS_SPEAKER = os.getenv("SILERO_TTS_SPEAKER", "aidar")
+SILERO_TTS_SAMPLE_RATE = int(os.getenv("SILERO_TTS_SAMPLE_RATE", "24000"))
+
+# Frames pushed per chunk when emitting synthesised audio
+_PLAYBACK_CHUNK_MS = 100
+
+
+def _load_silero_tts():
+    import torch
+
+    model, _ = torch.hub.load(
+        repo_or_dir="snakers4/silero-models",
+        model="silero_tts",
+        language="ru",
+        speaker=SILERO_TTS_MODEL,
+    )
+    model.to(torch.device("cpu"))
+    return model
+
+
+def _run_silero_tts(model, item: tuple) -> bytes:
+    import torch
+
+    text, speaker, sample_rate = item
+    with torch.inference_mode():
+        audio = model.apply_tts(text=text, speaker=speaker, sample_rate=sample_rate)
+    return (audio.clamp(-1.0, 1.0) * 32767).to(torch.int16).numpy().tobytes()
+
+
+# task name -> (model loader, item runner); both run on the inference thread
+_TASKS = {
+    "silero_tts": (_load_silero_tts, _run_silero_tts),
+}
+
+
+def _set_torch_threads(threads: int):
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+class _SharedExecutor(concurrent.futures.Executor):
+    """View of a shared thread pool that owners cannot shut down."""
+
+    def __init__(self, pool: concurrent.futures.ThreadPoolExecutor):
+        self._pool = pool
+
+    def submit(self, fn, /, *args, **kwargs):
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        pass
+
+
+class _ExecutorLoop:
+    """Event loop view whose run_in_executor(None, ...) uses the given executor instead of the default."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, executor: concurrent.futures.Executor):
+        self._loop = loop
+        self._executor = executor
+
+    def run_in_executor(self, executor, func, *args):
+        return self._loop.run_in_executor(executor or self._executor, func, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._loop, name)
+
+
+class InferencePool:
+    """The job process's inference thread and the models loaded on it."""
+
+    def __init__(self, torch_threads: int = INFERENCE_TORCH_THREADS):
+        self.torch_threads = torch_threads
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._vad_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # Only touched on the inference thread
+        self._models: dict = {}
+        self.items = 0
+        self.skipped = 0
+        self._warmed: set = set()
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="inference",
+                initializer=_set_torch_threads,
+                initargs=(self.torch_threads,),
+            )
+        return self._executor
+
+    def _model(self, task: str):
+        if task not in self._models:
+            started = time.perf_counter()
+            self._models[task] = _TASKS[task][0]()
+            logger.info(f"Inference model loaded: {task} in {time.perf_counter() - started:.3f}s")
+        return self._models[task]
+
+    def _run_item(self, task: str, item: Any) -> Any:
+        return _TASKS[task][1](self._model(task), item)
+
+    def shared_thread_executor(self) -> concurrent.futures.Executor:
+        """Thread for inference that must stay in this process (e.g. VAD state)."""
+        if self._vad_executor is None:
+            self._vad_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="inference-vad",
+            )
+        return _SharedExecutor(self._vad_executor)
+
+    def warmup(self, task: str, wait: bool = True):
+        """Load the model on the inference thread before the first request needs it."""
+        if task in self._warmed:
+            return
+        self._warmed.add(task)
+        future = self._get_executor().submit(self._model, task)
+        if wait:
+            future.result()
+
+    async def run(self, task: str, item: Any) -> Any:
+        """Run one item on the inference thread, after the items queued before it."""
+        self.items += 1
+        future = self._get_executor().submit(self._run_item, task, item)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Cancelled while still queued (e.g. TTS of an interrupted reply): never runs
+            if future.cancelled():
+                self.skipped += 1
+            raise
+        except Exception as e:
+            raise Exception(f"Inference failed ({task}): {type(e).__name__}: {e}") from e
+
+    def stats(self) -> dict:
+        return {
+            "models": sorted(self._models),
+            "items": self.items,
+            "skipped": self.skipped,
+        }
+
+    def shutdown(self):
+        for executor in (self._executor, self._vad_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._vad_executor = None
+
+
+inference_pool = InferencePool()
+
+
+def silero_tts_available() -> bool:
+    """Whether torch is installed (without importing it: that takes seconds)."""
+    return importlib.util.find_spec("torch") is not None
+
+
+def use_shared_vad_executor(vad_instance):
+    """Run every stream of a Silero VAD on the shared VAD thread instead of one thread per stream."""
+    make_stream = vad_instance.stream
+
+    def stream(*args, **kwargs):
+        vad_stream = make_stream(*args, **kwargs)
+        own_executor = getattr(vad_stream, "_executor", None)
+        if own_executor is not None:
+            # Older plugin versions create a private single-thread executor per stream and
+            # only read it when running inference, so it can be swapped before the first frame
+            own_executor.shutdown(wait=False)
+            vad_stream._executor = inference_pool.shared_thread_executor()
+        elif getattr(vad_stream, "_loop", None) is not None:
+            # Newer versions call self._loop.run_in_executor(None, ...); only this stream's
+            # calls are redirected, the loop's default executor (to_thread etc.) is left alone
+            vad_stream._loop = _ExecutorLoop(vad_stream._loop, inference_pool.shared_thread_executor())
+        return vad_stream
+
+    vad_instance.stream = stream
+    return vad_instance
+
+
+class SileroTTS(tts.TTS):
+    """Local Silero TTS whose synthesis runs on the inference thread."""
+
+    def __init__(
+        self,
+        *,
+        speaker: str = SILERO_TTS_SPEAKER,
+        sample_rate: int = SILERO_TTS_SAMPLE_RATE,
+        pool: Optional[InferencePool] = None,
+    ):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=sample_rate,
+            num_channels=1,
+        )
+        self.speaker = speaker
+        self.pool = pool or inference_pool
+
+    def synthesize(
+        self,
+        text: str,
+        *,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+    ) -> "SileroChunkedStream":
+        return SileroChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+    def prewarm(self):
+        # Called from the event loop by the session; loading continues on the inference thread
+        self.pool.warmup("silero_tts", wait=False)
+
+
+class SileroChunkedStream(tts.ChunkedStream):
+    """Synthesises one sentence on the inference thread and emits it in short chunks."""
+
+    def __init__(self, *, tts: SileroTTS, input_text: str, conn_options: APIConnectOptions):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._silero_tts = tts
+
+    async def _run(self, output_emitter: tts.AudioEmitter):
+        sample_rate = self._silero_tts.sample_rate
+        pcm = await self._silero_tts.pool.run(
+            "silero_tts", (self._input_text, self._silero_tts.speaker, sample_rate)
+        )
+        output_emitter.initialize(
+            request_id=utils.shortuuid(),
+            sample_rate=sample_rate,
+            num_channels=1,
+            mime_type="audio/pcm",
+        )
+        chunk = sample_rate * 2 * _PLAYBACK_CHUNK_MS // 1000
+        for offset in range(0, len(pcm), chunk):
+            output_emitter.push(pcm[offset:offset + chunk])
+            # Let other rooms' audio run between chunks
+            await asyncio.sleep(0)
+        output_emitter.flush()
@@ -0,0 +1,245 @@
+"""
+Capacity-aware load reporting and admission control for the agent worker.
+
+Job processes publish their event-loop lag, active sessions and in-flight GigaChat
+requests to a shared stats directory; the worker's load function combines them with
+CPU usage, so LiveKit stops routing rooms to a saturated worker. A per-worker session
+cap and a draining mode (for rolling deploys) gate new jobs.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import psutil
+
+from metrics import ACTIVE_SESSIONS, EVENT_LOOP_LAG, WORKER_LOAD
+
+logger = logging.getLogger("shadowmed.load_control")
+
+AGENT_MAX_SESSIONS = int(os.getenv("AGENT_MAX_SESSIONS", "0")) or (os.cpu_count() or 1) * 2
+AGENT_LOAD_THRESHOLD = float(os.getenv("AGENT_LOAD_THRESHOLD", "0.75"))
+# Event-loop lag (seconds) at which a job process counts as fully loaded
+AGENT_MAX_LOOP_LAG = float(os.getenv("AGENT_MAX_LOOP_LAG", "0.1"))
+# In-flight GigaChat requests at which the worker counts as fully loaded
+AGENT_MAX_GIGACHAT_IN_FLIGHT = int(os.getenv("AGENT_MAX_GIGACHAT_IN_FLIGHT", "32"))
+AGENT_DRAIN_FILE = os.getenv("AGENT_DRAIN_FILE", os.path.join(tempfile.gettempdir(), "shadowmed-agent.drain"))
+# One directory per worker by default, so two workers on a host never read each other's load
+# files; set in the environment so the worker's job processes inherit it
+AGENT_STATS_DIR = os.environ.setdefault(
+    "AGENT_STATS_DIR",
+    os.path.join(tempfile.gettempdir(), f"shadowmed-agent-stats-{os.getpid()}"),
+)
+
+# Stats files not updated for this long belong to dead processes
+_STATS_STALE_AFTER = 5.0
+_REPORT_INTERVAL = 1.0
+# An accepted job that is not running after this long was never assigned to the worker
+_ACCEPT_TIMEOUT = 10.0
+
+
+class ProcessLoad:
+    """Load of the current (job) process, published for the worker's load function."""
+
+    def __init__(self, stats_dir: str = AGENT_STATS_DIR):
+        self.stats_dir = stats_dir
+        self.active_sessions = 0
+        self.gigachat_in_flight = 0
+        self.loop_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def track_gigachat(self):
+        """Count a GigaChat request as in flight for the duration of the block."""
+        self.gigachat_in_flight += 1
+        try:
+            yield
+        finally:
+            self.gigachat_in_flight -= 1
+
+    def session_started(self):
+        self.active_sessions += 1
+        ACTIVE_SESSIONS.inc()
+        self._ensure_running()
+
+    def session_ended(self):
+        if self.active_sessions > 0:
+            self.active_sessions -= 1
+            ACTIVE_SESSIONS.dec()
+        self._publish()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + _REPORT_INTERVAL
+            await asyncio.sleep(_REPORT_INTERVAL)
+            # How late the loop woke us up is the lag every other coroutine sees too
+            self.loop_lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.set(self.loop_lag)
+            self._publish()
+
+    def _path(self) -> str:
+        return os.path.join(self.stats_dir, f"{os.getpid()}.json")
+
+    def _publish(self):
+        try:
+            os.makedirs(self.stats_dir, exist_ok=True)
+            tmp_path = f"{self._path()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "active_sessions": self.active_sessions,
+                    "gigachat_in_flight": self.gigachat_in_flight,
+                    "loop_lag": self.loop_lag,
+                }, f)
+            os.replace(tmp_path, self._path())
+        except OSError as e:
+            logger.warning(f"Failed to publish process load: {e}")
+
+    async def aclose(self):
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            os.remove(self._path())
+        except OSError:
+            pass
+
+
+# Load of this process
+process_load = ProcessLoad()
+
+
+def read_process_stats(stats_dir: str = AGENT_STATS_DIR) -> list:
+    """Read fresh stats published by the worker's job processes."""
+    stats = []
+    now = time.time()
+    try:
+        names = os.listdir(stats_dir)
+    except FileNotFoundError:
+        return stats
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(stats_dir, name)
+        try:
+            if now - os.path.getmtime(path) > _STATS_STALE_AFTER:
+                continue
+            with open(path, encoding="utf-8") as f:
+                stats.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return stats
+
+
+class AdmissionControl:
+    """Worker-side load function, session cap and draining switch."""
+
+    def __init__(
+        self,
+        max_sessions: int = AGENT_MAX_SESSIONS,
+        max_loop_lag: float = AGENT_MAX_LOOP_LAG,
+        max_gigachat_in_flight: int = AGENT_MAX_GIGACHAT_IN_FLIGHT,
+        drain_file: str = AGENT_DRAIN_FILE,
+    ):
+        self.max_sessions = max_sessions
+        self.max_loop_lag = max_loop_lag
+        self.max_gigachat_in_flight = max_gigachat_in_flight
+        self.drain_file = drain_file
+        self._draining = False
+        self.last_load: dict = {}
+        self._worker = None
+        # Accepted job id -> accept time, until the job shows up as running. load_fnc runs in
+        # an executor thread, request_fnc on the event loop
+        self._accepted: dict = {}
+        self._accepted_lock = threading.Lock()
+        # Prime psutil so the first cpu_percent() call returns a real value
+        psutil.cpu_percent()
+
+    @property
+    def draining(self) -> bool:
+        return self._draining or os.path.exists(self.drain_file)
+
+    def start_draining(self, *_):
+        """Stop accepting new sessions; running ones finish normally."""
+        if not self._draining:
+            logger.info("Worker draining: no new sessions will be accepted")
+        self._draining = True
+
+    def install_signal_handler(self):
+        """SIGUSR1 switches the worker to draining (e.g. before a rolling deploy)."""
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.start_draining)
+
+    def compute_load(self, active_sessions: int) -> float:
+        """Combine CPU, event-loop lag, sessions and in-flight GigaChat requests into 0..1."""
+        stats = read_process_stats()
+        loop_lag = max((s.get("loop_lag", 0.0) for s in stats), default=0.0)
+        gigachat_in_flight = sum(s.get("gigachat_in_flight", 0) for s in stats)
+
+        components = {
+            "cpu": psutil.cpu_percent() / 100.0,
+            "sessions": active_sessions / self.max_sessions if self.max_sessions else 0.0,
+            "loop_lag": loop_lag / self.max_loop_lag if self.max_loop_lag else 0.0,
+            "gigachat": gigachat_in_flight / self.max_gigachat_in_flight if self.max_gigachat_in_flight else 0.0,
+        }
+        load = min(1.0, max(components.values()))
+        if self.draining or active_sessions >= self.max_sessions:
+            load = 1.0
+        self.last_load = {**components, "load": load, "active_sessions": active_sessions}
+        for component, value in {**components, "load": load}.items():
+            WORKER_LOAD.labels(component).set(value)
+        return load
+
+    def load_fnc(self, worker) -> float:
+        """WorkerOptions.load_fnc: reported to LiveKit for routing decisions."""
+        self._worker = worker
+        return self.compute_load(self.session_count())
+
+    def session_count(self) -> int:
+        """Running jobs plus accepted ones that have not started yet."""
+        with self._accepted_lock:
+            return self._session_count()
+
+    def _session_count(self) -> int:
+        running = {info.job.id for info in self._worker.active_jobs} if self._worker is not None else set()
+        now = time.monotonic()
+        for job_id, accepted_at in list(self._accepted.items()):
+            if job_id in running or now - accepted_at > _ACCEPT_TIMEOUT:
+                self._accepted.pop(job_id, None)
+        return len(running) + len(self._accepted)
+
+    def should_accept(self, active_sessions: int) -> bool:
+        return not self.draining and active_sessions < self.max_sessions
+
+    async def request_fnc(self, req):
+        """WorkerOptions.request_fnc: reject jobs over the session cap or while draining."""
+        # Counted now, not from the last load tick, so a burst of requests cannot pass the cap;
+        # the job is reserved before the first await
+        with self._accepted_lock:
+            accept = self.should_accept(self._session_count())
+            if accept:
+                self._accepted[req.id] = time.monotonic()
+        if accept:
+            await req.accept()
+            return
+        reason = "draining" if self.draining else f"session cap {self.max_sessions} reached"
+        logger.info(f"Rejecting job for room {req.room.name}: {reason}")
+        await req.reject()
+
+
+admission_control = AdmissionControl()
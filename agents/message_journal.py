@@ -0,0 +1,315 @@
+"""
+Write-behind journal for visit transcript messages.
+Messages are queued without blocking the reply path, batched per visit into bulk
+POSTs to the Next.js API, and spilled to a local append-only file while the API
+is unavailable. The spill file is replayed once the API recovers. Messages the API
+rejects as invalid are not retried; they are kept in a separate rejected file. File I/O
+runs in threads, never on the event loop.
+"""
+
+import asyncio
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import aiohttp
+
+from http_pool import http_pool
+from metrics import MESSAGE_FLUSH_SECONDS, MESSAGES_PERSISTED
+
+logger = logging.getLogger("shadowmed.message_journal")
+
+NEXTJS_API_URL = os.getenv("NEXTJS_API_URL", "http://localhost:3000")
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "20"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "1.0"))
+MESSAGE_REPLAY_INTERVAL = float(os.getenv("MESSAGE_REPLAY_INTERVAL", "30"))
+MESSAGE_JOURNAL_PATH = os.getenv(
+    "MESSAGE_JOURNAL_PATH",
+    os.path.join(tempfile.gettempdir(), "shadowmed-agent-messages.jsonl"),
+)
+
+
+class MessageJournal:
+    """Asynchronous, batched, spill-to-disk message writer."""
+
+    def __init__(
+        self,
+        api_url: str = NEXTJS_API_URL,
+        journal_path: str = MESSAGE_JOURNAL_PATH,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        flush_interval: float = MESSAGE_FLUSH_INTERVAL,
+        replay_interval: float = MESSAGE_REPLAY_INTERVAL,
+    ):
+        self.api_url = api_url
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.replay_interval = replay_interval
+        self._pending: dict = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._send_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._users = 0
+        self._last_replay = 0.0
+        self.sent_total = 0
+        self.spilled_total = 0
+        self.replayed_total = 0
+        self.rejected_total = 0
+        self._claims = 0
+        # Serialises appends from the writer threads (flush and replay may spill at once)
+        self._file_lock = threading.Lock()
+
+    @property
+    def rejected_path(self) -> str:
+        return f"{self.journal_path}.rejected"
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._send_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, visit_id: str, role: str, content: str, metadata: Optional[dict] = None):
+        """Queue a message for persistence; never waits on the network."""
+        if not content or not content.strip():
+            # The API rejects empty messages; they carry nothing worth saving
+            logger.debug(f"Skipping empty {role} message for visit {visit_id}")
+            return
+        self._ensure_running()
+        self._pending.setdefault(visit_id, []).append({
+            "role": role,
+            "content": content,
+            "metadata": metadata or {},
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        })
+        if len(self._pending[visit_id]) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending_count(self) -> int:
+        return sum(len(batch) for batch in self._pending.values())
+
+    async def flush(self, visit_id: Optional[str] = None):
+        """Send everything queued (for one visit or all); unsent messages go to the journal file."""
+        if self._send_lock is None:
+            return
+        visit_ids = [visit_id] if visit_id else list(self._pending.keys())
+        async with self._send_lock:
+            for vid in visit_ids:
+                await self._send_visit(vid)
+
+    def acquire(self):
+        """Register a job that uses the journal (paired with release())."""
+        self._users += 1
+
+    async def release(self):
+        """Unregister a job; the writer is flushed and stopped when the last job leaves."""
+        self._users = max(0, self._users - 1)
+        if self._users == 0:
+            await self.aclose()
+
+    async def aclose(self):
+        """Flush all pending messages and stop the background writer."""
+        await self.flush()
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+                if loop.time() - self._last_replay >= self.replay_interval:
+                    self._last_replay = loop.time()
+                    await self.replay()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in message journal writer: {e}")
+
+    async def _send_visit(self, visit_id: str):
+        while self._pending.get(visit_id):
+            batch = self._pending[visit_id][:self.batch_size]
+            del self._pending[visit_id][:len(batch)]
+            rejected = await self._post_bulk(visit_id, batch)
+            if rejected is None:
+                await self._spill(visit_id, batch)
+                continue
+            sent = len(batch) - len(rejected)
+            self.sent_total += sent
+            MESSAGES_PERSISTED.labels("sent").inc(sent)
+            await self._reject(visit_id, rejected)
+        self._pending.pop(visit_id, None)
+
+    async def _post_bulk(self, visit_id: str, messages: list) -> Optional[list]:
+        """POST a batch. Returns the (message, error) pairs the API rejected, or None if not delivered."""
+        service_token = os.getenv("AGENT_SERVICE_TOKEN")
+        headers = {"Content-Type": "application/json"}
+        if service_token:
+            headers["x-service-token"] = service_token
+
+        started = time.perf_counter()
+        try:
+            async with http_pool.post(
+                f"{self.api_url}/api/visits/{visit_id}/messages/bulk",
+                headers=headers,
+                json={"messages": messages},
+            ) as resp:
+                if resp.status in (200, 201):
+                    MESSAGE_FLUSH_SECONDS.observe(time.perf_counter() - started)
+                    try:
+                        body = await resp.json()
+                    except (aiohttp.ContentTypeError, json.JSONDecodeError):
+                        body = {}
+                    # Invalid messages are skipped by the API, the rest of the batch is saved
+                    return [
+                        (messages[item["index"]], item.get("error", "rejected"))
+                        for item in body.get("rejected") or []
+                        if 0 <= item.get("index", -1) < len(messages)
+                    ]
+                error_text = await resp.text()
+                logger.warning(f"Failed to save {len(messages)} messages to DB: {resp.status} - {error_text}")
+                # Client errors will not succeed on retry
+                if 400 <= resp.status < 500 and resp.status not in (401, 408, 429):
+                    return [(message, f"{resp.status}: {error_text[:200]}") for message in messages]
+                return None
+        except Exception as e:
+            logger.error(f"Error saving messages to DB: {e}")
+            return None
+
+    def _append(self, path: str, entries: list):
+        """Append JSON lines to a file (blocking; run in a thread)."""
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with self._file_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    async def _reject(self, visit_id: str, rejected: list):
+        """Keep messages the API refused in the rejected file; they are not retried."""
+        if not rejected:
+            return
+        self.rejected_total += len(rejected)
+        MESSAGES_PERSISTED.labels("rejected").inc(len(rejected))
+        logger.error(f"API rejected {len(rejected)} messages for visit {visit_id}: {rejected[0][1]}")
+        entries = [{"visit_id": visit_id, "error": error, **message} for message, error in rejected]
+        try:
+            await asyncio.to_thread(self._append, self.rejected_path, entries)
+        except OSError as e:
+            logger.error(f"Error writing rejected messages: {e}")
+
+    async def _spill(self, visit_id: str, messages: list):
+        """Append unsent messages to the local journal file."""
+        entries = [{"visit_id": visit_id, **message} for message in messages]
+        try:
+            await asyncio.to_thread(self._append, self.journal_path, entries)
+            self.spilled_total += len(messages)
+            MESSAGES_PERSISTED.labels("spilled").inc(len(messages))
+            logger.warning(f"Spilled {len(messages)} messages for visit {visit_id} to {self.journal_path}")
+        except OSError as e:
+            logger.error(f"Error writing message journal: {e}")
+
+    def _claim(self, path: str) -> Optional[str]:
+        """Atomically take a journal file for replay, so concurrent workers don't replay it twice."""
+        self._claims += 1
+        claimed_path = f"{self.journal_path}.{os.getpid()}.{self._claims}.replay"
+        try:
+            os.replace(path, claimed_path)
+        except OSError:
+            return None
+        return claimed_path
+
+    def _orphaned_claims(self) -> list:
+        """Claimed files left by a replay that did not finish (crashed process or cancelled task)."""
+        orphans = []
+        prefix = f"{self.journal_path}."
+        for path in glob.glob(f"{glob.escape(self.journal_path)}.*.replay"):
+            pid = path[len(prefix):].split(".", 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                continue
+            orphans.append(path)
+        return sorted(orphans)
+
+    async def replay(self):
+        """Resend messages from the journal file; entries that fail again are re-spilled.
+
+        A claimed file is removed only after all its batches were delivered, re-spilled or
+        rejected. If the replay dies halfway, the file is picked up again; messages already
+        sent from it are deduplicated by the API through their messageKey.
+        """
+        claimed = await asyncio.to_thread(self._claim_all)
+        for claimed_path in claimed:
+            await self._replay_file(claimed_path)
+
+        if self.replayed_total:
+            logger.info(f"Message journal replayed: {self.replayed_total} messages total")
+
+    def _claim_all(self) -> list:
+        """Claim orphaned replay files and the current journal (blocking; run in a thread)."""
+        claimed = [path for path in map(self._claim, self._orphaned_claims()) if path]
+        if os.path.exists(self.journal_path):
+            claimed_path = self._claim(self.journal_path)
+            if claimed_path:
+                claimed.append(claimed_path)
+        return claimed
+
+    async def _replay_file(self, claimed_path: str):
+        by_visit = await asyncio.to_thread(_read_journal, claimed_path)
+
+        for visit_id, messages in by_visit.items():
+            for i in range(0, len(messages), self.batch_size):
+                batch = messages[i:i + self.batch_size]
+                rejected = await self._post_bulk(visit_id, batch)
+                if rejected is None:
+                    await self._spill(visit_id, batch)
+                    continue
+                replayed = len(batch) - len(rejected)
+                self.replayed_total += replayed
+                MESSAGES_PERSISTED.labels("replayed").inc(replayed)
+                await self._reject(visit_id, rejected)
+
+        await asyncio.to_thread(os.remove, claimed_path)
+
+
+def _read_journal(path: str) -> dict:
+    """Journal entries grouped by visit id, in file order."""
+    by_visit: dict = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            by_visit.setdefault(entry.pop("visit_id"), []).append(entry)
+    return by_visit
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Process-wide journal shared by all sessions in the worker
+message_journal = MessageJournal()
@@ -0,0 +1,218 @@
+"""
+Metrics for the doctor agent worker.
+Prometheus histograms, counters and gauges (collected from every job process through
+the worker's multiprocess metrics endpoint), plus in-process cold vs warm job start
+stats (models loaded by prewarm or inside the job).
+"""
+
+import logging
+import math
+import os
+import time
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger("shadowmed.metrics")
+
+# A process that gets its job within this many seconds of finishing prewarm() was spawned
+# for it (no idle process was ready), so the job also waited for the models to load
+JOB_COLD_START_IDLE = float(os.getenv("JOB_COLD_START_IDLE", "0.5"))
+
+_LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+TURN_STAGE_SECONDS = Histogram(
+    "shadowmed_agent_turn_stage_seconds",
+    "Duration of a voice turn stage (see telemetry.TURN_STAGES)",
+    ["stage", "persona"],
+    buckets=_LATENCY_BUCKETS,
+)
+JOB_START_SECONDS = Histogram(
+    "shadowmed_agent_job_start_seconds",
+    "Time from job start to a startup stage",
+    ["mode", "stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+GIGACHAT_REQUESTS = Counter(
+    "shadowmed_agent_gigachat_requests_total",
+    "GigaChat completion requests",
+    ["mode", "outcome"],
+)
+GIGACHAT_TOKENS = Counter(
+    "shadowmed_agent_gigachat_tokens_total",
+    "GigaChat tokens from response usage (kind: prompt, precached, completion)",
+    ["mode", "kind"],
+)
+GIGACHAT_PROMPT_CACHE = Counter(
+    "shadowmed_agent_gigachat_prompt_cache_total",
+    "GigaChat responses by prompt prefix cache use (hit: precached_prompt_tokens > 0)",
+    ["mode", "outcome"],
+)
+GIGACHAT_TOKEN_REFRESHES = Counter(
+    "shadowmed_agent_gigachat_token_refreshes_total",
+    "GigaChat OAuth token fetches",
+    ["outcome"],
+)
+GIGACHAT_RESILIENCE_EVENTS = Counter(
+    "shadowmed_agent_gigachat_resilience_events_total",
+    "GigaChat retries, hedged requests, timeouts, breaker openings and fallback replies",
+    ["event"],
+)
+GIGACHAT_BREAKER_OPEN = Gauge(
+    "shadowmed_agent_gigachat_breaker_open",
+    "1 while the GigaChat circuit breaker of a process is open",
+    multiprocess_mode="livemax",
+)
+GIGACHAT_RATE_QUEUE_SECONDS = Histogram(
+    "shadowmed_agent_gigachat_rate_queue_seconds",
+    "Time a GigaChat request waited for the shared rate limit",
+    ["priority"],
+    buckets=_LATENCY_BUCKETS,
+)
+GIGACHAT_RATE_QUEUE_DEPTH = Gauge(
+    "shadowmed_agent_gigachat_rate_queue_depth",
+    "GigaChat requests waiting for the shared rate limit",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+GIGACHAT_RATE_REJECTED = Counter(
+    "shadowmed_agent_gigachat_rate_rejected_total",
+    "GigaChat requests rejected after waiting too long for the rate limit",
+    ["priority"],
+)
+HTTP_ERRORS = Counter(
+    "shadowmed_agent_http_errors_total",
+    "Failed outgoing HTTP requests (error status or exception)",
+    ["host", "status"],
+)
+SPECULATIVE_REQUESTS = Counter(
+    "shadowmed_agent_speculative_requests_total",
+    "Speculative GigaChat requests on interim transcripts",
+    ["outcome"],
+)
+MESSAGES_PERSISTED = Counter(
+    "shadowmed_agent_messages_persisted_total",
+    "Transcript messages handled by the message journal",
+    ["outcome"],
+)
+STT_AUDIO_SECONDS = Counter(
+    "shadowmed_agent_stt_audio_seconds_total",
+    "Rep audio seconds received from the room and uploaded to STT (direction)",
+    ["direction"],
+)
+STT_SEGMENTS = Counter(
+    "shadowmed_agent_stt_segments_total",
+    "VAD speech segments (sent, split: part of a long utterance, dropped: too short)",
+    ["outcome"],
+)
+STT_ENDPOINTING_SECONDS = Histogram(
+    "shadowmed_agent_stt_endpointing_seconds",
+    "Time from the end of the rep's speech to the end-of-utterance decision",
+    buckets=_LATENCY_BUCKETS,
+)
+MESSAGE_FLUSH_SECONDS = Histogram(
+    "shadowmed_agent_message_flush_seconds",
+    "Duration of a bulk message save to the Next.js API",
+    buckets=_LATENCY_BUCKETS,
+)
+ACTIVE_SESSIONS = Gauge(
+    "shadowmed_agent_active_sessions",
+    "Voice sessions running in job processes",
+    multiprocess_mode="livesum",
+)
+EVENT_LOOP_LAG = Gauge(
+    "shadowmed_agent_event_loop_lag_seconds",
+    "Event-loop lag of job processes",
+    multiprocess_mode="livemax",
+)
+WORKER_LOAD = Gauge(
+    "shadowmed_agent_worker_load",
+    "Worker load reported to LiveKit, by component",
+    ["component"],
+    multiprocess_mode="livemax",
+)
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(values: list) -> dict:
+    """count/mean/p50/p95/p99/max of a list of durations."""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+    }
+
+
+class StartupStats:
+    """Aggregates job start timings, split by cold and warm processes."""
+
+    def __init__(self):
+        self._samples = {"cold": {}, "warm": {}}
+
+    def observe(self, mode: str, stage: str, seconds: float):
+        JOB_START_SECONDS.labels(mode, stage).observe(seconds)
+        bucket = self._samples[mode].setdefault(stage, {"count": 0, "sum": 0.0, "max": 0.0})
+        bucket["count"] += 1
+        bucket["sum"] += seconds
+        bucket["max"] = max(bucket["max"], seconds)
+
+    def snapshot(self) -> dict:
+        result = {}
+        for mode, stages in self._samples.items():
+            result[mode] = {
+                stage: {
+                    "count": b["count"],
+                    "avg": b["sum"] / b["count"] if b["count"] else 0.0,
+                    "max": b["max"],
+                }
+                for stage, b in stages.items()
+            }
+        return result
+
+
+startup_stats = StartupStats()
+
+
+class JobStartTimer:
+    """Measures one job's start: models ready, session started, first doctor audio."""
+
+    def __init__(self, warm: bool, started: Optional[float] = None):
+        self.mode = "warm" if warm else "cold"
+        self.started = time.perf_counter() if started is None else started
+        self._first_audio: Optional[float] = None
+
+    @classmethod
+    def for_process(cls, userdata: dict) -> "JobStartTimer":
+        """Timer for a job in a process whose prewarm() stored its perf_counter() bounds.
+
+        Warm: the process sat idle with its models loaded before the job came. Cold: it
+        was spawned for the job (or never prewarmed), so the timer starts when the
+        process began loading models.
+        """
+        now = time.perf_counter()
+        finished = userdata.get("prewarm_finished")
+        if finished is not None and now - finished >= JOB_COLD_START_IDLE:
+            return cls(warm=True, started=now)
+        return cls(warm=False, started=userdata.get("prewarm_started", now))
+
+    def mark(self, stage: str) -> float:
+        elapsed = time.perf_counter() - self.started
+        startup_stats.observe(self.mode, stage, elapsed)
+        return elapsed
+
+    def mark_first_audio(self):
+        if self._first_audio is not None:
+            return
+        self._first_audio = self.mark("first_audio")
+        logger.info(f"Job start ({self.mode}): first audio after {self._first_audio:.3f}s")
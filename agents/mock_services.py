@@ -0,0 +1,343 @@
+"""
+Local stand-ins for GigaChat and the Next.js agent API, for offline benchmarks and replay.
+
+    POST /api/v2/oauth                      GigaChat OAuth (expires_at in ms)
+    POST /api/v1/chat/completions           GigaChat completion, JSON or SSE ("stream": true)
+    GET  /api/visits/{id}/agent             {"visit": {...}} with a doctor persona
+    GET  /api/visits/{id}/messages          saved transcript, newest first
+    POST /api/visits/{id}/messages          save one message
+    POST /api/visits/{id}/messages/bulk     save a batch (deduplicated by messageKey, invalid ones rejected)
+    GET  /api/evaluations/pending           completed visits without an evaluation, paged
+    POST /api/evaluations/bulk              save a batch of evaluations
+
+Latency is configurable: a time to first token with jitter, then a per-token delay.
+A share of completions can fail with 503 or stall before the first token.
+Responses report `usage`; requests with the same X-Session-ID reuse the longest common
+message prefix of the previous request as precached tokens, and with prefill_ms_per_1k
+the uncached prompt tokens add to the time to first token.
+
+Usage:
+    python mock_services.py --port 8090 --ttft-ms 300 --jitter-ms 100
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Optional
+
+from aiohttp import web
+
+MOCK_REPLIES = [
+    "Здравствуйте. Расскажите, пожалуйста, о каком препарате пойдёт речь?",
+    "Понятно. А какие есть клинические исследования по эффективности этого препарата?",
+    "Какие у него противопоказания и побочные эффекты? Мне важно знать про пожилых пациентов.",
+    "Интересно. Чем он отличается от препаратов, которые я назначаю сейчас?",
+    "Хорошо, я подумаю. Оставьте, пожалуйста, материалы по исследованиям.",
+]
+
+
+class MockServices:
+    """In-memory GigaChat and Next.js API with configurable latency."""
+
+    def __init__(
+        self,
+        ttft_ms: float = 300.0,
+        jitter_ms: float = 100.0,
+        token_delay_ms: float = 20.0,
+        tokens_per_chunk: int = 3,
+        seed: Optional[int] = None,
+        error_rate: float = 0.0,
+        stall_rate: float = 0.0,
+        stall_ms: float = 5000.0,
+        prefill_ms_per_1k: float = 0.0,
+    ):
+        self.ttft_ms = ttft_ms
+        self.jitter_ms = jitter_ms
+        self.token_delay_ms = token_delay_ms
+        self.tokens_per_chunk = tokens_per_chunk
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        # X-Session-ID -> messages of the last request plus its reply (the cached prefix)
+        self._session_prompts: dict = {}
+        self._random = random.Random(seed)
+        self.messages: dict = {}
+        self.completed_visits: set = set()
+        self.evaluations: dict = {}
+        self.counters = {
+            "oauth": 0,
+            "completions": 0,
+            "streams": 0,
+            "errors": 0,
+            "stalls": 0,
+            "cache_hits": 0,
+            "saved_messages": 0,
+            "duplicates": 0,
+            "evaluations": 0,
+        }
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    def _first_token_delay(self) -> float:
+        jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.ttft_ms + jitter) / 1000.0
+
+    def _reply_for(self, messages: list) -> str:
+        if any("JSON" in m.get("content", "") for m in messages if m.get("role") == "system"):
+            # Visit evaluation
+            return json.dumps({
+                "score": 80,
+                "feedback": "Хороший контакт с врачом.",
+                "recommendations": ["Больше данных исследований"],
+                "metrics": {"clarity": 8},
+            }, ensure_ascii=False)
+        turns = sum(1 for m in messages if m.get("role") == "user")
+        return MOCK_REPLIES[max(0, turns - 1) % len(MOCK_REPLIES)]
+
+    @staticmethod
+    def _message_tokens(message: dict) -> int:
+        return len(message.get("content", "")) // 3 + 4
+
+    def _usage(self, session_id: Optional[str], messages: list, reply: str) -> dict:
+        """Token usage; the prefix shared with the session's previous request counts as precached."""
+        prompt = sum(self._message_tokens(m) for m in messages)
+        precached = 0
+        if session_id:
+            for cached, message in zip(self._session_prompts.get(session_id, []), messages):
+                if cached != message:
+                    break
+                precached += self._message_tokens(message)
+            self._session_prompts[session_id] = messages + [{"role": "assistant", "content": reply}]
+        if precached:
+            self.counters["cache_hits"] += 1
+        completion = len(reply) // 3 + 1
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "precached_prompt_tokens": precached,
+            "total_tokens": prompt + completion,
+        }
+
+    def _chunks(self, text: str) -> list:
+        words = text.split(" ")
+        step = max(1, self.tokens_per_chunk)
+        return [" ".join(words[i:i + step]) + ("" if i + step >= len(words) else " ") for i in range(0, len(words), step)]
+
+    async def handle_oauth(self, request: web.Request) -> web.Response:
+        self.counters["oauth"] += 1
+        return web.json_response({
+            "access_token": f"mock-{uuid.uuid4()}",
+            "expires_at": int((time.time() + 1800) * 1000),
+        })
+
+    async def handle_completions(self, request: web.Request) -> web.StreamResponse:
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"message": "Unauthorized"}, status=401)
+        body = await request.json()
+        messages = body.get("messages", [])
+        reply = self._reply_for(messages)
+        fault = self._random.random()
+        if fault < self.error_rate:
+            self.counters["errors"] += 1
+            return web.json_response({"message": "Service Unavailable"}, status=503)
+        if fault < self.error_rate + self.stall_rate:
+            self.counters["stalls"] += 1
+            await asyncio.sleep(self.stall_ms / 1000.0)
+        usage = self._usage(request.headers.get("X-Session-ID"), messages, reply)
+        prefill = self.prefill_ms_per_1k * (usage["prompt_tokens"] - usage["precached_prompt_tokens"]) / 1000.0
+        await asyncio.sleep(self._first_token_delay() + prefill / 1000.0)
+
+        if not body.get("stream"):
+            self.counters["completions"] += 1
+            # Generation time of the remaining tokens
+            await asyncio.sleep(self.token_delay_ms * (len(self._chunks(reply)) - 1) / 1000.0)
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": reply}, "index": 0, "finish_reason": "stop"}],
+                "created": int(time.time()),
+                "model": "GigaChat",
+                "object": "chat.completion",
+                "usage": usage,
+            })
+
+        self.counters["streams"] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        try:
+            await resp.prepare(request)
+            chunks = self._chunks(reply)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(self.token_delay_ms / 1000.0)
+                event = {"choices": [{"delta": {"content": chunk}, "index": 0}], "created": int(time.time()), "model": "GigaChat"}
+                if i == len(chunks) - 1:
+                    event["usage"] = usage
+                await resp.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await resp.write(b"data: [DONE]\n\n")
+            await resp.write_eof()
+        except ConnectionResetError:
+            # The client cancelled the request (e.g. the losing hedged request)
+            pass
+        return resp
+
+    async def handle_visit(self, request: web.Request) -> web.Response:
+        visit_id = request.match_info["id"]
+        return web.json_response({
+            "visit": {
+                "id": visit_id,
+                "status": "in_progress",
+                "doctor": {
+                    "id": "mock-doctor",
+                    "name": "Доктор Иванов",
+                    "personalityType": "rational",
+                    "empathyLevel": 5,
+                    "promptTemplate": "Ты терапевт районной поликлиники.",
+                    "updatedAt": "2024-01-01T00:00:00.000Z",
+                },
+            }
+        })
+
+    async def handle_get_messages(self, request: web.Request) -> web.Response:
+        saved = self.messages.get(request.match_info["id"], [])
+        return web.json_response({"messages": list(reversed(saved))})
+
+    def _save(self, visit_id: str, messages: list) -> int:
+        saved = self.messages.setdefault(visit_id, [])
+        keys = {(m.get("metadata") or {}).get("messageKey") for m in saved}
+        inserted = 0
+        for message in messages:
+            key = (message.get("metadata") or {}).get("messageKey")
+            if key and key in keys:
+                self.counters["duplicates"] += 1
+                continue
+            keys.add(key)
+            saved.append(message)
+            inserted += 1
+        self.counters["saved_messages"] += inserted
+        return inserted
+
+    async def handle_post_message(self, request: web.Request) -> web.Response:
+        inserted = self._save(request.match_info["id"], [await request.json()])
+        return web.json_response({"inserted": inserted}, status=201)
+
+    async def handle_bulk(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        messages = body.get("messages", [])
+        # Like the Next.js route: invalid messages are reported back, the rest is saved
+        rejected = [
+            {"index": i, "error": "Role and content are required"}
+            for i, message in enumerate(messages)
+            if not message.get("role") or not (message.get("content") or "").strip()
+        ]
+        if len(rejected) == len(messages):
+            return web.json_response({"error": "Role and content are required", "rejected": rejected}, status=400)
+        skipped = {item["index"] for item in rejected}
+        valid = [message for i, message in enumerate(messages) if i not in skipped]
+        inserted = self._save(request.match_info["id"], valid)
+        return web.json_response(
+            {"inserted": inserted, "duplicates": len(valid) - inserted, "rejected": rejected},
+            status=201,
+        )
+
+    def add_completed_visit(self, visit_id: str, messages: list):
+        """A finished visit with its transcript, to be picked up by batch evaluation."""
+        self.completed_visits.add(visit_id)
+        self._save(visit_id, messages)
+
+    async def handle_pending_evaluations(self, request: web.Request) -> web.Response:
+        limit = int(request.query.get("limit", "50"))
+        after = request.query.get("after", "")
+        pending = sorted(v for v in self.completed_visits if v not in self.evaluations and v > after)[:limit]
+        return web.json_response({
+            "visits": [
+                {
+                    "id": visit_id,
+                    "doctor": {"name": "Доктор Иванов", "personalityType": "rational"},
+                    "messages": [{"role": m["role"], "content": m["content"]} for m in self.messages.get(visit_id, [])],
+                }
+                for visit_id in pending
+            ],
+            "nextCursor": pending[-1] if len(pending) == limit else None,
+        })
+
+    async def handle_bulk_evaluations(self, request: web.Request) -> web.Response:
+        results = (await request.json()).get("evaluations", [])
+        inserted = 0
+        for result in results:
+            if result["visitId"] in self.completed_visits and result["visitId"] not in self.evaluations:
+                self.evaluations[result["visitId"]] = result
+                inserted += 1
+        self.counters["evaluations"] += inserted
+        return web.json_response({"inserted": inserted, "skipped": len(results) - inserted}, status=201)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/v2/oauth", self.handle_oauth)
+        app.router.add_post("/api/v1/chat/completions", self.handle_completions)
+        app.router.add_get("/api/visits/{id}/agent", self.handle_visit)
+        app.router.add_get("/api/visits/{id}/messages", self.handle_get_messages)
+        app.router.add_post("/api/visits/{id}/messages", self.handle_post_message)
+        app.router.add_post("/api/visits/{id}/messages/bulk", self.handle_bulk)
+        app.router.add_get("/api/evaluations/pending", self.handle_pending_evaluations)
+        app.router.add_post("/api/evaluations/bulk", self.handle_bulk_evaluations)
+        return app
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> dict:
+        """Environment that points the agent modules at this server (set before importing them)."""
+        return {
+            "GIGACHAT_OAUTH_URL": f"{self.base_url}/api/v2/oauth",
+            "GIGACHAT_API_URL": f"{self.base_url}/api/v1",
+            "GIGACHAT_AUTHORIZATION_KEY": "mock-authorization-key",
+            "NEXTJS_API_URL": self.base_url,
+        }
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        # Resolve the ephemeral port
+        self.port = self._runner.addresses[0][1]
+
+    async def aclose(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args):
+    services = MockServices(
+        ttft_ms=args.ttft_ms,
+        jitter_ms=args.jitter_ms,
+        token_delay_ms=args.token_delay_ms,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        prefill_ms_per_1k=args.prefill_ms_per_1k,
+    )
+    await services.start(args.host, args.port)
+    print(f"Mock GigaChat / Next.js API listening on {services.base_url}")
+    for name, value in services.env().items():
+        print(f"  {name}={value}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await services.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock GigaChat and Next.js agent API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of completions failing with 503")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of completions stalling 5s")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0, help="Extra TTFT per 1000 uncached prompt tokens")
+    asyncio.run(_serve(parser.parse_args()))
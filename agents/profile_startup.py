@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Cold-start import profile of the agent entry points.
+Every target is imported in a fresh interpreter with `python -X importtime`. The report
+lists the slowest modules (cumulative time), the self time per top-level package and the
+total. The command exits non-zero when a target exceeds the import budget, so a heavy
+import added at module level is caught before it slows every process spawn.
+
+Usage:
+    python profile_startup.py
+    python profile_startup.py --target job --budget-ms 3000 --top 20
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+# Import time allowed per target (best of --runs), milliseconds
+AGENT_IMPORT_BUDGET_MS = float(os.getenv("AGENT_IMPORT_BUDGET_MS", "3500"))
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> statement timed in a fresh interpreter
+TARGETS = {
+    # The worker's main process (run_worker.py without starting the worker)
+    "worker": "import run_worker",
+    # A job process up to prewarm(): agent module and the configured provider plugins
+    "job": "import doctor_agent; doctor_agent.load_plugins()",
+    "batch_evaluate": "import batch_evaluate",
+}
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> list:
+    """(module, self_us, cumulative_us, depth) for every line of -X importtime output."""
+    modules = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return modules
+
+
+def profile_target(statement: str) -> dict:
+    """Import time of one statement in a fresh interpreter."""
+    code = f"import time\n_t = time.perf_counter()\n{statement}\nprint(time.perf_counter() - _t)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=AGENTS_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{result.stderr[-2000:]}")
+    return {
+        "total_ms": float(result.stdout.strip().splitlines()[-1]) * 1000,
+        "modules": parse_importtime(result.stderr),
+    }
+
+
+def summarize(profile: dict, top: int) -> dict:
+    packages: dict = {}
+    for name, self_us, _, _ in profile["modules"]:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    slowest = sorted(profile["modules"], key=lambda m: m[2], reverse=True)[:top]
+    return {
+        "total_ms": round(profile["total_ms"], 1),
+        "modules": len(profile["modules"]),
+        "slowest": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for name, self_us, cumulative, _ in slowest
+        ],
+        "packages_ms": {
+            package: round(us / 1000, 1)
+            for package, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile and budget of the agent entry points")
+    parser.add_argument("--target", action="append", choices=sorted(TARGETS), help="Profile only these targets")
+    parser.add_argument("--budget-ms", type=float, default=AGENT_IMPORT_BUDGET_MS, help="Allowed import time per target")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per target (best run is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules / packages listed")
+    args = parser.parse_args()
+
+    report = {"budget_ms": args.budget_ms, "python": sys.version.split()[0], "targets": {}}
+    over_budget = []
+    for name in args.target or list(TARGETS):
+        best = min((profile_target(TARGETS[name]) for _ in range(max(1, args.runs))), key=lambda p: p["total_ms"])
+        summary = summarize(best, args.top)
+        summary["over_budget"] = summary["total_ms"] > args.budget_ms
+        report["targets"][name] = summary
+        if summary["over_budget"]:
+            over_budget.append(f"{name}: {summary['total_ms']:.0f}ms > {args.budget_ms:.0f}ms")
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if over_budget:
+        print("Import budget exceeded: " + ", ".join(over_budget), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+GigaChat rate-limit scheduler shared by all sessions of a worker.
+Requests per second and tokens per minute are drawn from token buckets kept in a locked
+state file, so every job process on the host spends the same account budget. Waiting
+requests are served in priority order (live conversational turns before background work
+such as summaries and evaluations); a request that would wait longer than its priority's
+limit is rejected instead of piling up, and a 429 from GigaChat pauses every process until
+the limit resets rather than letting all sessions retry at once. Without configured limits
+no state file is touched: only the 429 pause is kept, in memory, for this process.
+The state file lock is never waited for on the event loop: a busy lock counts as a short
+wait, and token corrections and 429 pauses are kept locally until the next locked update.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: per-process buckets only
+    fcntl = None
+
+from context_window import estimate_messages_tokens
+from metrics import GIGACHAT_RATE_QUEUE_DEPTH, GIGACHAT_RATE_QUEUE_SECONDS, GIGACHAT_RATE_REJECTED
+
+logger = logging.getLogger("shadowmed.rate_limiter")
+
+# Account limits (0 disables the corresponding bucket)
+GIGACHAT_RPS_LIMIT = float(os.getenv("GIGACHAT_RPS_LIMIT", "0"))
+GIGACHAT_TPM_LIMIT = float(os.getenv("GIGACHAT_TPM_LIMIT", "0"))
+# Bucket capacity in seconds of the rate (allowed burst)
+GIGACHAT_RATE_BURST_SECONDS = float(os.getenv("GIGACHAT_RATE_BURST_SECONDS", "1"))
+# Share of the buckets background requests may not use, kept for live turns
+GIGACHAT_RATE_LIVE_RESERVE = float(os.getenv("GIGACHAT_RATE_LIVE_RESERVE", "0.2"))
+# Longest queueing before a request is rejected (backpressure)
+GIGACHAT_RATE_LIVE_MAX_WAIT = float(os.getenv("GIGACHAT_RATE_LIVE_MAX_WAIT", "5"))
+GIGACHAT_RATE_BACKGROUND_MAX_WAIT = float(os.getenv("GIGACHAT_RATE_BACKGROUND_MAX_WAIT", "60"))
+# Completion tokens charged up front when the reply length is not known yet
+GIGACHAT_RATE_COMPLETION_TOKENS = int(os.getenv("GIGACHAT_RATE_COMPLETION_TOKENS", "200"))
+# Pause after a 429 without Retry-After, seconds
+GIGACHAT_RATE_429_PAUSE = float(os.getenv("GIGACHAT_RATE_429_PAUSE", "1"))
+# Shared bucket state; empty keeps the buckets per process
+GIGACHAT_RATE_STATE_DIR = os.getenv("GIGACHAT_RATE_STATE_DIR", tempfile.gettempdir())
+
+PRIORITIES = {"live": 0, "background": 1}
+
+# Longest sleep before the head of the queue is re-checked (other processes refill/spend too)
+_POLL_INTERVAL = 0.05
+
+
+class RateLimitExceeded(Exception):
+    """A GigaChat request waited too long for the shared rate limit."""
+
+
+def estimate_request_tokens(messages: list, max_tokens: int) -> int:
+    """Tokens charged for a request: prompt estimate plus the expected completion."""
+    return estimate_messages_tokens(messages) + min(max_tokens, GIGACHAT_RATE_COMPLETION_TOKENS)
+
+
+class SharedBuckets:
+    """Request and token buckets, in a locked file when shared between processes."""
+
+    def __init__(self, rps: float, tpm: float, burst_seconds: float, path: Optional[str]):
+        self.request_rate = rps
+        self.token_rate = tpm / 60.0
+        self.request_capacity = max(1.0, rps * burst_seconds)
+        self.token_capacity = max(1.0, tpm / 60.0 * burst_seconds)
+        self.path = path if fcntl else None
+        self._state = self._full()
+        # Changes not yet written to the shared state (its lock was busy)
+        self._pending_tokens = 0.0
+        self._pending_block = False
+        # Last known pause, checked before the state file is opened
+        self.blocked_until = 0.0
+
+    def _full(self) -> dict:
+        return {
+            "requests": self.request_capacity,
+            "tokens": self.token_capacity,
+            "updated": time.time(),
+            "blocked_until": 0.0,
+        }
+
+    @contextmanager
+    def _locked(self):
+        """Yield the refilled bucket state (None if another process holds the lock); changes are written back."""
+        if not self.path:
+            self._refill(self._state)
+            yield self._state
+            return
+        # Held only for a read-modify-write, never across an await; called on the event loop,
+        # so a busy lock is not waited for
+        with open(self.path, "a+", encoding="utf-8") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+            try:
+                f.seek(0)
+                try:
+                    state = {**self._full(), **json.loads(f.read() or "{}")}
+                except ValueError:
+                    state = self._full()
+                self._refill(state)
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _refill(self, state: dict):
+        now = time.time()
+        elapsed = max(0.0, now - state["updated"])
+        state["requests"] = min(self.request_capacity, state["requests"] + elapsed * self.request_rate)
+        state["tokens"] = min(self.token_capacity, state["tokens"] + elapsed * self.token_rate)
+        state["updated"] = now
+        # Apply what was recorded while the lock was busy
+        if self._pending_tokens:
+            state["tokens"] = min(self.token_capacity, state["tokens"] + self._pending_tokens)
+            self._pending_tokens = 0.0
+        if self._pending_block:
+            state["blocked_until"] = max(state["blocked_until"], self.blocked_until)
+            # Start from an empty request bucket so processes do not all resume at once
+            state["requests"] = min(state["requests"], 0.0)
+            self._pending_block = False
+        self.blocked_until = state["blocked_until"]
+
+    def try_consume(self, tokens: int, reserve: float = 0.0) -> float:
+        """Take one request and `tokens` tokens; return 0 on success, else seconds to wait."""
+        now = time.time()
+        if self.blocked_until > now:
+            if self._pending_block or self._pending_tokens:
+                # Let the other processes see the pause as soon as the lock is free
+                self._flush()
+            return self.blocked_until - now
+        with self._locked() as state:
+            if state is None:
+                return _POLL_INTERVAL
+            now = state["updated"]
+            if state["blocked_until"] > now:
+                return state["blocked_until"] - now
+
+            wait = 0.0
+            if self.request_rate > 0:
+                need = min(self.request_capacity, 1.0 + reserve * self.request_capacity)
+                if state["requests"] < need:
+                    wait = max(wait, (need - state["requests"]) / self.request_rate)
+            if self.token_rate > 0:
+                # A request larger than the bucket waits for a full bucket, not forever
+                need = min(self.token_capacity, tokens + reserve * self.token_capacity)
+                if state["tokens"] < need:
+                    wait = max(wait, (need - state["tokens"]) / self.token_rate)
+            if wait > 0:
+                return wait
+
+            if self.request_rate > 0:
+                state["requests"] -= 1.0
+            if self.token_rate > 0:
+                state["tokens"] -= tokens
+            return 0.0
+
+    def adjust_tokens(self, delta: float):
+        """Return (positive) or charge (negative) tokens once actual usage is known."""
+        if self.token_rate <= 0:
+            return
+        self._pending_tokens += delta
+        self._flush()
+
+    def block(self, seconds: float):
+        """Pause all requests; this process at once, the others from the next locked update."""
+        self.blocked_until = max(self.blocked_until, time.time() + seconds)
+        self._pending_block = True
+        self._flush()
+
+    def _flush(self):
+        with self._locked():
+            pass
+
+
+class Admission:
+    """Rate-limit admission for the attempts of one logical GigaChat request."""
+
+    def __init__(self, limiter: "GigaChatRateLimiter", tokens: int, priority: str):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.priority = priority
+
+    async def acquire(self):
+        await self.limiter.acquire(self.tokens, self.priority)
+
+    def try_acquire(self) -> bool:
+        """Budget for an optional extra attempt (a hedged request), without queueing."""
+        return self.limiter.try_acquire(self.tokens)
+
+    def settle(self, actual: Optional[int]):
+        """Correct the token bucket with the usage GigaChat reported for the winning attempt."""
+        self.limiter.settle(self.tokens, actual)
+
+
+class GigaChatRateLimiter:
+    """Priority queue in front of the shared buckets for this worker process."""
+
+    def __init__(
+        self,
+        rps: float = GIGACHAT_RPS_LIMIT,
+        tpm: float = GIGACHAT_TPM_LIMIT,
+        burst_seconds: float = GIGACHAT_RATE_BURST_SECONDS,
+        state_dir: str = GIGACHAT_RATE_STATE_DIR,
+    ):
+        self.enabled = rps > 0 or tpm > 0
+        path = os.path.join(state_dir, "shadowmed-gigachat-rate.json") if state_dir else None
+        self.buckets = SharedBuckets(rps, tpm, burst_seconds, path) if self.enabled else None
+        # Without limits requests only wait out a 429 pause of this process
+        self.blocked_until = 0.0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.granted = {priority: 0 for priority in PRIORITIES}
+        self.rejected = {priority: 0 for priority in PRIORITIES}
+        self.queue_wait_max = 0.0
+
+    async def acquire(self, tokens: int = 0, priority: str = "live"):
+        """Wait for budget for one request of about `tokens` tokens (see settle)."""
+        max_wait = GIGACHAT_RATE_LIVE_MAX_WAIT if priority == "live" else GIGACHAT_RATE_BACKGROUND_MAX_WAIT
+        queued = time.perf_counter()
+        if not self.enabled:
+            pause = self.blocked_until - time.time()
+            if pause > 0:
+                await self._wait_pause(pause, max_wait, priority)
+            self.granted[priority] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._seq), tokens, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        GIGACHAT_RATE_QUEUE_DEPTH.labels(priority).inc()
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self.rejected[priority] += 1
+            GIGACHAT_RATE_REJECTED.labels(priority).inc()
+            raise RateLimitExceeded(f"GigaChat rate limit: {priority} request waited over {max_wait:.1f}s")
+        finally:
+            GIGACHAT_RATE_QUEUE_DEPTH.labels(priority).dec()
+
+        waited = time.perf_counter() - queued
+        self.granted[priority] += 1
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+        GIGACHAT_RATE_QUEUE_SECONDS.labels(priority).observe(waited)
+
+    async def _wait_pause(self, pause: float, max_wait: float, priority: str):
+        """Sit out a 429 pause; a pause longer than the priority allows is rejected at once."""
+        if pause > max_wait:
+            self.rejected[priority] += 1
+            GIGACHAT_RATE_REJECTED.labels(priority).inc()
+            raise RateLimitExceeded(f"GigaChat rate limit: {priority} request would wait {pause:.1f}s")
+        GIGACHAT_RATE_QUEUE_DEPTH.labels(priority).inc()
+        try:
+            await asyncio.sleep(pause)
+        finally:
+            GIGACHAT_RATE_QUEUE_DEPTH.labels(priority).dec()
+        self.queue_wait_max = max(self.queue_wait_max, pause)
+        GIGACHAT_RATE_QUEUE_SECONDS.labels(priority).observe(pause)
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        """Take budget only if it is available now and nobody is queued."""
+        if not self.enabled:
+            return self.blocked_until <= time.time()
+        if any(not future.done() for _, _, _, future in self._waiters):
+            return False
+        return self.buckets.try_consume(tokens) <= 0
+
+    def admission(self, tokens: int = 0, priority: str = "live") -> Admission:
+        return Admission(self, tokens, priority)
+
+    async def _dispatch(self):
+        """Grant the head of the queue whenever the buckets allow it."""
+        while self._waiters:
+            rank, _, tokens, future = self._waiters[0]
+            if future.done():
+                # Rejected or cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            reserve = GIGACHAT_RATE_LIVE_RESERVE if rank > PRIORITIES["live"] else 0.0
+            wait = self.buckets.try_consume(tokens, reserve)
+            if wait <= 0:
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+                continue
+            # Re-check soon: a live request may jump the queue, other processes refill too
+            await asyncio.sleep(min(wait, _POLL_INTERVAL))
+
+    def settle(self, charged: int, actual: Optional[int]):
+        """Correct the token bucket with the usage GigaChat reported."""
+        if self.enabled and actual is not None and charged:
+            self.buckets.adjust_tokens(charged - actual)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """GigaChat answered 429: hold every process of the worker until the limit resets."""
+        pause = retry_after if retry_after is not None else GIGACHAT_RATE_429_PAUSE
+        logger.warning(f"GigaChat rate limit hit, pausing requests for {pause:.1f}s")
+        if self.enabled:
+            self.buckets.block(pause)
+        else:
+            self.blocked_until = max(self.blocked_until, time.time() + pause)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": sum(1 for _, _, _, future in self._waiters if not future.done()),
+            "granted": dict(self.granted),
+            "rejected": dict(self.rejected),
+            "queue_wait_max": self.queue_wait_max,
+        }
+
+
+# Shared by all sessions of this worker process (and, via the state file, by all processes)
+gigachat_rate_limiter = GigaChatRateLimiter()
@@ -0,0 +1,412 @@
+"""
+Offline replay of recorded rep speech through the doctor agent pipeline.
+Feeds WAV files through the same VAD, STT, GigaChatLLM and TTS chain as a LiveKit
+session, without a LiveKit server. Remote providers are replaced by local stand-ins
+(scripted STT, tone TTS, mock GigaChat/Next.js API). The doctor's synthesised audio
+and per-stage timestamps of every turn are written to disk. Many recordings can be
+replayed in parallel as a load test.
+
+Usage:
+    python replay.py recordings/*.wav --out-dir replay-out --parallel 8
+    python replay.py visit.wav --repeat 50 --parallel 50 --realtime
+
+A recording's transcript, one utterance per line, is read from <name>.txt next to it
+(used by the scripted STT).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+import wave
+from array import array
+from typing import Optional
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import (
+    stt,
+    tts,
+    utils,
+    vad as agents_vad,
+    APIConnectOptions,
+    DEFAULT_API_CONNECT_OPTIONS,
+    NOT_GIVEN,
+    NotGivenOr,
+)
+
+from metrics import latency_summary
+from mock_services import MockServices
+
+logger = logging.getLogger("shadowmed.replay")
+
+REPLAY_FRAME_MS = 20
+# Silence appended after a recording so its last utterance is closed by the VAD
+REPLAY_TAIL_SILENCE_MS = 1500
+# Derived per-turn durations: name -> (from mark, to mark)
+TURN_STAGES = {
+    # Waiting for the previous reply to finish (fast replay feeds audio ahead of the doctor)
+    "turn_queue": ("speech_end", "stt_start"),
+    "stt": ("stt_start", "stt_done"),
+    "llm_ttft": ("stt_done", "llm_first_token"),
+    "llm_total": ("stt_done", "llm_done"),
+    "tts_ttfb": ("llm_first_token", "tts_first_audio"),
+    "response_latency": ("speech_end", "tts_first_audio"),
+    "turn_total": ("speech_end", "tts_done"),
+}
+
+
+class ScriptedSTT(stt.STT):
+    """STT stand-in: returns the next line of the recording's transcript after a fixed latency."""
+
+    def __init__(self, transcript: list, latency: float = 0.2):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=False, interim_results=False))
+        self._lines = list(transcript)
+        self._index = 0
+        self.latency = latency
+
+    async def _recognize_impl(
+        self,
+        buffer,
+        *,
+        language: NotGivenOr[str] = NOT_GIVEN,
+        conn_options: APIConnectOptions,
+    ) -> stt.SpeechEvent:
+        await asyncio.sleep(self.latency)
+        if self._index < len(self._lines):
+            text = self._lines[self._index]
+        else:
+            text = f"Реплика представителя номер {self._index + 1}."
+        self._index += 1
+        return stt.SpeechEvent(
+            type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+            alternatives=[stt.SpeechData(language="ru", text=text)],
+        )
+
+
+class ToneTTS(tts.TTS):
+    """TTS stand-in: a quiet tone as long as the text would take to say."""
+
+    def __init__(self, latency: float = 0.15, sample_rate: int = 24000, chars_per_second: float = 15.0):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=sample_rate,
+            num_channels=1,
+        )
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+        # 100 ms of a 220 Hz tone (a whole number of periods, so chunks join seamlessly)
+        samples = sample_rate // 10
+        self.chunk = array(
+            "h", (int(2000 * math.sin(2 * math.pi * 220 * i / sample_rate)) for i in range(samples))
+        ).tobytes()
+
+    def synthesize(
+        self,
+        text: str,
+        *,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+    ) -> "ToneChunkedStream":
+        return ToneChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+class ToneChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts: ToneTTS, input_text: str, conn_options: APIConnectOptions):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._tone_tts = tts
+
+    async def _run(self, output_emitter: tts.AudioEmitter):
+        await asyncio.sleep(self._tone_tts.latency)
+        output_emitter.initialize(
+            request_id=utils.shortuuid(),
+            sample_rate=self._tone_tts.sample_rate,
+            num_channels=1,
+            mime_type="audio/pcm",
+        )
+        chunks = max(2, math.ceil(len(self._input_text) / self._tone_tts.chars_per_second * 10))
+        for _ in range(chunks):
+            output_emitter.push(self._tone_tts.chunk)
+            await asyncio.sleep(0)
+        output_emitter.flush()
+
+
+def read_wav_frames(path: str) -> tuple:
+    """Read a 16-bit PCM WAV as mono frames of REPLAY_FRAME_MS; returns (sample_rate, frames)."""
+    with wave.open(path, "rb") as w:
+        if w.getsampwidth() != 2:
+            raise Exception(f"{path}: only 16-bit PCM WAV files are supported")
+        sample_rate = w.getframerate()
+        channels = w.getnchannels()
+        pcm = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+    if channels > 1:
+        pcm = pcm.reshape(-1, channels).mean(axis=1).astype(np.int16)
+
+    samples_per_frame = sample_rate * REPLAY_FRAME_MS // 1000
+    tail = np.zeros(sample_rate * REPLAY_TAIL_SILENCE_MS // 1000, dtype=np.int16)
+    pcm = np.concatenate([pcm, tail])
+    frames = []
+    for start in range(0, len(pcm) - samples_per_frame + 1, samples_per_frame):
+        frames.append(rtc.AudioFrame(
+            data=pcm[start:start + samples_per_frame].tobytes(),
+            sample_rate=sample_rate,
+            num_channels=1,
+            samples_per_channel=samples_per_frame,
+        ))
+    return sample_rate, frames
+
+
+def read_transcript(wav_path: str) -> list:
+    path = os.path.splitext(wav_path)[0] + ".txt"
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class ReplaySession:
+    """One replayed conversation: input recording -> doctor replies, with stage timestamps."""
+
+    def __init__(self, name: str, wav_path: str, doctor_agent, vad, stt_instance: stt.STT, tts_instance: tts.TTS, args):
+        self.name = name
+        self.wav_path = wav_path
+        self.doctor_agent = doctor_agent
+        self.vad = vad
+        self.stt = stt_instance
+        self.tts = tts_instance
+        self.realtime = args.realtime
+        self.out_dir = args.out_dir
+        self.visit_id = args.visit_id or f"replay-{name}"
+        self.turns: list = []
+        self._audio = bytearray()
+        self._started = 0.0
+
+    def _clock(self) -> float:
+        return time.perf_counter() - self._started
+
+    def _write_audio(self, frame: rtc.AudioFrame, at: Optional[float]):
+        # In real time the reply is placed where it would be heard, otherwise replies are appended
+        if at is not None and self.realtime:
+            target = int(at * self.tts.sample_rate) * 2
+            if len(self._audio) < target:
+                self._audio.extend(bytes(target - len(self._audio)))
+        self._audio.extend(frame.data.tobytes())
+
+    async def run(self) -> dict:
+        from livekit.agents import llm
+
+        sample_rate, frames = read_wav_frames(self.wav_path)
+        visit = await self.doctor_agent.get_visit_data(self.visit_id)
+        doctor = self.doctor_agent.visit_cache.normalize_doctor(visit.get("doctor"))
+        system_prompt = self.doctor_agent.build_system_prompt(doctor.get("name") or "Доктор", doctor)
+        giga_llm = self.doctor_agent.GigaChatLLM(visit_id=self.visit_id, doctor_prompt=system_prompt, streaming=True)
+        chat_ctx = llm.ChatContext()
+
+        vad_stream = self.vad.stream()
+        utterances: asyncio.Queue = asyncio.Queue()
+        self._started = time.perf_counter()
+
+        async def feed():
+            frame_duration = REPLAY_FRAME_MS / 1000
+            for i, frame in enumerate(frames):
+                vad_stream.push_frame(frame)
+                if self.realtime:
+                    await asyncio.sleep(max(0.0, (i + 1) * frame_duration - self._clock()))
+                else:
+                    await asyncio.sleep(0)
+            vad_stream.end_input()
+
+        async def detect():
+            async for ev in vad_stream:
+                if ev.type == agents_vad.VADEventType.END_OF_SPEECH:
+                    await utterances.put((self._clock(), ev.frames))
+            await utterances.put(None)
+
+        async def respond():
+            while (item := await utterances.get()) is not None:
+                await self._turn(giga_llm, chat_ctx, *item)
+
+        try:
+            await asyncio.gather(feed(), detect(), respond())
+        finally:
+            await vad_stream.aclose()
+            await giga_llm.context_window.aclose()
+
+        return self._save(sample_rate, len(frames) * REPLAY_FRAME_MS / 1000)
+
+    async def _turn(self, giga_llm, chat_ctx, speech_end: float, speech_frames: list):
+        marks = {"speech_end": speech_end, "stt_start": self._clock()}
+        event = await self.stt.recognize(buffer=speech_frames, language="ru")
+        text = event.alternatives[0].text if event.alternatives else ""
+        marks["stt_done"] = self._clock()
+        if not text.strip():
+            return
+        chat_ctx.add_message(role="user", content=text)
+
+        synth = self.tts.stream()
+
+        async def generate() -> str:
+            parts = []
+            async with giga_llm.chat(chat_ctx=chat_ctx) as llm_stream:
+                async for chunk in llm_stream:
+                    content = chunk.delta.content if chunk.delta else None
+                    if content:
+                        marks.setdefault("llm_first_token", self._clock())
+                        parts.append(content)
+                        synth.push_text(content)
+            marks["llm_done"] = self._clock()
+            synth.end_input()
+            return "".join(parts)
+
+        generation = asyncio.create_task(generate())
+        try:
+            async for audio in synth:
+                first = "tts_first_audio" not in marks
+                marks.setdefault("tts_first_audio", self._clock())
+                self._write_audio(audio.frame, marks["tts_first_audio"] if first else None)
+            reply = await generation
+        finally:
+            await synth.aclose()
+        marks["tts_done"] = self._clock()
+        chat_ctx.add_message(role="assistant", content=reply)
+
+        durations = {
+            stage: marks[end] - marks[start]
+            for stage, (start, end) in TURN_STAGES.items()
+            if start in marks and end in marks
+        }
+        self.turns.append({"transcript": text, "reply": reply, "marks": marks, "durations": durations})
+
+    def _save(self, sample_rate: int, input_duration: float) -> dict:
+        os.makedirs(self.out_dir, exist_ok=True)
+        wav_path = os.path.join(self.out_dir, f"{self.name}.wav")
+        with wave.open(wav_path, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.tts.sample_rate)
+            w.writeframes(bytes(self._audio))
+
+        result = {
+            "name": self.name,
+            "input": self.wav_path,
+            "input_sample_rate": sample_rate,
+            "input_duration": input_duration,
+            "output": wav_path,
+            "wall_time": self._clock(),
+            "turns": self.turns,
+        }
+        with open(os.path.join(self.out_dir, f"{self.name}.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        return result
+
+
+async def run_replay(args) -> dict:
+    services = None
+    if not args.live:
+        services = MockServices(ttft_ms=args.ttft_ms, jitter_ms=args.jitter_ms, token_delay_ms=args.token_delay_ms)
+        await services.start()
+        # Agent modules read their configuration at import time
+        workdir = tempfile.mkdtemp(prefix="shadowmed-replay-")
+        os.environ.update(services.env())
+        os.environ["GIGACHAT_TOKEN_CACHE_DIR"] = workdir
+        os.environ["MESSAGE_JOURNAL_PATH"] = os.path.join(workdir, "journal.jsonl")
+        os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts-cache")
+        os.environ.pop("AGENT_SERVICE_TOKEN", None)
+
+    import doctor_agent
+    from http_pool import http_pool
+    from message_journal import message_journal
+    from gigachat_auth import gigachat_tokens
+
+    http_pool.acquire()
+    message_journal.acquire()
+    await gigachat_tokens.get_token()
+
+    try:
+        # One VAD model and one TTS per process, as prewarm() does for a worker
+        vad = doctor_agent.create_vad()
+        if args.tts == "tone":
+            tts_instance = doctor_agent.adapt_tts(ToneTTS(latency=args.tts_latency_ms / 1000), voice="tone", model="replay")
+        else:
+            tts_instance = doctor_agent.create_tts()
+
+        jobs = []
+        for wav_path in args.inputs:
+            stem = os.path.splitext(os.path.basename(wav_path))[0]
+            for k in range(args.repeat):
+                name = stem if args.repeat == 1 else f"{stem}-{k}"
+                if args.stt == "scripted":
+                    stt_instance = ScriptedSTT(read_transcript(wav_path), latency=args.stt_latency_ms / 1000)
+                else:
+                    stt_instance = doctor_agent.create_stt()
+                jobs.append(ReplaySession(name, wav_path, doctor_agent, vad, stt_instance, tts_instance, args))
+
+        semaphore = asyncio.Semaphore(args.parallel)
+
+        async def run_one(session: ReplaySession):
+            async with semaphore:
+                try:
+                    return await session.run()
+                except Exception as e:
+                    logger.error(f"Replay {session.name} failed: {e}")
+                    return {"name": session.name, "error": str(e), "turns": []}
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[run_one(session) for session in jobs])
+        wall_time = time.perf_counter() - started
+    finally:
+        await message_journal.release()
+        await gigachat_tokens.aclose()
+        await http_pool.release()
+        if services is not None:
+            await services.aclose()
+
+    turns = [turn for result in results for turn in result["turns"]]
+    summary = {
+        "conversations": len(results),
+        "failed": sum(1 for result in results if "error" in result),
+        "turns": len(turns),
+        "parallel": args.parallel,
+        "realtime": args.realtime,
+        "wall_time": wall_time,
+        "stages": {
+            stage: latency_summary([turn["durations"][stage] for turn in turns if stage in turn["durations"]])
+            for stage in TURN_STAGES
+        },
+    }
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded rep speech through the doctor agent pipeline")
+    parser.add_argument("inputs", nargs="+", help="16-bit PCM WAV recordings")
+    parser.add_argument("--out-dir", default="replay-out")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay every recording this many times")
+    parser.add_argument("--parallel", type=int, default=1, help="Conversations replayed at once")
+    parser.add_argument("--realtime", action="store_true", help="Feed audio at real-time pace")
+    parser.add_argument("--stt", choices=["scripted", "default"], default="scripted")
+    parser.add_argument("--tts", choices=["tone", "default"], default="tone")
+    parser.add_argument("--stt-latency-ms", type=float, default=200.0)
+    parser.add_argument("--tts-latency-ms", type=float, default=150.0)
+    parser.add_argument("--live", action="store_true", help="Use the configured GigaChat/Next.js API instead of stand-ins")
+    parser.add_argument("--visit-id", help="Visit to load the doctor from (with --live)")
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_replay(args))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
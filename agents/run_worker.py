@@ -2,22 +2,70 @@
 """
 Run agent as a worker that receives dispatch requests from LiveKit.
 For production deployment.
+
+With AGENT_DISPATCH_ENABLED=true the worker registers under AGENT_NAME for explicit
+dispatch and serves a local dispatch endpoint (see dispatch_server.py), so new visits
+are handed to already-warm job processes instead of starting a process per visit.
 """
 
 import os
+import tempfile
 from dotenv import load_dotenv
-from doctor_agent import entrypoint
-from livekit.agents import cli, WorkerOptions
 
 load_dotenv()
 
+# Prometheus /metrics port of the worker (0 disables the endpoint)
+AGENT_METRICS_PORT = int(os.getenv("AGENT_METRICS_PORT", "9464"))
+AGENT_METRICS_DIR = os.getenv(
+    "AGENT_METRICS_DIR",
+    os.path.join(tempfile.gettempdir(), "shadowmed-agent-metrics"),
+)
+if AGENT_METRICS_PORT:
+    # Job processes write their metrics to files the worker's endpoint aggregates;
+    # prometheus_client picks the multiprocess mode at import, so set it first
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", AGENT_METRICS_DIR)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+from doctor_agent import entrypoint, prewarm
+from livekit.agents import cli, WorkerOptions
+from load_control import admission_control, AGENT_LOAD_THRESHOLD
+
+AGENT_DISPATCH_ENABLED = os.getenv("AGENT_DISPATCH_ENABLED", "false").lower() == "true"
+# Warm (prewarmed) job processes kept ready for incoming visits
+AGENT_NUM_IDLE_PROCESSES = int(os.getenv("AGENT_NUM_IDLE_PROCESSES", "3"))
+
 if __name__ == "__main__":
+    # SIGUSR1 (or the AGENT_DRAIN_FILE) drains the worker before a rolling deploy
+    admission_control.install_signal_handler()
+
+    worker_options = {}
+    if AGENT_DISPATCH_ENABLED:
+        from dispatch_server import DispatchServer, AGENT_NAME
+
+        DispatchServer().start_in_thread()
+        # Explicit dispatch: jobs arrive only through the dispatch endpoint
+        worker_options["agent_name"] = AGENT_NAME
+
+    if AGENT_METRICS_PORT:
+        # Per-turn stage latencies, GigaChat/HTTP errors, persistence and load (see metrics.py)
+        worker_options["prometheus_port"] = AGENT_METRICS_PORT
+        worker_options["prometheus_multiproc_dir"] = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+
     # Run as a worker that receives job dispatches
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
+            # Load VAD/TTS models once per worker process instead of once per job
+            prewarm_fnc=prewarm,
+            num_idle_processes=AGENT_NUM_IDLE_PROCESSES,
+            # Report CPU, event-loop lag, sessions and in-flight GigaChat requests as load;
+            # LiveKit stops sending rooms above the threshold
+            load_fnc=admission_control.load_fnc,
+            load_threshold=AGENT_LOAD_THRESHOLD,
+            # Enforce the per-worker session cap and draining mode
+            request_fnc=admission_control.request_fnc,
             # Worker will automatically receive dispatch requests for rooms
             # when participants join
+            **worker_options,
         )
     )
-
@@ -0,0 +1,221 @@
+"""
+Speculative GigaChat generation before the user turn is committed.
+Once the rep stops speaking (VAD end of speech) and a final transcript is there, a GigaChat
+request is started for it at once, while end-of-turn detection is still waiting out
+min_endpointing_delay. With a streaming STT an interim transcript is used as well, after it
+has been stable for a moment. When the turn is committed and its transcript matches
+closely, the reply that is already streaming is used; otherwise it is cancelled and a
+normal request runs. Nothing is persisted for a speculative request, and a per-session cap
+bounds the extra API cost.
+"""
+
+import asyncio
+import difflib
+import logging
+import os
+import re
+from typing import AsyncIterator, Callable, Optional
+
+from metrics import SPECULATIVE_REQUESTS
+
+logger = logging.getLogger("shadowmed.speculation")
+
+GIGACHAT_SPECULATIVE = os.getenv("GIGACHAT_SPECULATIVE", "false").lower() == "true"
+# How long an interim transcript (streaming STT only) must stay unchanged after end of
+# speech before speculating; a final transcript starts the request at once
+SPECULATIVE_STABLE_MS = float(os.getenv("SPECULATIVE_STABLE_MS", "200"))
+# difflib similarity of the speculative and final transcripts needed to use the reply
+SPECULATIVE_MIN_SIMILARITY = float(os.getenv("SPECULATIVE_MIN_SIMILARITY", "0.9"))
+SPECULATIVE_MIN_CHARS = int(os.getenv("SPECULATIVE_MIN_CHARS", "8"))
+SPECULATIVE_MAX_PER_SESSION = int(os.getenv("SPECULATIVE_MAX_PER_SESSION", "40"))
+
+# messages -> reply tokens
+GenerateFn = Callable[[list], AsyncIterator[str]]
+# messages of the conversation before the pending user turn
+ContextFn = Callable[[], list]
+
+_DONE = object()
+
+
+def normalize_transcript(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+
+def transcript_similarity(first: str, second: str) -> float:
+    """Similarity ratio (0..1) of two transcripts, ignoring case and punctuation."""
+    first, second = normalize_transcript(first), normalize_transcript(second)
+    if first == second:
+        return 1.0
+    return difflib.SequenceMatcher(None, first, second).ratio()
+
+
+class _Speculation:
+    """One speculative request; tokens are buffered until the turn is committed."""
+
+    def __init__(self, transcript: str, prefix: list, generate: GenerateFn):
+        self.transcript = transcript
+        self.prefix = prefix
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.failed = False
+        self.task = asyncio.create_task(self._run(generate(prefix + [{"role": "user", "content": transcript}])))
+
+    async def _run(self, tokens: AsyncIterator[str]):
+        try:
+            async for token in tokens:
+                self.queue.put_nowait(token)
+        except Exception as e:
+            logger.warning(f"Speculative request failed: {e}")
+            self.failed = True
+            self.queue.put_nowait(e)
+            return
+        self.queue.put_nowait(_DONE)
+
+    async def tokens(self) -> AsyncIterator[str]:
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+
+
+class SpeculativeGenerator:
+    """Starts GigaChat requests on stable transcripts of a session before its turn is committed."""
+
+    def __init__(
+        self,
+        generate: GenerateFn,
+        context: ContextFn,
+        stable_delay: float = SPECULATIVE_STABLE_MS / 1000.0,
+        min_similarity: float = SPECULATIVE_MIN_SIMILARITY,
+        max_per_session: int = SPECULATIVE_MAX_PER_SESSION,
+    ):
+        self.generate = generate
+        self.context = context
+        self.stable_delay = stable_delay
+        self.min_similarity = min_similarity
+        self.max_per_session = max_per_session
+        self.started = 0
+        self.committed = 0
+        self.discarded = 0
+        # Transcript of the pending user turn: final STT segments plus the current interim
+        self._finals: list = []
+        self._interim = ""
+        self._end_of_speech = False
+        self._current: Optional[_Speculation] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def transcript(self) -> str:
+        return " ".join(self._finals + [self._interim]).strip()
+
+    def on_transcript(self, text: str, is_final: bool):
+        """STT interim or final transcript of the pending user turn."""
+        if is_final:
+            self._finals.append(text.strip())
+            self._interim = ""
+        else:
+            self._interim = text.strip()
+        if self._end_of_speech:
+            self._schedule()
+
+    def on_end_of_speech(self):
+        """The rep stopped speaking: the end of the utterance looks likely."""
+        self._end_of_speech = True
+        self._schedule()
+
+    def on_start_of_speech(self):
+        """The rep resumed speaking: the transcript will change, stop speculating."""
+        self._end_of_speech = False
+        self._cancel_timer()
+        self._cancel("cancelled")
+
+    def _schedule(self):
+        self._cancel_timer()
+        if not self._interim:
+            # Nothing left for STT to revise: every second waited is lost head start
+            self._maybe_start()
+            return
+        self._timer = asyncio.get_running_loop().call_later(self.stable_delay, self._maybe_start)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _cancel(self, outcome: str):
+        if self._current is not None:
+            self._current.cancel()
+            self._current = None
+            SPECULATIVE_REQUESTS.labels(outcome).inc()
+
+    def _maybe_start(self):
+        self._timer = None
+        transcript = self.transcript
+        if len(transcript) < SPECULATIVE_MIN_CHARS:
+            return
+        current = self._current
+        if current is not None and not current.failed:
+            if transcript_similarity(current.transcript, transcript) >= self.min_similarity:
+                return
+        self._cancel("cancelled")
+        if self.started >= self.max_per_session:
+            return
+
+        try:
+            prefix = self.context()
+        except Exception as e:
+            logger.warning(f"Speculative request skipped, no chat context: {e}")
+            return
+        self.started += 1
+        SPECULATIVE_REQUESTS.labels("started").inc()
+        self._current = _Speculation(transcript, prefix, self.generate)
+        logger.debug(f"Speculative request started: {transcript[:50]}...")
+
+    def take(self, messages: list) -> Optional[AsyncIterator[str]]:
+        """Claim the speculative reply for a committed turn, or None to run a normal request.
+
+        messages is the full conversation of the turn (last message is the committed user text).
+        """
+        current = self._current
+        self._current = None
+        self._finals, self._interim, self._end_of_speech = [], "", False
+        self._cancel_timer()
+        if current is None:
+            return None
+
+        if (
+            current.failed
+            or not messages
+            or messages[-1].get("role") != "user"
+            or messages[:-1] != current.prefix
+            or transcript_similarity(current.transcript, messages[-1].get("content", "")) < self.min_similarity
+        ):
+            current.cancel()
+            self.discarded += 1
+            SPECULATIVE_REQUESTS.labels("discarded").inc()
+            return None
+
+        self.committed += 1
+        SPECULATIVE_REQUESTS.labels("committed").inc()
+        return current.tokens()
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "committed": self.committed,
+            "discarded": self.discarded,
+        }
+
+    async def aclose(self):
+        self._cancel_timer()
+        self._cancel("cancelled")
@@ -2,15 +2,46 @@
 """
 Helper script to start agent for a specific visit.
 Used by Next.js API to launch agent processes.
+
+If a long-lived worker is running (run_worker.py with AGENT_DISPATCH_ENABLED=true),
+the visit is handed to it through the local dispatch endpoint and this script exits
+immediately. Otherwise it falls back to running a dedicated worker for the visit.
 """
 
 import sys
 import os
 import json
-import asyncio
-from livekit.agents import cli
-from doctor_agent import entrypoint
-from livekit.agents import WorkerOptions
+import urllib.error
+import urllib.request
+
+AGENT_DISPATCH_URL = os.getenv("AGENT_DISPATCH_URL", "http://127.0.0.1:8081")
+
+
+def dispatch_to_worker(visit_id: str, room_name: str, doctor_name: str) -> bool:
+    """Hand the visit to a running worker; returns False if none is reachable."""
+    headers = {"Content-Type": "application/json"}
+    service_token = os.getenv("AGENT_SERVICE_TOKEN")
+    if service_token:
+        headers["x-service-token"] = service_token
+
+    request = urllib.request.Request(
+        f"{AGENT_DISPATCH_URL}/dispatch",
+        data=json.dumps({
+            "visit_id": visit_id,
+            "room": room_name,
+            "doctor_name": doctor_name,
+        }).encode("utf-8"),
+        headers=headers,
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            print(resp.read().decode("utf-8"))
+            return True
+    except (urllib.error.URLError, OSError) as e:
+        print(f"Agent worker not reachable at {AGENT_DISPATCH_URL}: {e}")
+        return False
+
 
 if __name__ == "__main__":
     # Parse command line arguments
@@ -21,6 +52,13 @@ if __name__ == "__main__":
     visit_id = sys.argv[1]
     room_name = sys.argv[2]
     doctor_name = sys.argv[3] if len(sys.argv) > 3 else "Доктор"
+
+    if dispatch_to_worker(visit_id, room_name, doctor_name):
+        sys.exit(0)
+
+    # No long-lived worker: run a dedicated one for this visit
+    from livekit.agents import cli, WorkerOptions
+    from doctor_agent import entrypoint, prewarm
     
     # Set metadata for job
     os.environ["VISIT_ID"] = visit_id
@@ -31,8 +69,9 @@ if __name__ == "__main__":
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
+            # Load VAD/TTS models once per worker process instead of once per job
+            prewarm_fnc=prewarm,
             # Prefer to run in-process for development
             # In production, use separate worker processes
         )
     )
-
@@ -0,0 +1,260 @@
+"""
+VAD-gated speech recognition for the rep's audio.
+The room audio is resampled to 16 kHz and run through the local Silero VAD; only speech
+segments (with a short pre-roll, trailing silence trimmed) are uploaded to the STT, so
+silence and background noise are never transcribed or billed. Endpointing is configurable:
+the silence that ends an utterance, the pre-roll padding, the shortest segment worth
+uploading and the longest utterance before it is split. Speech is accumulated in one
+preallocated buffer per stream instead of a frame list merged per utterance.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from livekit import rtc
+from livekit.agents import APIConnectOptions, DEFAULT_API_CONNECT_OPTIONS, NOT_GIVEN, stt, vad as agents_vad
+
+from metrics import STT_AUDIO_SECONDS, STT_ENDPOINTING_SECONDS, STT_SEGMENTS, latency_summary
+
+logger = logging.getLogger("shadowmed.stt_gate")
+
+STT_VAD_GATE = os.getenv("STT_VAD_GATE", "true").lower() == "true"
+# Sample rate of the audio handed to VAD and STT (Whisper works at 16 kHz)
+STT_SAMPLE_RATE = int(os.getenv("STT_SAMPLE_RATE", "16000"))
+# Silence that ends an utterance
+STT_MIN_SILENCE_MS = float(os.getenv("STT_MIN_SILENCE_MS", "400"))
+# Audio kept before the detected start of speech
+STT_PREFIX_PADDING_MS = float(os.getenv("STT_PREFIX_PADDING_MS", "300"))
+# Trailing silence left on an uploaded segment
+STT_TRAILING_SILENCE_MS = float(os.getenv("STT_TRAILING_SILENCE_MS", "150"))
+# Shorter segments (coughs, clicks) are not uploaded
+STT_MIN_SPEECH_MS = float(os.getenv("STT_MIN_SPEECH_MS", "150"))
+# Longer speech is split and transcribed in parts
+STT_MAX_UTTERANCE_S = float(os.getenv("STT_MAX_UTTERANCE_S", "15"))
+VAD_ACTIVATION_THRESHOLD = float(os.getenv("VAD_ACTIVATION_THRESHOLD", "0.5"))
+
+# STT.recognize retries by itself; the stream does not retry on top of it
+_STREAM_CONN_OPTIONS = APIConnectOptions(max_retry=0, timeout=DEFAULT_API_CONNECT_OPTIONS.timeout)
+
+
+def vad_options() -> dict:
+    """silero.VAD.load() options for the configured endpointing."""
+    return {
+        "min_silence_duration": STT_MIN_SILENCE_MS / 1000.0,
+        "prefix_padding_duration": STT_PREFIX_PADDING_MS / 1000.0,
+        # The gate splits long speech itself; VAD only needs room for one part
+        "max_buffered_speech": STT_MAX_UTTERANCE_S + 1.0,
+        "activation_threshold": VAD_ACTIVATION_THRESHOLD,
+    }
+
+
+class VADGatedSTT(stt.STT):
+    """Streaming STT that uploads only VAD speech segments to a non-streaming STT.
+
+    One instance per session: its counters are the session's audio and endpointing stats.
+    """
+
+    def __init__(
+        self,
+        wrapped: stt.STT,
+        vad: agents_vad.VAD,
+        min_speech: float = STT_MIN_SPEECH_MS / 1000.0,
+        max_utterance: float = STT_MAX_UTTERANCE_S,
+        trailing_silence: float = STT_TRAILING_SILENCE_MS / 1000.0,
+    ):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=True, interim_results=False))
+        self._wrapped = wrapped
+        self.vad = vad
+        self.min_speech = min_speech
+        self.max_utterance = max_utterance
+        self.trailing_silence = trailing_silence
+        self.received_seconds = 0.0
+        self.uploaded_seconds = 0.0
+        self.segments = {"sent": 0, "split": 0, "dropped": 0}
+        self._endpointing_delays: deque = deque(maxlen=1000)
+        self._wrapped.on("metrics_collected", self._on_metrics_collected)
+
+    @property
+    def model(self) -> str:
+        return self._wrapped.model
+
+    @property
+    def provider(self) -> str:
+        return self._wrapped.provider
+
+    async def _recognize_impl(
+        self,
+        buffer,
+        *,
+        language=NOT_GIVEN,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+    ) -> stt.SpeechEvent:
+        return await self._wrapped.recognize(buffer=buffer, language=language, conn_options=conn_options)
+
+    def stream(self, *, language=NOT_GIVEN, conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS):
+        return _GatedStream(self, language=language, conn_options=conn_options)
+
+    def _on_metrics_collected(self, *args, **kwargs):
+        self.emit("metrics_collected", *args, **kwargs)
+
+    def on_audio_received(self, seconds: float):
+        self.received_seconds += seconds
+        STT_AUDIO_SECONDS.labels("received").inc(seconds)
+
+    def on_segment(self, outcome: str, seconds: float = 0.0):
+        self.segments[outcome] += 1
+        STT_SEGMENTS.labels(outcome).inc()
+        if outcome != "dropped":
+            self.uploaded_seconds += seconds
+            STT_AUDIO_SECONDS.labels("uploaded").inc(seconds)
+
+    def on_end_of_speech(self, delay: float):
+        """Time from the last speech to the end-of-utterance decision."""
+        self._endpointing_delays.append(delay)
+        STT_ENDPOINTING_SECONDS.observe(delay)
+
+    def stats(self) -> dict:
+        return {
+            "received_seconds": self.received_seconds,
+            "uploaded_seconds": self.uploaded_seconds,
+            "upload_ratio": self.uploaded_seconds / self.received_seconds if self.received_seconds else 0.0,
+            "segments": dict(self.segments),
+            "endpointing_delay": latency_summary(list(self._endpointing_delays)),
+        }
+
+    async def aclose(self):
+        self._wrapped.off("metrics_collected", self._on_metrics_collected)
+
+
+class _GatedStream(stt.RecognizeStream):
+    """VAD events -> speech buffer -> STT.recognize, one segment at a time and in order."""
+
+    def __init__(self, gated: VADGatedSTT, *, language, conn_options: APIConnectOptions):
+        super().__init__(stt=gated, conn_options=_STREAM_CONN_OPTIONS, sample_rate=STT_SAMPLE_RATE)
+        self._gated = gated
+        self._language = language
+        self._wrapped_conn_options = conn_options
+        # Speech of the current utterance (16-bit mono), allocated once for the stream
+        self._buffer: Optional[bytearray] = None
+        self._length = 0
+
+    async def _metrics_monitor_task(self, event_aiter):
+        # Recognition metrics come from the wrapped STT
+        async for _ in event_aiter:
+            pass
+
+    def _append(self, frames: list):
+        if self._buffer is None:
+            capacity = int((self._gated.max_utterance + STT_PREFIX_PADDING_MS / 1000.0 + 1.0) * STT_SAMPLE_RATE) * 2
+            self._buffer = bytearray(capacity)
+        for frame in frames:
+            data = frame.data.cast("B")
+            end = min(len(self._buffer), self._length + len(data))
+            self._buffer[self._length:end] = data[:end - self._length]
+            self._length = end
+
+    def _seconds(self, length: int) -> float:
+        return length / 2 / STT_SAMPLE_RATE
+
+    def _cut(self, outcome: str, speech: float, trailing_silence: float = 0.0) -> Optional[rtc.AudioFrame]:
+        """Take the buffered speech as one frame (or drop it if too short) and reset the buffer."""
+        length, self._length = self._length, 0
+        if speech < self._gated.min_speech:
+            self._gated.on_segment("dropped")
+            return None
+        trim = max(0.0, trailing_silence - self._gated.trailing_silence)
+        length = max(0, length - int(trim * STT_SAMPLE_RATE) * 2)
+        if length == 0:
+            return None
+        self._gated.on_segment(outcome, self._seconds(length))
+        # One copy per segment: the buffer is reused for the next utterance meanwhile
+        return rtc.AudioFrame(
+            data=bytes(self._buffer[:length]),
+            sample_rate=STT_SAMPLE_RATE,
+            num_channels=1,
+            samples_per_channel=length // 2,
+        )
+
+    async def _run(self):
+        vad_stream = self._gated.vad.stream()
+        segments: asyncio.Queue = asyncio.Queue()
+
+        async def forward_input():
+            async for frame in self._input_ch:
+                if isinstance(frame, self._FlushSentinel):
+                    vad_stream.flush()
+                    continue
+                self._gated.on_audio_received(frame.duration)
+                vad_stream.push_frame(frame)
+            vad_stream.end_input()
+
+        async def segment_speech():
+            in_speech = False
+            split_speech = 0.0
+            async for ev in vad_stream:
+                if ev.type == agents_vad.VADEventType.START_OF_SPEECH:
+                    in_speech, split_speech = True, 0.0
+                    # The VAD's buffer so far: pre-roll padding and the speech that triggered it
+                    self._length = 0
+                    self._append(ev.frames)
+                    self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.START_OF_SPEECH))
+                elif ev.type == agents_vad.VADEventType.INFERENCE_DONE and in_speech:
+                    self._append(ev.frames)
+                    if self._seconds(self._length) >= self._gated.max_utterance:
+                        # Transcribe long speech in parts instead of waiting for a pause
+                        frame = self._cut("split", self._seconds(self._length))
+                        split_speech = ev.speech_duration
+                        if frame is not None:
+                            segments.put_nowait((frame, time.time()))
+                elif ev.type == agents_vad.VADEventType.END_OF_SPEECH:
+                    in_speech = False
+                    speech_end_time = time.time() - ev.silence_duration - ev.inference_duration
+                    self._gated.on_end_of_speech(ev.silence_duration + ev.inference_duration)
+                    self._event_ch.send_nowait(
+                        stt.SpeechEvent(type=stt.SpeechEventType.END_OF_SPEECH, speech_end_time=speech_end_time)
+                    )
+                    speech = max(0.0, ev.speech_duration - split_speech) if split_speech else ev.speech_duration
+                    frame = self._cut("sent", speech, ev.silence_duration)
+                    if frame is not None:
+                        segments.put_nowait((frame, speech_end_time))
+            segments.put_nowait(None)
+
+        async def recognize():
+            while (segment := await segments.get()) is not None:
+                frame, speech_end_time = segment
+                try:
+                    event = await self._gated._wrapped.recognize(
+                        buffer=frame,
+                        language=self._language,
+                        conn_options=self._wrapped_conn_options,
+                    )
+                except Exception as e:
+                    # One lost utterance, not a dead STT stream for the rest of the visit
+                    logger.warning(f"Speech segment not transcribed: {e}")
+                    continue
+                if not event.alternatives or not event.alternatives[0].text:
+                    continue
+                self._event_ch.send_nowait(
+                    stt.SpeechEvent(
+                        type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+                        alternatives=[event.alternatives[0]],
+                        speech_end_time=speech_end_time,
+                    )
+                )
+
+        tasks = [
+            asyncio.create_task(forward_input()),
+            asyncio.create_task(segment_speech()),
+            asyncio.create_task(recognize()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await vad_stream.aclose()
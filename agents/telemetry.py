@@ -0,0 +1,137 @@
+"""
+Structured logging and per-turn latency spans for the doctor agent.
+Log records are handed to a background thread through a queue, so logging never
+blocks the event loop on stderr. Every voice turn is traced as a span with stage
+timestamps tagged with the visit and doctor persona; stage durations also feed the
+turn-stage Prometheus histogram.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Optional
+
+from metrics import TURN_STAGE_SECONDS
+
+AGENT_LOG_LEVEL = os.getenv("AGENT_LOG_LEVEL", "INFO").upper()
+# "text" or "json" (one JSON object per line)
+AGENT_LOG_FORMAT = os.getenv("AGENT_LOG_FORMAT", "text").lower()
+
+# Per-turn stages derived from span marks: name -> (from mark, to mark)
+TURN_STAGES = {
+    "stt": ("end_of_speech", "stt_final"),
+    "llm_queue": ("stt_final", "llm_request"),
+    "llm_ttft": ("llm_request", "llm_first_token"),
+    "llm_total": ("llm_request", "llm_done"),
+    # Live sessions save a reply once it is played out, so this includes the playout
+    "persist": ("llm_done", "persisted"),
+    "first_token_to_playout": ("llm_first_token", "playout_start"),
+    "response": ("end_of_speech", "playout_start"),
+}
+
+# LogRecord attributes that are not user-supplied extras
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+logger = logging.getLogger("shadowmed.telemetry")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """Route the agent's "shadowmed" loggers through a queue to a stderr writer thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    if AGENT_LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(process)d] %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    # Drain queued records on interpreter exit
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger("shadowmed")
+    root.setLevel(AGENT_LOG_LEVEL)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    # Not duplicated into the LiveKit worker's own log forwarding
+    root.propagate = False
+
+
+class TurnTracer:
+    """Per-turn spans of one visit: stage timestamps, durations and histogram observations."""
+
+    def __init__(self, visit_id: str, persona: str = "unknown"):
+        self.visit_id = visit_id
+        self.persona = persona or "unknown"
+        self.turn = 0
+        self._started: Optional[float] = None
+        self._marks: dict = {}
+        self._durations: dict = {}
+
+    def mark(self, stage: str):
+        """Record the first time a stage is reached in the current turn."""
+        now = time.perf_counter()
+        if stage == "end_of_speech" and self._marks:
+            # A new utterance closes whatever the previous turn got to
+            self.finish()
+        if self._started is None:
+            self._started = now
+        self._marks.setdefault(stage, now)
+
+    def record(self, stage: str, seconds: float):
+        """Record a duration measured elsewhere (e.g. TTS time to first byte from the session metrics)."""
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._durations[stage] = seconds
+
+    def finish(self):
+        """Close the current turn: observe stage histograms and log the span."""
+        if self._started is None:
+            return
+        durations = dict(self._durations)
+        for stage, (start, end) in TURN_STAGES.items():
+            if start in self._marks and end in self._marks:
+                durations[stage] = self._marks[end] - self._marks[start]
+        for stage, seconds in durations.items():
+            TURN_STAGE_SECONDS.labels(stage, self.persona).observe(seconds)
+
+        self.turn += 1
+        span = {
+            "visit_id": self.visit_id,
+            "persona": self.persona,
+            "turn": self.turn,
+            "marks": {stage: round(at - self._started, 4) for stage, at in self._marks.items()},
+            "durations": {stage: round(seconds, 4) for stage, seconds in durations.items()},
+        }
+        logger.info(f"Turn span: {json.dumps(span, ensure_ascii=False)}", extra={"span": span})
+
+        self._started = None
+        self._marks = {}
+        self._durations = {}
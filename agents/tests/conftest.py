@@ -0,0 +1,11 @@
+"""
+Unit tests of the agent modules. The modules import each other by bare name, as when the
+worker runs from agents/, so that directory is put on the import path.
+
+Run from agents/: python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,124 @@
+import asyncio
+
+from context_window import SUMMARY_HEADER, ContextWindow, estimate_messages_tokens, estimate_tokens
+
+
+def turns(count, size=90):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:03d}" + "ж" * size}
+        for i in range(count)
+    ]
+
+
+class Summarizer:
+    def __init__(self, result="итог", fail=False):
+        self.result = result
+        self.fail = fail
+        self.calls = []
+
+    async def __call__(self, previous, messages):
+        self.calls.append((previous, [m["content"][:3] for m in messages]))
+        if self.fail:
+            raise RuntimeError("GigaChat unavailable")
+        return self.result
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("ж" * 30) == 11
+    assert estimate_messages_tokens([{"role": "user", "content": "ж" * 30}, {"role": "user"}]) == 19
+
+
+def test_short_conversation_is_sent_verbatim():
+    async def run():
+        summarizer = Summarizer()
+        window = ContextWindow(summarizer, token_budget=3000, keep_recent=4)
+        messages = turns(6)
+        built = window.build(messages, "system")
+        await window.aclose()
+        return built, messages, summarizer
+
+    built, messages, summarizer = asyncio.run(run())
+    assert built == [{"role": "system", "content": "system"}] + messages
+    assert summarizer.calls == []
+
+
+def test_over_budget_prompt_drops_oldest_turns_until_summarized():
+    async def run():
+        window = ContextWindow(Summarizer(), token_budget=200, keep_recent=4)
+        built = window.build(turns(12), "system")
+        await window.aclose()
+        return built
+
+    built = asyncio.run(run())
+    # 7 tokens of system prompt and 36 per turn: the newest five turns fit, in order
+    assert estimate_messages_tokens(built) == 187
+    assert [m["content"][:3] for m in built[1:]] == ["007", "008", "009", "010", "011"]
+
+
+def test_never_drops_below_keep_recent():
+    async def run():
+        window = ContextWindow(Summarizer(), token_budget=10, keep_recent=4)
+        built = window.build(turns(12), "system")
+        await window.aclose()
+        return built
+
+    built = asyncio.run(run())
+    assert [m["content"][:3] for m in built[1:]] == ["008", "009", "010", "011"]
+
+
+def test_older_turns_are_folded_into_the_summary():
+    async def run():
+        summarizer = Summarizer("представитель рассказал о препарате")
+        window = ContextWindow(summarizer, token_budget=200, keep_recent=4)
+        messages = turns(12)
+        window.build(messages, "system")
+        await window._summary_task
+        built = window.build(messages, "system")
+        await window.aclose()
+        return window, built, summarizer
+
+    window, built, summarizer = asyncio.run(run())
+    assert summarizer.calls == [("", ["000", "001", "002", "003", "004", "005", "006", "007"])]
+    assert window.summarized_upto == 8
+    assert built[0]["content"] == f"system\n\n{SUMMARY_HEADER}\nпредставитель рассказал о препарате"
+    assert [m["content"][:3] for m in built[1:]] == ["008", "009", "010", "011"]
+
+
+def test_summary_waits_for_a_full_batch_of_turns():
+    async def run():
+        summarizer = Summarizer()
+        window = ContextWindow(summarizer, token_budget=100, keep_recent=4)
+        # Only two messages beyond keep_recent: not worth a summary yet
+        window.build(turns(6), "system")
+        await window.aclose()
+        return summarizer
+
+    assert asyncio.run(run()).calls == []
+
+
+def test_failed_summary_keeps_the_transcript():
+    async def run():
+        window = ContextWindow(Summarizer(fail=True), token_budget=200, keep_recent=4)
+        window.build(turns(12), "system")
+        await window._summary_task
+        await window.aclose()
+        return window
+
+    window = asyncio.run(run())
+    assert (window.summary, window.summarized_upto) == ("", 0)
+
+
+def test_shorter_transcript_resets_the_summary():
+    async def run():
+        window = ContextWindow(Summarizer(), token_budget=200, keep_recent=4)
+        window.build(turns(12), "system")
+        await window._summary_task
+        built = window.build(turns(2), "system")
+        await window.aclose()
+        return window, built
+
+    window, built = asyncio.run(run())
+    assert (window.summary, window.summarized_upto) == ("", 0)
+    assert built[0] == {"role": "system", "content": "system"}
+    assert len(built) == 3
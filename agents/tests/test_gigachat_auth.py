@@ -0,0 +1,80 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+
+from gigachat_auth import GigaChatTokenManager, parse_token_expiry
+from http_pool import http_pool
+
+
+def test_parse_token_expiry():
+    assert parse_token_expiry({"expires_at": 1_900_000_000_000}) == 1_900_000_000
+    assert parse_token_expiry({"expires_at": 1_900_000_000}) == 1_900_000_000
+    assert parse_token_expiry({"expires_in": 60}, now=100) == 160
+    assert parse_token_expiry({}, now=100) == 1900
+
+
+def serve_tokens(tmp_path, *responses):
+    """Token manager against a local OAuth stand-in answering with `responses` in order."""
+    responses = list(responses)
+
+    async def oauth(request):
+        return web.json_response(responses.pop(0))
+
+    async def run(action):
+        app = web.Application()
+        app.router.add_post("/oauth", oauth)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        manager = GigaChatTokenManager(
+            oauth_url=f"http://127.0.0.1:{runner.addresses[0][1]}/oauth",
+            authorization_key="test-key",
+            cache_dir=str(tmp_path),
+        )
+        try:
+            return await action(manager)
+        finally:
+            await manager.aclose()
+            await http_pool.aclose()
+            await runner.cleanup()
+
+    return run
+
+
+def test_token_is_fetched_once_and_cached(tmp_path):
+    run = serve_tokens(tmp_path, {"access_token": "token-1", "expires_in": 1800})
+
+    async def action(manager):
+        tokens = await asyncio.gather(*(manager.get_token() for _ in range(5)))
+        return manager, tokens
+
+    manager, tokens = asyncio.run(run(action))
+    assert tokens == ["token-1"] * 5
+    assert manager.refresh_count == 1
+    with open(manager.cache_path, encoding="utf-8") as f:
+        assert json.load(f)["access_token"] == "token-1"
+
+
+def test_response_without_token_is_an_error_and_not_cached(tmp_path):
+    run = serve_tokens(tmp_path, {"expires_in": 1800}, {"access_token": "token-2", "expires_in": 1800})
+
+    async def action(manager):
+        with pytest.raises(Exception, match="no access_token"):
+            await manager.get_token()
+        assert manager._token is None
+        assert manager._read_cache() is None
+        return await manager.get_token()
+
+    assert asyncio.run(run(action)) == "token-2"
+
+
+def test_cached_empty_token_is_ignored(tmp_path):
+    manager = GigaChatTokenManager(authorization_key="test-key", cache_dir=str(tmp_path))
+    for token in (None, ""):
+        with open(manager.cache_path, "w", encoding="utf-8") as f:
+            json.dump({"access_token": token, "issued_at": time.time(), "expires_at": time.time() + 1800}, f)
+        assert manager._read_cache() is None
@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+import gigachat_resilience
+from gigachat_resilience import CircuitBreaker, CircuitOpenError, GigaChatAPIError, GigaChatResilience
+
+
+def expire_cooldown(breaker):
+    breaker.opened_at -= breaker.cooldown
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.check()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+    breaker.record_failure()
+    expire_cooldown(breaker)
+    assert breaker.state == "half_open"
+
+    breaker.check()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_failed_trial_reopens_for_another_cooldown():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+    breaker.record_failure()
+    expire_cooldown(breaker)
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_abandoned_trial_frees_the_half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+    breaker.record_failure()
+    expire_cooldown(breaker)
+    breaker.check()
+    breaker.end_trial()
+    breaker.check()
+
+
+@pytest.fixture
+def resilience(monkeypatch):
+    monkeypatch.setattr(gigachat_resilience, "GIGACHAT_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(gigachat_resilience, "GIGACHAT_HEDGE_MIN_DELAY", 0.01)
+    return GigaChatResilience()
+
+
+class Script:
+    """request() callable answering with the scripted results in order."""
+
+    def __init__(self, *results, delays=()):
+        self.results = list(results)
+        self.delays = list(delays)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0)
+        delay = self.delays.pop(0) if self.delays else 0
+        if delay:
+            await asyncio.sleep(delay)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+def test_retryable_errors_are_retried(resilience):
+    request = Script(GigaChatAPIError(503, "unavailable"), GigaChatAPIError(429, "slow down", retry_after=0), "ответ")
+    assert asyncio.run(resilience.call(request)) == "ответ"
+    assert request.calls == 3
+    assert resilience.retries_total == 2
+    assert resilience.breaker.failures == 0
+
+
+def test_client_errors_are_not_retried(resilience):
+    request = Script(GigaChatAPIError(400, "bad request"), "ответ")
+    with pytest.raises(GigaChatAPIError):
+        asyncio.run(resilience.call(request))
+    assert request.calls == 1
+    assert resilience.breaker.failures == 1
+
+
+def test_open_breaker_fails_fast(resilience):
+    resilience.breaker.failure_threshold = 1
+    with pytest.raises(GigaChatAPIError):
+        asyncio.run(resilience.call(Script(GigaChatAPIError(401, "unauthorized"))))
+
+    request = Script("ответ")
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilience.call(request))
+    assert request.calls == 0
+    assert resilience.fallback(CircuitOpenError()) == gigachat_resilience.GIGACHAT_FALLBACK_REPLY
+
+
+def test_slow_request_gets_a_hedged_twin(resilience):
+    tracker = resilience.latency["blocking"]
+    for _ in range(tracker.min_samples):
+        tracker.observe(0.02)
+    request = Script("медленный", "быстрый", delays=(1.0, 0.0))
+
+    assert asyncio.run(resilience.call(request)) == "быстрый"
+    assert (resilience.hedges_total, resilience.hedges_won) == (1, 1)
+
+
+def test_stream_retries_until_the_first_token(resilience):
+    opened = []
+
+    async def tokens(fail):
+        if fail:
+            raise GigaChatAPIError(502, "bad gateway")
+        for token in ("Добрый ", "день"):
+            yield token
+
+    def open_stream():
+        opened.append(len(opened))
+        return tokens(fail=len(opened) == 1)
+
+    async def run():
+        return [token async for token in resilience.stream(open_stream)]
+
+    assert asyncio.run(run()) == ["Добрый ", "день"]
+    assert len(opened) == 2
+    assert resilience.retries_total == 1
+
+
+def test_retry_after_is_honored_beyond_the_jitter_cap(resilience, monkeypatch):
+    monkeypatch.setattr(gigachat_resilience, "GIGACHAT_RETRY_MAX_DELAY", 0.01)
+    request = Script(GigaChatAPIError(503, "unavailable", retry_after=0.2), "ответ")
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        reply = await resilience.call(request)
+        return reply, asyncio.get_running_loop().time() - started
+
+    reply, elapsed = asyncio.run(run())
+    assert reply == "ответ"
+    assert elapsed >= 0.2
+
+
+def test_retry_after_past_the_deadline_gives_up_at_once(resilience):
+    request = Script(GigaChatAPIError(429, "slow down", retry_after=gigachat_resilience.GIGACHAT_TIMEOUT_MAX + 1), "ответ")
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(GigaChatAPIError):
+            await resilience.call(request)
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(run()) < 0.5
+    assert request.calls == 1
+    assert resilience.retries_total == 0
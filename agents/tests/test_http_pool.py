@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from http_pool import HttpPool
+
+
+def read_slow_stream(pool, **kwargs):
+    """Read a response streamed in 5 chunks over ~0.5 s from a local server."""
+
+    async def slow(request):
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for i in range(5):
+            await asyncio.sleep(0.1)
+            await resp.write(f"data: {i}\n\n".encode())
+        return resp
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/stream", slow)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        try:
+            async with pool.get(f"http://127.0.0.1:{runner.addresses[0][1]}/stream", **kwargs) as resp:
+                return [line async for line in resp.content if line.strip()]
+        finally:
+            await pool.aclose()
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def test_total_timeout_applies_to_plain_requests():
+    with pytest.raises(asyncio.TimeoutError):
+        read_slow_stream(HttpPool(total_timeout=0.25))
+
+
+def test_stream_timeout_only_bounds_socket_reads():
+    pool = HttpPool(total_timeout=0.25, read_timeout=0.3)
+    assert len(read_slow_stream(pool, timeout=pool.stream_timeout)) == 5
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import inference_pool
+from inference_pool import InferencePool
+
+
+@pytest.fixture
+def echo_task(monkeypatch):
+    """Slow-loading model that echoes items and records the threads it ran on."""
+    calls = {"loads": 0, "threads": set()}
+
+    def load():
+        calls["loads"] += 1
+        time.sleep(0.05)
+        return "model"
+
+    def run(model, item):
+        calls["threads"].add(threading.get_ident())
+        time.sleep(0.01)
+        return (model, item)
+
+    monkeypatch.setitem(inference_pool._TASKS, "echo", (load, run))
+    return calls
+
+
+def test_one_model_copy_on_one_thread(echo_task):
+    pool = InferencePool()
+
+    async def run():
+        pool.warmup("echo", wait=False)
+        # Requests arriving while the model loads queue behind the load
+        return await asyncio.gather(*(pool.run("echo", i) for i in range(4)))
+
+    try:
+        assert asyncio.run(run()) == [("model", i) for i in range(4)]
+    finally:
+        pool.shutdown()
+    assert echo_task["loads"] == 1
+    assert len(echo_task["threads"]) == 1
+    assert pool.stats() == {"models": ["echo"], "items": 4, "skipped": 0}
+
+
+def test_cancelled_queued_item_never_runs(echo_task):
+    pool = InferencePool()
+
+    async def run():
+        first = asyncio.ensure_future(pool.run("echo", "first"))
+        queued = asyncio.ensure_future(pool.run("echo", "queued"))
+        await asyncio.sleep(0)
+        queued.cancel()
+        return await first
+
+    try:
+        assert asyncio.run(run()) == ("model", "first")
+    finally:
+        pool.shutdown()
+    assert pool.skipped == 1
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import load_control
+from load_control import AdmissionControl, read_process_stats
+
+
+class FakeRequest:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.room = SimpleNamespace(name=f"visit-{job_id}")
+        self.outcome = None
+
+    async def accept(self):
+        # LiveKit answers the availability request asynchronously
+        await asyncio.sleep(0.01)
+        self.outcome = "accepted"
+
+    async def reject(self):
+        self.outcome = "rejected"
+
+
+class FakeWorker:
+    def __init__(self):
+        self.active_jobs = []
+
+    def start(self, job_id):
+        self.active_jobs.append(SimpleNamespace(job=SimpleNamespace(id=job_id)))
+
+
+def admission(tmp_path, max_sessions=2):
+    return AdmissionControl(max_sessions=max_sessions, drain_file=str(tmp_path / "drain"))
+
+
+def test_burst_of_requests_cannot_pass_the_cap(tmp_path):
+    control = admission(tmp_path)
+    requests = [FakeRequest(f"job-{i}") for i in range(5)]
+
+    async def run():
+        await asyncio.gather(*(control.request_fnc(req) for req in requests))
+
+    asyncio.run(run())
+    assert [req.outcome for req in requests] == ["accepted", "accepted", "rejected", "rejected", "rejected"]
+    assert control.session_count() == 2
+
+
+def test_started_job_is_not_counted_twice(tmp_path):
+    control = admission(tmp_path)
+    worker = FakeWorker()
+    control.load_fnc(worker)
+    asyncio.run(control.request_fnc(FakeRequest("job-1")))
+
+    worker.start("job-1")
+    assert control.session_count() == 1
+    assert control._accepted == {}
+
+
+def test_reservation_expires_if_the_job_never_starts(tmp_path, monkeypatch):
+    control = admission(tmp_path, max_sessions=1)
+    asyncio.run(control.request_fnc(FakeRequest("job-1")))
+    assert control.session_count() == 1
+
+    later = time.monotonic() + load_control._ACCEPT_TIMEOUT + 1
+    monkeypatch.setattr(load_control.time, "monotonic", lambda: later)
+    assert control.session_count() == 0
+
+
+def test_draining_rejects_new_jobs(tmp_path):
+    control = admission(tmp_path)
+    (tmp_path / "drain").touch()
+    req = FakeRequest("job-1")
+    asyncio.run(control.request_fnc(req))
+    assert req.outcome == "rejected"
+
+    os.remove(tmp_path / "drain")
+    control.start_draining()
+    assert control.draining
+    assert not control.should_accept(0)
+
+
+def test_load_is_the_busiest_component(tmp_path, monkeypatch):
+    control = admission(tmp_path, max_sessions=4)
+    monkeypatch.setattr(load_control.psutil, "cpu_percent", lambda: 20.0)
+    monkeypatch.setattr(load_control, "read_process_stats", lambda: [
+        {"loop_lag": 0.05, "gigachat_in_flight": 4},
+        {"loop_lag": 0.01, "gigachat_in_flight": 4},
+    ])
+
+    assert control.compute_load(1) == 0.5
+    assert control.last_load["loop_lag"] == 0.5
+    assert control.last_load["gigachat"] == 8 / control.max_gigachat_in_flight
+    # A full worker reports full load whatever its CPU
+    assert control.compute_load(4) == 1.0
+    control.start_draining()
+    assert control.compute_load(0) == 1.0
+
+
+def test_stale_process_stats_are_ignored(tmp_path):
+    for name, age in (("1.json", 0), ("2.json", 60)):
+        path = tmp_path / name
+        path.write_text(json.dumps({"active_sessions": 1, "loop_lag": age}))
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+    (tmp_path / "3.json.tmp").write_text("{}")
+
+    assert read_process_stats(str(tmp_path)) == [{"active_sessions": 1, "loop_lag": 0}]
+    assert read_process_stats(str(tmp_path / "missing")) == []
+
+
+def test_session_count_is_safe_across_threads(tmp_path):
+    import threading
+
+    control = admission(tmp_path, max_sessions=1000)
+    worker = FakeWorker()
+    control.load_fnc(worker)
+    for i in range(200):
+        control._accepted[f"job-{i}"] = time.monotonic()
+        worker.start(f"job-{i}")
+    errors = []
+
+    def count():
+        try:
+            control.session_count()
+        except Exception as e:
+            errors.append(e)
+
+    # load_fnc (executor thread) and request_fnc (event loop) prune the same reservations
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert control.session_count() == 200
+
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+
+from message_journal import MessageJournal
+
+
+class ScriptedJournal(MessageJournal):
+    """Journal whose bulk POST answers from a script instead of the API."""
+
+    def __init__(self, tmp_path, outcomes=None, **kwargs):
+        super().__init__(
+            api_url="http://api.invalid",
+            journal_path=str(tmp_path / "messages.jsonl"),
+            flush_interval=60,
+            replay_interval=3600,
+            **kwargs,
+        )
+        # Each outcome: "ok", "down" or a list of rejected indexes; "ok" once the script ends
+        self.outcomes = list(outcomes or [])
+        self.posted = []
+
+    async def _post_bulk(self, visit_id, messages):
+        self.posted.append((visit_id, [m["content"] for m in messages]))
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if outcome == "down":
+            return None
+        if outcome == "ok":
+            return []
+        return [(messages[i], "invalid") for i in outcome]
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_batches_per_visit(tmp_path):
+    async def run():
+        journal = ScriptedJournal(tmp_path, batch_size=2)
+        for i in range(3):
+            journal.enqueue("v1", "user", f"q{i}")
+        journal.enqueue("v2", "assistant", "a0")
+        await journal.aclose()
+        return journal
+
+    journal = asyncio.run(run())
+    assert journal.posted == [("v1", ["q0", "q1"]), ("v1", ["q2"]), ("v2", ["a0"])]
+    assert journal.sent_total == 4
+    assert journal.pending_count() == 0
+
+
+def test_empty_messages_are_not_queued(tmp_path):
+    async def run():
+        journal = ScriptedJournal(tmp_path)
+        journal.enqueue("v1", "user", "  ")
+        journal.enqueue("v1", "user", "")
+        return journal.pending_count()
+
+    assert asyncio.run(run()) == 0
+
+
+def test_undelivered_batch_is_spilled_and_replayed(tmp_path):
+    async def run():
+        journal = ScriptedJournal(tmp_path, outcomes=["down"])
+        journal.enqueue("v1", "user", "hello", {"messageKey": "k1"})
+        journal.enqueue("v1", "assistant", "hi")
+        await journal.flush()
+        spilled = read_lines(journal.journal_path)
+
+        await journal.replay()
+        await journal.aclose()
+        return journal, spilled
+
+    journal, spilled = asyncio.run(run())
+    assert [(e["visit_id"], e["content"]) for e in spilled] == [("v1", "hello"), ("v1", "hi")]
+    assert spilled[0]["metadata"] == {"messageKey": "k1"}
+    assert journal.posted[-1] == ("v1", ["hello", "hi"])
+    assert (journal.spilled_total, journal.replayed_total, journal.sent_total) == (2, 2, 0)
+    # The journal file and its claim are gone once everything was delivered
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_replay_is_spilled_again(tmp_path):
+    async def run():
+        journal = ScriptedJournal(tmp_path, outcomes=["down", "down"])
+        journal.enqueue("v1", "user", "hello")
+        await journal.flush()
+        await journal.replay()
+        return journal
+
+    journal = asyncio.run(run())
+    assert [e["content"] for e in read_lines(journal.journal_path)] == ["hello"]
+    assert journal.replayed_total == 0
+    assert os.listdir(tmp_path) == ["messages.jsonl"]
+
+
+def test_rejected_messages_are_kept_apart_and_not_retried(tmp_path):
+    async def run():
+        journal = ScriptedJournal(tmp_path, outcomes=[[1]])
+        for content in ("ok", "bad", "ok too"):
+            journal.enqueue("v1", "user", content)
+        await journal.aclose()
+        return journal
+
+    journal = asyncio.run(run())
+    rejected = read_lines(journal.rejected_path)
+    assert [(e["visit_id"], e["content"], e["error"]) for e in rejected] == [("v1", "bad", "invalid")]
+    assert (journal.sent_total, journal.rejected_total, journal.spilled_total) == (2, 1, 0)
+    assert not os.path.exists(journal.journal_path)
+
+
+def test_replay_picks_up_claims_of_dead_processes(tmp_path):
+    journal = ScriptedJournal(tmp_path)
+    # Claimed by a replay whose process is gone (a pid above any pid_max)
+    orphan = f"{journal.journal_path}.4294967.1.replay"
+    with open(orphan, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"visit_id": "v1", "role": "user", "content": "left over"}) + "\n")
+    # Claimed by a live process (this test's parent): not touched
+    live = f"{journal.journal_path}.{os.getppid()}.1.replay"
+    with open(live, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"visit_id": "v2", "role": "user", "content": "in flight"}) + "\n")
+
+    asyncio.run(journal.replay())
+
+    assert journal.posted == [("v1", ["left over"])]
+    assert journal.replayed_total == 1
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(live)]
+
+
+def test_api_answers_map_to_delivered_rejected_or_retry(tmp_path):
+    from aiohttp import web
+
+    from http_pool import http_pool
+
+    answers = {
+        "partial": web.json_response({"rejected": [{"index": 0, "error": "content is required"}]}, status=201),
+        "invalid": web.json_response({"error": "Messages array is required"}, status=400),
+        "busy": web.json_response({"error": "Too many requests"}, status=429),
+        "down": web.Response(status=503, text="unavailable"),
+    }
+
+    async def bulk(request):
+        return answers[request.match_info["visit_id"]]
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/api/visits/{visit_id}/messages/bulk", bulk)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        journal = MessageJournal(api_url=f"http://127.0.0.1:{port}", journal_path=str(tmp_path / "m.jsonl"))
+        messages = [{"role": "user", "content": "a"}, {"role": "user", "content": "b"}]
+        try:
+            return {visit_id: await journal._post_bulk(visit_id, messages) for visit_id in answers}
+        finally:
+            await http_pool.aclose()
+            await runner.cleanup()
+
+    results = asyncio.run(run())
+    assert results["partial"] == [({"role": "user", "content": "a"}, "content is required")]
+    # A 4xx will fail the same way again: the whole batch is rejected, except rate limiting
+    assert [error[:3] for _, error in results["invalid"]] == ["400", "400"]
+    assert results["busy"] is None
+    assert results["down"] is None
+
+
+def test_file_io_runs_off_the_event_loop(tmp_path, monkeypatch):
+    import threading
+
+    threads = set()
+    real_open = open
+
+    def recording_open(path, *args, **kwargs):
+        if str(path).startswith(str(tmp_path)):
+            threads.add(threading.current_thread() is threading.main_thread())
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", recording_open)
+
+    async def run():
+        journal = ScriptedJournal(tmp_path, outcomes=["down", [0]])
+        journal.enqueue("v1", "user", "hello")
+        await journal.flush()
+        await journal.replay()
+
+    asyncio.run(run())
+    # Spill, replay read and rejected file: none on the loop's thread
+    assert threads == {False}
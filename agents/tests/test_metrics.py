@@ -0,0 +1,24 @@
+import time
+
+import metrics
+from metrics import JobStartTimer
+
+
+def test_process_idle_after_prewarm_is_a_warm_start():
+    userdata = {"prewarm_started": time.perf_counter() - 5, "prewarm_finished": time.perf_counter() - 2}
+    timer = JobStartTimer.for_process(userdata)
+    assert timer.mode == "warm"
+    assert time.perf_counter() - timer.started < 1
+
+
+def test_process_spawned_for_the_job_is_a_cold_start(monkeypatch):
+    monkeypatch.setattr(metrics, "JOB_COLD_START_IDLE", 0.5)
+    started = time.perf_counter() - 3
+    timer = JobStartTimer.for_process({"prewarm_started": started, "prewarm_finished": time.perf_counter()})
+    # The job waited for prewarm(), so its start includes the model loading
+    assert timer.mode == "cold"
+    assert timer.started == started
+
+
+def test_process_without_prewarm_is_a_cold_start():
+    assert JobStartTimer.for_process({}).mode == "cold"
@@ -0,0 +1,134 @@
+import asyncio
+import fcntl
+import os
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import GigaChatRateLimiter, RateLimitExceeded, SharedBuckets
+
+
+def test_request_bucket_refills_at_the_rate(tmp_path):
+    buckets = SharedBuckets(rps=10, tpm=0, burst_seconds=0.2, path=str(tmp_path / "state.json"))
+    assert buckets.try_consume(0) == 0
+    assert buckets.try_consume(0) == 0
+    wait = buckets.try_consume(0)
+    assert 0 < wait <= 0.1
+
+    time.sleep(wait)
+    assert buckets.try_consume(0) == 0
+
+
+def test_token_bucket_charges_and_settles(tmp_path):
+    # 600 tokens per minute: 10 per second, 20 in the bucket
+    buckets = SharedBuckets(rps=0, tpm=600, burst_seconds=2, path=None)
+    assert buckets.try_consume(15) == 0
+    assert buckets.try_consume(15) == pytest.approx(1.0, abs=0.05)
+
+    # The reply was shorter than charged
+    buckets.adjust_tokens(10)
+    assert buckets.try_consume(15) == 0
+
+
+def test_oversized_request_waits_for_a_full_bucket():
+    buckets = SharedBuckets(rps=0, tpm=600, burst_seconds=1, path=None)
+    buckets.try_consume(5)
+    assert buckets.try_consume(1000) == pytest.approx(0.5, abs=0.05)
+
+
+def test_buckets_are_shared_through_the_state_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    first = SharedBuckets(rps=1, tpm=0, burst_seconds=1, path=path)
+    second = SharedBuckets(rps=1, tpm=0, burst_seconds=1, path=path)
+    assert first.try_consume(0) == 0
+    assert second.try_consume(0) > 0.9
+
+
+def test_busy_state_file_is_not_waited_for(tmp_path):
+    path = str(tmp_path / "state.json")
+    buckets = SharedBuckets(rps=10, tpm=600, burst_seconds=1, path=path)
+    with open(path, "a+") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        assert buckets.try_consume(0) == rate_limiter._POLL_INTERVAL
+        # Recorded now, written with the next locked update
+        buckets.adjust_tokens(-10)
+        buckets.block(5)
+        assert buckets.try_consume(0) > 4
+
+    other = SharedBuckets(rps=10, tpm=600, burst_seconds=1, path=path)
+    assert other.try_consume(0) == 0
+    # The paused process writes its pause once the lock is free
+    assert buckets.try_consume(0) > 4
+    assert other.try_consume(0) > 4
+
+
+def test_live_requests_are_served_before_background(tmp_path):
+    limiter = GigaChatRateLimiter(rps=20, tpm=0, burst_seconds=0.05, state_dir=str(tmp_path))
+    order = []
+
+    async def request(name, priority):
+        await limiter.acquire(0, priority)
+        order.append(name)
+
+    async def run():
+        # Spend the burst so the next requests queue
+        await limiter.acquire(0, "live")
+        await asyncio.gather(
+            request("background-1", "background"),
+            request("background-2", "background"),
+            request("live-1", "live"),
+            request("live-2", "live"),
+        )
+
+    asyncio.run(run())
+    assert order == ["live-1", "live-2", "background-1", "background-2"]
+    assert limiter.stats()["granted"] == {"live": 3, "background": 2}
+
+
+def test_request_waiting_too_long_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "GIGACHAT_RATE_LIVE_MAX_WAIT", 0.05)
+    limiter = GigaChatRateLimiter(rps=1, tpm=0, burst_seconds=1, state_dir=str(tmp_path))
+
+    async def run():
+        await limiter.acquire(0, "live")
+        await limiter.acquire(0, "live")
+
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(run())
+    assert limiter.stats()["rejected"]["live"] == 1
+
+
+def test_hedge_takes_budget_only_if_available_now(tmp_path):
+    limiter = GigaChatRateLimiter(rps=1, tpm=0, burst_seconds=1, state_dir=str(tmp_path))
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_rate_limited_pause_holds_requests(tmp_path):
+    limiter = GigaChatRateLimiter(rps=100, tpm=0, burst_seconds=1, state_dir=str(tmp_path))
+    limiter.on_rate_limited(0.1)
+
+    started = time.monotonic()
+    asyncio.run(limiter.acquire(0, "live"))
+    assert time.monotonic() - started >= 0.1
+
+
+def test_without_limits_only_the_pause_is_kept_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "GIGACHAT_RATE_LIVE_MAX_WAIT", 0.5)
+    limiter = GigaChatRateLimiter(rps=0, tpm=0, state_dir=str(tmp_path))
+    assert not limiter.enabled
+    asyncio.run(limiter.acquire(0, "live"))
+
+    limiter.on_rate_limited(0.05)
+    assert not limiter.try_acquire()
+    started = time.monotonic()
+    asyncio.run(limiter.acquire(0, "live"))
+    assert time.monotonic() - started >= 0.05
+
+    # A pause longer than the priority's wait is rejected at once
+    limiter.on_rate_limited(5)
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(limiter.acquire(0, "live"))
+    assert limiter.stats()["granted"]["live"] == 2
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from speculation import SpeculativeGenerator, normalize_transcript, transcript_similarity
+
+PREFIX = [{"role": "system", "content": "Вы врач-терапевт."}]
+
+
+class Replies:
+    """generate() answering every request with a fixed reply; records the requested transcripts."""
+
+    def __init__(self, reply=("Слушаю ", "вас."), fail=False, fail_after=0.0):
+        self.reply = reply
+        self.fail = fail
+        self.fail_after = fail_after
+        self.requests = []
+
+    def __call__(self, messages):
+        self.requests.append(messages[-1]["content"])
+        return self._tokens()
+
+    async def _tokens(self):
+        for token in self.reply:
+            await asyncio.sleep(0)
+            yield token
+        if self.fail:
+            await asyncio.sleep(self.fail_after)
+            raise RuntimeError("GigaChat unavailable")
+
+
+def generator(replies, **options):
+    return SpeculativeGenerator(replies, lambda: list(PREFIX), stable_delay=0.01, **options)
+
+
+async def settle():
+    await asyncio.sleep(0.05)
+
+
+def turn(text):
+    return PREFIX + [{"role": "user", "content": text}]
+
+
+def test_similarity_ignores_case_and_punctuation():
+    assert normalize_transcript("Здравствуйте,  доктор!") == "здравствуйте доктор"
+    assert transcript_similarity("Здравствуйте, доктор!", "здравствуйте доктор") == 1.0
+    assert transcript_similarity("расскажу о препарате", "расскажу о побочных эффектах") < 0.9
+
+
+def test_matching_turn_takes_the_speculative_reply():
+    async def run():
+        replies = Replies()
+        speculation = generator(replies)
+        speculation.on_transcript("Добрый день, доктор", is_final=False)
+        speculation.on_end_of_speech()
+        await settle()
+        tokens = speculation.take(turn("Добрый день, доктор."))
+        return replies, speculation, [token async for token in tokens]
+
+    replies, speculation, tokens = asyncio.run(run())
+    assert replies.requests == ["Добрый день, доктор"]
+    assert tokens == ["Слушаю ", "вас."]
+    assert speculation.stats() == {"started": 1, "committed": 1, "discarded": 0}
+
+
+def test_different_turn_discards_the_reply():
+    async def run():
+        speculation = generator(Replies())
+        speculation.on_transcript("Добрый день, доктор", is_final=True)
+        speculation.on_end_of_speech()
+        await settle()
+        return speculation, speculation.take(turn("Добрый день, доктор, у меня новый препарат"))
+
+    speculation, tokens = asyncio.run(run())
+    assert tokens is None
+    assert speculation.stats() == {"started": 1, "committed": 0, "discarded": 1}
+
+
+def test_changed_context_discards_the_reply():
+    async def run():
+        speculation = generator(Replies())
+        speculation.on_transcript("Добрый день, доктор", is_final=True)
+        speculation.on_end_of_speech()
+        await settle()
+        messages = PREFIX + [{"role": "assistant", "content": "Здравствуйте."}, {"role": "user", "content": "Добрый день, доктор"}]
+        return speculation.take(messages)
+
+    assert asyncio.run(run()) is None
+
+
+def test_no_request_while_the_rep_is_speaking_or_for_short_text():
+    async def run():
+        replies = Replies()
+        speculation = generator(replies)
+        speculation.on_transcript("Добрый день, доктор", is_final=False)
+        await settle()
+        speculation.on_transcript("Да", is_final=False)
+        speculation.on_end_of_speech()
+        await settle()
+        return replies
+
+    assert asyncio.run(run()).requests == []
+
+
+def test_resumed_speech_cancels_and_restarts_on_the_new_transcript():
+    async def run():
+        replies = Replies()
+        speculation = generator(replies)
+        speculation.on_transcript("Добрый день, доктор", is_final=True)
+        speculation.on_end_of_speech()
+        await settle()
+        speculation.on_start_of_speech()
+        speculation.on_transcript("хочу рассказать о препарате", is_final=True)
+        speculation.on_end_of_speech()
+        await settle()
+        return replies, speculation
+
+    replies, speculation = asyncio.run(run())
+    assert replies.requests == ["Добрый день, доктор", "Добрый день, доктор хочу рассказать о препарате"]
+    assert speculation.started == 2
+
+
+def test_session_cap_bounds_requests():
+    async def run():
+        replies = Replies()
+        speculation = generator(replies, max_per_session=1)
+        for text in ("Добрый день, доктор", "Совсем другая фраза представителя"):
+            speculation.on_start_of_speech()
+            speculation.on_transcript(text, is_final=True)
+            speculation.on_end_of_speech()
+            await settle()
+        await speculation.aclose()
+        return replies
+
+    assert asyncio.run(run()).requests == ["Добрый день, доктор"]
+
+
+def test_failed_speculative_request_is_not_used():
+    async def run():
+        speculation = generator(Replies(fail=True))
+        speculation.on_transcript("Добрый день, доктор", is_final=True)
+        speculation.on_end_of_speech()
+        await settle()
+        return speculation.take(turn("Добрый день, доктор"))
+
+    assert asyncio.run(run()) is None
+
+
+def test_error_after_commit_reaches_the_reply_stream():
+    async def run():
+        speculation = generator(Replies(fail=True, fail_after=0.2))
+        speculation.on_transcript("Добрый день, доктор", is_final=True)
+        speculation.on_end_of_speech()
+        await settle()
+        tokens = speculation.take(turn("Добрый день, доктор"))
+        return [token async for token in tokens]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+
+
+def test_final_transcript_after_end_of_speech_starts_at_once():
+    # Live order with the non-streaming STT: VAD end of speech, then the final transcript
+    # of the buffered audio, then the turn is committed after min_endpointing_delay
+    async def run():
+        replies = Replies()
+        speculation = SpeculativeGenerator(replies, lambda: list(PREFIX), stable_delay=10.0)
+        speculation.on_end_of_speech()
+        await asyncio.sleep(0.01)
+        speculation.on_transcript("Добрый день, доктор", is_final=True)
+        started = speculation.started
+        await asyncio.sleep(0.01)
+        tokens = speculation.take(turn("Добрый день, доктор."))
+        return started, [token async for token in tokens]
+
+    started, tokens = asyncio.run(run())
+    assert started == 1
+    assert tokens == ["Слушаю ", "вас."]
+
+
+def test_interim_transcript_waits_until_stable():
+    async def run():
+        replies = Replies()
+        speculation = generator(replies)
+        speculation.on_transcript("Добрый день, доктор", is_final=False)
+        speculation.on_end_of_speech()
+        started = speculation.started
+        await settle()
+        return started, speculation.started
+
+    assert asyncio.run(run()) == (0, 1)
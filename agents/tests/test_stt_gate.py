@@ -0,0 +1,154 @@
+import asyncio
+
+from livekit import rtc
+from livekit.agents import stt, vad as agents_vad
+
+from stt_gate import STT_SAMPLE_RATE, VADGatedSTT
+
+START, INFERENCE, END = (
+    agents_vad.VADEventType.START_OF_SPEECH,
+    agents_vad.VADEventType.INFERENCE_DONE,
+    agents_vad.VADEventType.END_OF_SPEECH,
+)
+
+
+def audio(seconds):
+    samples = int(seconds * STT_SAMPLE_RATE)
+    return rtc.AudioFrame(data=bytes(samples * 2), sample_rate=STT_SAMPLE_RATE, num_channels=1, samples_per_channel=samples)
+
+
+def event(kind, frame_seconds=0.0, speech=0.0, silence=0.0):
+    return agents_vad.VADEvent(
+        type=kind,
+        samples_index=0,
+        timestamp=0.0,
+        speech_duration=speech,
+        silence_duration=silence,
+        frames=[audio(frame_seconds)] if frame_seconds else [],
+    )
+
+
+def utterance(speech, silence=0.4, preroll=0.3, step=0.1):
+    """VAD events of one utterance: pre-roll with the first speech, inference steps, end of speech."""
+    events = [event(START, preroll)]
+    steps = round((speech + silence) / step)
+    for i in range(1, steps + 1):
+        events.append(event(INFERENCE, step, speech=min(speech, i * step)))
+    events.append(event(END, speech=speech, silence=silence))
+    return events
+
+
+class ScriptedVADStream:
+    def __init__(self, events):
+        self._events = asyncio.Queue()
+        self._script = events
+
+    def push_frame(self, frame):
+        pass
+
+    def flush(self):
+        pass
+
+    def end_input(self):
+        # The script plays once all audio is in
+        for ev in self._script:
+            self._events.put_nowait(ev)
+        self._events.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        ev = await self._events.get()
+        if ev is None:
+            raise StopAsyncIteration
+        return ev
+
+    async def aclose(self):
+        pass
+
+
+class ScriptedVAD(agents_vad.VAD):
+    def __init__(self, events):
+        super().__init__(capabilities=agents_vad.VADCapabilities(update_interval=0.032))
+        self.events = events
+
+    def stream(self):
+        return ScriptedVADStream(self.events)
+
+
+class RecordingSTT(stt.STT):
+    """Transcribes every segment as its number and duration; can fail chosen segments."""
+
+    def __init__(self, fail=()):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=False, interim_results=False))
+        self.durations = []
+        self.fail = set(fail)
+
+    async def _recognize_impl(self, buffer, *, language=None, conn_options=None):
+        self.durations.append(round(buffer.duration, 3))
+        if len(self.durations) in self.fail:
+            raise RuntimeError("STT unavailable")
+        return stt.SpeechEvent(
+            type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+            alternatives=[stt.SpeechData(language="ru", text=f"segment {len(self.durations)}")],
+        )
+
+
+def transcribe(events, wrapped=None, **options):
+    wrapped = wrapped or RecordingSTT()
+    gated = VADGatedSTT(wrapped, ScriptedVAD(events), **options)
+
+    async def run():
+        stream = gated.stream()
+        stream.push_frame(audio(0.1))
+        stream.end_input()
+        received = [ev async for ev in stream]
+        await stream.aclose()
+        return received
+
+    received = asyncio.run(run())
+    return gated, wrapped, received
+
+
+def kinds(received):
+    return [
+        ev.alternatives[0].text if ev.type == stt.SpeechEventType.FINAL_TRANSCRIPT else ev.type.name
+        for ev in received
+    ]
+
+
+def test_speech_segment_is_uploaded_with_trailing_silence_trimmed():
+    gated, wrapped, received = transcribe(utterance(0.6), min_speech=0.15, trailing_silence=0.15)
+
+    assert sorted(kinds(received)) == ["END_OF_SPEECH", "START_OF_SPEECH", "segment 1"]
+    # 0.3 s of pre-roll and 1.0 s of inference steps, minus 0.25 s of the 0.4 s silence
+    assert wrapped.durations == [1.05]
+    assert gated.segments == {"sent": 1, "split": 0, "dropped": 0}
+    assert round(gated.uploaded_seconds, 3) == 1.05
+
+
+def test_short_noise_is_not_uploaded():
+    gated, wrapped, received = transcribe(utterance(0.1), min_speech=0.15)
+
+    assert kinds(received) == ["START_OF_SPEECH", "END_OF_SPEECH"]
+    assert wrapped.durations == []
+    assert gated.segments == {"sent": 0, "split": 0, "dropped": 1}
+
+
+def test_long_speech_is_split_into_parts():
+    gated, wrapped, received = transcribe(utterance(2.0, silence=0.2), min_speech=0.15, max_utterance=1.0)
+
+    # Parts are transcribed in order, each as soon as it is cut
+    assert [kind for kind in kinds(received) if kind.startswith("segment")] == ["segment 1", "segment 2", "segment 3"]
+    assert wrapped.durations == [1.0, 1.0, 0.45]
+    assert gated.segments == {"sent": 1, "split": 2, "dropped": 0}
+
+
+def test_failed_segment_does_not_end_the_stream():
+    events = utterance(0.6) + utterance(0.8)
+    gated, wrapped, received = transcribe(events, wrapped=RecordingSTT(fail={1}), min_speech=0.15)
+
+    assert len(wrapped.durations) == 2
+    assert kinds(received)[-1] == "segment 2"
+    assert kinds(received).count("END_OF_SPEECH") == 2
@@ -0,0 +1,86 @@
+import fcntl
+import os
+
+from tts_cache import _HEADER, AudioFileCache, cache_key
+
+# One entry: header plus 1000 bytes of PCM
+ENTRY_BYTES = _HEADER.size + 1000
+
+
+def store(cache, key, mtime):
+    cache.put(key, 24000, 1, b"\x01" * 1000)
+    os.utime(cache._path(key), (mtime, mtime))
+
+
+def cached_keys(directory):
+    return sorted(name[:-4] for name in os.listdir(directory) if name.endswith(".pcm"))
+
+
+def test_cache_key_normalizes_whitespace_but_not_case():
+    key = cache_key("alloy", "tts-1", 24000, "Слушаю  вас.\n")
+    assert key == cache_key("alloy", "tts-1", 24000, "Слушаю вас.")
+    assert key != cache_key("alloy", "tts-1", 24000, "слушаю вас.")
+    assert key != cache_key("nova", "tts-1", 24000, "Слушаю вас.")
+    assert key != cache_key("alloy", "tts-1", 16000, "Слушаю вас.")
+
+
+def test_round_trip(tmp_path):
+    cache = AudioFileCache(str(tmp_path), max_bytes=10 * ENTRY_BYTES)
+    cache.put("a", 24000, 1, b"\x01\x02" * 10)
+    sample_rate, num_channels, mm = cache.get("a")
+    try:
+        assert (sample_rate, num_channels) == (24000, 1)
+        assert mm[_HEADER.size:] == b"\x01\x02" * 10
+    finally:
+        mm.close()
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = AudioFileCache(str(tmp_path), max_bytes=3 * ENTRY_BYTES)
+    for i, key in enumerate("abc"):
+        store(cache, key, 1000 + i)
+
+    # A hit makes "a" the most recently used entry
+    cache.get("a")[2].close()
+    cache.put("d", 24000, 1, b"\x01" * 1000)
+
+    assert cached_keys(tmp_path) == ["a", "c", "d"]
+    assert cache.stats()["evicted"] == 1
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["bytes"] == 3 * ENTRY_BYTES
+
+
+def test_bound_holds_across_instances(tmp_path):
+    # Two worker processes writing to the same directory
+    first = AudioFileCache(str(tmp_path), max_bytes=2 * ENTRY_BYTES)
+    second = AudioFileCache(str(tmp_path), max_bytes=2 * ENTRY_BYTES)
+    store(first, "a", 1000)
+    store(first, "b", 1001)
+    second.put("c", 24000, 1, b"\x01" * 1000)
+
+    assert cached_keys(tmp_path) == ["b", "c"]
+
+
+def test_eviction_is_skipped_while_another_process_trims(tmp_path):
+    cache = AudioFileCache(str(tmp_path), max_bytes=ENTRY_BYTES)
+    with open(cache._lock_path, "w") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        store(cache, "a", 1000)
+        store(cache, "b", 1001)
+        assert cached_keys(tmp_path) == ["a", "b"]
+    cache.evict()
+    assert cached_keys(tmp_path) == ["b"]
+
+
+def test_short_or_foreign_files_are_misses(tmp_path):
+    cache = AudioFileCache(str(tmp_path), max_bytes=10 * ENTRY_BYTES)
+    for key, content in (("empty", b""), ("short", b"SMTC\x00"), ("foreign", b"RIFF" + b"\x00" * 64)):
+        with open(cache._path(key), "wb") as f:
+            f.write(content)
+
+    assert [cache.get(key) for key in ("empty", "short", "foreign")] == [None, None, None]
+    assert cache.misses == 3
+    assert not os.path.exists(cache._path("short"))
+    assert not os.path.exists(cache._path("foreign"))
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import time
+
+import visit_cache
+from visit_cache import TTLCache
+
+AGENTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_entry_written_by_one_process_is_read_by_the_next(tmp_path):
+    # A job process stores the doctor profile and exits; a later job on the host reads it
+    script = (
+        "import visit_cache; "
+        "visit_cache.remember_visit('visit-1', {'doctor': {'id': 'doc-1', 'name': 'Иванов', 'updatedAt': 'v1'}})"
+    )
+    env = dict(os.environ, VISIT_CACHE_DIR=str(tmp_path))
+    subprocess.run([sys.executable, "-c", script], cwd=AGENTS_DIR, env=env, check=True)
+
+    doctors = TTLCache("doctors", 8, 60, directory=str(tmp_path))
+    assert doctors.get("doc-1")["name"] == "Иванов"
+    assert TTLCache("visits", 8, 60, directory=str(tmp_path)).get("visit-1") is not None
+
+
+def test_expired_and_corrupt_entries_are_misses(tmp_path):
+    cache = TTLCache("visits", 8, 60, directory=str(tmp_path))
+    cache.set("fresh", {"a": 1})
+    cache.set("corrupt", {"a": 2})
+    with open(cache._path("corrupt"), "w", encoding="utf-8") as f:
+        f.write("{")
+    TTLCache("visits", 8, -1, directory=str(tmp_path)).set("expired", {"a": 3})
+
+    assert cache.get("fresh") == {"a": 1}
+    assert cache.get("corrupt") is None
+    assert cache.get("expired") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.stats()["size"] == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TTLCache("doctors", 2, 60, directory=str(tmp_path))
+    for i, key in enumerate(("a", "b")):
+        cache.set(key, key)
+        mtime = time.time() - 10 + i
+        os.utime(cache._path(key), (mtime, mtime))
+    cache.get("a")
+    cache.set("c", "c")
+    assert [cache.get(key) for key in ("a", "b", "c")] == ["a", None, "c"]
+
+
+def test_new_doctor_version_drops_profile_and_prompts(tmp_path, monkeypatch):
+    for name in ("doctor_profiles", "system_prompts"):
+        monkeypatch.setattr(visit_cache, name, TTLCache(name, 8, 60, directory=str(tmp_path)))
+    visit_cache.remember_visit("visit-1", {"doctor": {"id": "doc-1", "updatedAt": "v1"}})
+    visit_cache.system_prompts.set(("doc-1", "v1", "Иванов"), "prompt")
+    visit_cache.system_prompts.set(("doc-2", "v1", "Петров"), "other prompt")
+
+    assert visit_cache.cached_doctor("doc-1", "v1")["updated_at"] == "v1"
+    assert visit_cache.cached_doctor("doc-1", "v2") is None
+    assert visit_cache.doctor_profiles.get("doc-1") is None
+    assert visit_cache.system_prompts.get(("doc-1", "v1", "Иванов")) is None
+    assert visit_cache.system_prompts.get(("doc-2", "v1", "Петров")) == "other prompt"
@@ -0,0 +1,318 @@
+"""
+Content-addressed on-disk cache for synthesised doctor speech.
+Audio is keyed by (voice, model, sample_rate, normalised text), stored as raw PCM files
+in a size-bounded LRU directory and played back from memory-mapped files, so repeated
+phrases start instantly and cost no TTS API calls. File I/O runs in threads, never on
+the event loop.
+"""
+
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import unicodedata
+from typing import Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction is not coordinated between processes
+    fcntl = None
+
+from livekit.agents import tts, utils, APIConnectOptions, DEFAULT_API_CONNECT_OPTIONS
+
+logger = logging.getLogger("shadowmed.tts_cache")
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "shadowmed-tts-cache"))
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "512"))
+
+# File layout: magic, sample_rate, num_channels, then 16-bit PCM
+_HEADER = struct.Struct("<4sII")
+_MAGIC = b"SMTC"
+# Frames pushed per chunk when playing back from cache
+_PLAYBACK_CHUNK_MS = 100
+
+# Phrases doctors repeat across visits; pre-synthesised when TTS_PRESYNTHESIZE is enabled
+COMMON_DOCTOR_PHRASES = [
+    "Здравствуйте.",
+    "Здравствуйте, проходите, присаживайтесь.",
+    "Слушаю вас.",
+    "Расскажите подробнее о препарате.",
+    "Какие у препарата противопоказания?",
+    "А какие побочные эффекты?",
+    "Есть ли клинические исследования?",
+    "Понятно.",
+    "Спасибо, я подумаю.",
+    "До свидания.",
+]
+
+
+def normalize_text(text: str) -> str:
+    """Normalise text for cache keys (Unicode form and whitespace; case is kept for TTS prosody)."""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(voice: str, model: str, sample_rate: int, text: str) -> str:
+    raw = "\n".join([voice or "", model or "", str(sample_rate), normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioFileCache:
+    """Size-bounded LRU directory of PCM files, shared by the worker processes on the host.
+
+    Recency is the file mtime, refreshed on every hit, so eviction works from a scan of the
+    directory and TTS_CACHE_MAX_MB holds for all processes writing to it. The methods do
+    blocking file I/O and are called off the event loop.
+    """
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = int(TTS_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock_path = os.path.join(directory, ".evict.lock")
+        # As of the last directory scan
+        self._entries = 0
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pcm")
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (sample_rate, num_channels, mmap) for a cached entry, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Evicted by another worker, or empty file
+            self.misses += 1
+            return None
+
+        if len(mm) < _HEADER.size or mm[:len(_MAGIC)] != _MAGIC:
+            # Truncated or foreign file: a miss; the phrase is stored again once synthesised
+            mm.close()
+            _remove(path)
+            self.misses += 1
+            return None
+
+        _, sample_rate, num_channels = _HEADER.unpack_from(mm, 0)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            # Read the audio in now rather than page by page during playback
+            mm.madvise(mmap.MADV_WILLNEED)
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return sample_rate, num_channels, mm
+
+    def put(self, key: str, sample_rate: int, num_channels: int, pcm: bytes):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, sample_rate, num_channels))
+                f.write(pcm)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write TTS cache entry: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """Trim the directory to max_bytes, least recently used files first."""
+        if fcntl is None:
+            self._evict_scan()
+            return
+        try:
+            lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            self._evict_scan()
+            return
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is trimming the directory right now
+                return
+            self._evict_scan()
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(lock_fd)
+
+    def _evict_scan(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".pcm"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+            removed += 1
+        self._entries = len(entries) - removed
+        self._total_bytes = total
+        self.evicted += removed
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._entries,
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class CachedTTS(tts.TTS):
+    """TTS wrapper that serves repeated phrases from the on-disk audio cache."""
+
+    def __init__(
+        self,
+        wrapped: tts.TTS,
+        *,
+        voice: str = "",
+        model: str = "",
+        cache: Optional[AudioFileCache] = None,
+    ):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=wrapped.sample_rate,
+            num_channels=wrapped.num_channels,
+        )
+        self._wrapped = wrapped
+        self.voice = voice
+        self._model = model
+        self.cache = cache or AudioFileCache()
+        # Cache writes still running after their phrase was played
+        self._writes: set = set()
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def provider(self) -> str:
+        return self._wrapped.provider
+
+    def key_for(self, text: str) -> str:
+        return cache_key(self.voice, self.model, self.sample_rate, text)
+
+    def synthesize(
+        self,
+        text: str,
+        *,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+    ) -> "CachedChunkedStream":
+        return CachedChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+    async def presynthesize(self, lines: Iterable[str]):
+        """Synthesise phrases ahead of time so their first use is already a cache hit."""
+        for line in lines:
+            if not normalize_text(line) or await asyncio.to_thread(self.cache.contains, self.key_for(line)):
+                continue
+            try:
+                async with self.synthesize(line) as stream:
+                    async for _ in stream:
+                        pass
+            except Exception as e:
+                logger.warning(f"Failed to pre-synthesize '{line[:30]}': {e}")
+
+    def store(self, key: str, sample_rate: int, num_channels: int, pcm: bytes):
+        """Write a synthesised phrase to the cache in the background."""
+        task = asyncio.create_task(asyncio.to_thread(self.cache.put, key, sample_rate, num_channels, pcm))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def prewarm(self):
+        self._wrapped.prewarm()
+
+    async def aclose(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        await self._wrapped.aclose()
+
+
+class CachedChunkedStream(tts.ChunkedStream):
+    """Plays a phrase from cache, or synthesises it through the wrapped TTS and stores it."""
+
+    def __init__(self, *, tts: CachedTTS, input_text: str, conn_options: APIConnectOptions):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._cached_tts = tts
+
+    async def _run(self, output_emitter: tts.AudioEmitter):
+        key = self._cached_tts.key_for(self._input_text)
+        request_id = utils.shortuuid()
+
+        entry = await asyncio.to_thread(self._cached_tts.cache.get, key)
+        if entry is not None:
+            sample_rate, num_channels, mm = entry
+            try:
+                output_emitter.initialize(
+                    request_id=request_id,
+                    sample_rate=sample_rate,
+                    num_channels=num_channels,
+                    mime_type="audio/pcm",
+                )
+                chunk = sample_rate * num_channels * 2 * _PLAYBACK_CHUNK_MS // 1000
+                for offset in range(_HEADER.size, len(mm), chunk):
+                    output_emitter.push(mm[offset:offset + chunk])
+                    # Let other rooms' audio run between chunks
+                    await asyncio.sleep(0)
+                output_emitter.flush()
+            finally:
+                mm.close()
+            return
+
+        # Cache miss: synthesise and store only complete audio (an interrupted
+        # synthesis is cancelled before reaching put())
+        pcm = bytearray()
+        initialized = False
+        async with self._cached_tts._wrapped.synthesize(
+            self._input_text, conn_options=self._conn_options
+        ) as stream:
+            async for ev in stream:
+                frame = ev.frame
+                if not initialized:
+                    output_emitter.initialize(
+                        request_id=request_id,
+                        sample_rate=frame.sample_rate,
+                        num_channels=frame.num_channels,
+                        mime_type="audio/pcm",
+                    )
+                    sample_rate, num_channels = frame.sample_rate, frame.num_channels
+                    initialized = True
+                data = frame.data.tobytes()
+                pcm.extend(data)
+                output_emitter.push(data)
+
+        if initialized:
+            output_emitter.flush()
+            self._cached_tts.store(key, sample_rate, num_channels, bytes(pcm))
@@ -0,0 +1,218 @@
+"""
+Host-wide caches for visit payloads, doctor profiles and compiled system prompts.
+Doctor personas rarely change, so jobs reuse them instead of re-fetching and
+re-building the prompt for every visit. Every job runs in its own process that exits
+with the job, so entries are JSON files shared by the worker's processes on the host
+(like tts_cache), not process memory. The methods do blocking file I/O and are called
+off the event loop.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction is not coordinated between processes
+    fcntl = None
+
+logger = logging.getLogger("shadowmed.visit_cache")
+
+VISIT_CACHE_DIR = os.getenv("VISIT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "shadowmed-visit-cache"))
+VISIT_CACHE_SIZE = int(os.getenv("VISIT_CACHE_SIZE", "256"))
+VISIT_CACHE_TTL = float(os.getenv("VISIT_CACHE_TTL", "300"))
+DOCTOR_CACHE_SIZE = int(os.getenv("DOCTOR_CACHE_SIZE", "128"))
+DOCTOR_CACHE_TTL = float(os.getenv("DOCTOR_CACHE_TTL", "3600"))
+
+
+class TTLCache:
+    """LRU directory of JSON entries with a per-entry time to live.
+
+    Writers replace entry files atomically, so readers need no lock. Recency is the file
+    mtime, refreshed on every hit; the directory is trimmed to maxsize entries after a write.
+    Keys are strings or tuples of JSON values.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, directory: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = os.path.join(directory or VISIT_CACHE_DIR, name)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key) -> str:
+        raw = json.dumps(key, ensure_ascii=False)
+        return os.path.join(self.directory, f"{hashlib.sha256(raw.encode('utf-8')).hexdigest()}.json")
+
+    def get(self, key) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            value, expires_at = entry["value"], float(entry["expires_at"])
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            # Truncated or foreign file: a miss; the entry is stored again once fetched
+            _remove(path)
+            self.misses += 1
+            return None
+        if time.time() >= expires_at:
+            _remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # Visit payloads carry scenario and doctor prompts: keep them private to the worker user
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "value": value, "expires_at": time.time() + self.ttl}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to write visit cache entry: {e}")
+            _remove(tmp_path)
+            return
+        self.evict()
+
+    def invalidate(self, key):
+        _remove(self._path(key))
+
+    def invalidate_where(self, predicate: Callable[[Any], bool]):
+        for path in self._entry_paths():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    key = json.load(f)["key"]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            if predicate(tuple(key) if isinstance(key, list) else key):
+                _remove(path)
+
+    def clear(self):
+        for path in self._entry_paths():
+            _remove(path)
+
+    def evict(self):
+        """Trim the directory to maxsize entries, least recently used first."""
+        if fcntl is None:
+            self._evict_scan()
+            return
+        try:
+            lock_fd = os.open(os.path.join(self.directory, ".evict.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            self._evict_scan()
+            return
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is trimming the directory right now
+                return
+            self._evict_scan()
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(lock_fd)
+
+    def _evict_scan(self):
+        entries = []
+        for path in self._entry_paths():
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                continue
+        for _, path in sorted(entries)[:max(0, len(entries) - self.maxsize)]:
+            _remove(path)
+
+    def _entry_paths(self) -> list:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.endswith(".json")]
+
+    def stats(self) -> dict:
+        return {"size": len(self._entry_paths()), "hits": self.hits, "misses": self.misses}
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove visit cache entry {path}: {e}")
+
+
+# visit_id -> visit payload (as returned by /api/visits/{id}/agent)
+visit_payloads = TTLCache("visits", VISIT_CACHE_SIZE, VISIT_CACHE_TTL)
+# doctor_id -> normalized doctor profile
+doctor_profiles = TTLCache("doctors", DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL)
+# (doctor_id, doctor_version, doctor_name) -> compiled system prompt
+system_prompts = TTLCache("prompts", DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL)
+# API facts learned by earlier jobs, e.g. that /api/visits/{id}/agent is not deployed
+api_flags = TTLCache("api", 16, DOCTOR_CACHE_TTL)
+
+
+def normalize_doctor(doctor: Optional[dict]) -> dict:
+    """Accept doctor data in API (camelCase) or legacy (snake_case) form."""
+    doctor = doctor or {}
+    return {
+        "id": doctor.get("id"),
+        "name": doctor.get("name"),
+        "prompt_template": doctor.get("promptTemplate", doctor.get("prompt_template")) or "",
+        "personality_type": doctor.get("personalityType", doctor.get("personality_type")) or "rational",
+        "empathy_level": doctor.get("empathyLevel", doctor.get("empathy_level")) or 5,
+        "updated_at": doctor.get("updatedAt", doctor.get("updated_at")),
+    }
+
+
+def remember_visit(visit_id: str, visit: dict) -> dict:
+    """Cache a visit payload and its doctor profile; returns the normalized doctor."""
+    visit_payloads.set(visit_id, visit)
+    doctor = normalize_doctor(visit.get("doctor"))
+    if doctor["id"]:
+        doctor_profiles.set(doctor["id"], doctor)
+    return doctor
+
+
+def cached_doctor(doctor_id: Optional[str], version: Optional[str] = None) -> Optional[dict]:
+    """Return a cached doctor profile, unless the caller knows of a newer version."""
+    if not doctor_id:
+        return None
+    doctor = doctor_profiles.get(doctor_id)
+    if doctor is not None and version and doctor.get("updated_at") != version:
+        invalidate_doctor(doctor_id)
+        return None
+    return doctor
+
+
+def invalidate_doctor(doctor_id: str):
+    """Drop a doctor profile and every prompt compiled from it."""
+    doctor_profiles.invalidate(doctor_id)
+    system_prompts.invalidate_where(lambda key: key[0] == doctor_id)
+
+
+def invalidate_visit(visit_id: str):
+    visit_payloads.invalidate(visit_id)
+
+
+def cache_stats() -> dict:
+    return {
+        "visits": visit_payloads.stats(),
+        "doctors": doctor_profiles.stats(),
+        "prompts": system_prompts.stats(),
+    }
@@ -0,0 +1,99 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { requireAuth } from '@/lib/auth/require-auth';
+import { db } from '@/lib/db';
+import { evaluations, visits } from '@/lib/db/schema';
+import { and, eq, inArray } from 'drizzle-orm';
+
+const MAX_BULK_EVALUATIONS = 100;
+
+// POST /api/evaluations/bulk - Save a batch of visit evaluations
+// Used by the agent's batch evaluation; visits that already have an evaluation are skipped
+export async function POST(request: NextRequest) {
+  const serviceToken = request.headers.get('x-service-token');
+  const expectedToken = process.env.AGENT_SERVICE_TOKEN;
+  const isAgentRequest = serviceToken && expectedToken && serviceToken === expectedToken;
+
+  // For agents, skip auth; otherwise only trainers and admins
+  if (!isAgentRequest) {
+    const authResult = await requireAuth(request, ['trainer', 'admin']);
+    if (authResult instanceof NextResponse) {
+      return authResult;
+    }
+  }
+
+  try {
+    const { evaluations: results } = await request.json();
+
+    if (!Array.isArray(results) || results.length === 0) {
+      return NextResponse.json(
+        { error: 'Evaluations array is required' },
+        { status: 400 }
+      );
+    }
+
+    if (results.length > MAX_BULK_EVALUATIONS) {
+      return NextResponse.json(
+        { error: `At most ${MAX_BULK_EVALUATIONS} evaluations per request` },
+        { status: 400 }
+      );
+    }
+
+    for (const result of results) {
+      if (!result?.visitId || typeof result.score !== 'number') {
+        return NextResponse.json(
+          { error: 'visitId and numeric score are required' },
+          { status: 400 }
+        );
+      }
+    }
+
+    const visitIds: string[] = Array.from(new Set(results.map((result: any) => result.visitId)));
+
+    // Only completed visits can be evaluated
+    const completed = await db
+      .select({ id: visits.id })
+      .from(visits)
+      .where(and(inArray(visits.id, visitIds), eq(visits.status, 'completed')));
+    const completedIds = new Set(completed.map((visit) => visit.id));
+
+    const seen = new Set<string>();
+    const newResults = results.filter((result: any) => {
+      if (!completedIds.has(result.visitId) || seen.has(result.visitId)) {
+        return false;
+      }
+      seen.add(result.visitId);
+      return true;
+    });
+
+    // Visits evaluated meanwhile (a resumed batch, a manual evaluation) hit the
+    // unique index on visit_id and are skipped, so the counts stay accurate
+    let inserted: { visitId: string }[] = [];
+    if (newResults.length > 0) {
+      inserted = await db
+        .insert(evaluations)
+        .values(
+          newResults.map((result: any) => ({
+            visitId: result.visitId,
+            score: Math.max(0, Math.min(100, Math.round(result.score))),
+            feedbackText: result.feedback,
+            metricsJson: result.metrics,
+            recommendations: result.recommendations,
+          }))
+        )
+        .onConflictDoNothing({ target: evaluations.visitId })
+        .returning({ visitId: evaluations.visitId });
+    }
+
+    return NextResponse.json({
+      inserted: inserted.length,
+      skipped: results.length - inserted.length,
+    }, { status: 201 });
+
+  } catch (error) {
+    console.error('Bulk save evaluations error:', error);
+    return NextResponse.json(
+      { error: 'Failed to save evaluations' },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,99 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { requireAuth } from '@/lib/auth/require-auth';
+import { db } from '@/lib/db';
+import { evaluations, visits, visitMessages, scenarios, doctors } from '@/lib/db/schema';
+import { eq, and, asc, gt, inArray, isNull } from 'drizzle-orm';
+
+const DEFAULT_PAGE_SIZE = 50;
+const MAX_PAGE_SIZE = 200;
+
+// GET /api/evaluations/pending?limit=50&after=<visitId>&userId=<id>
+// Completed visits without an evaluation, with their transcripts, in pages ordered by id.
+// Used by the agent's batch evaluation (agents/batch_evaluate.py).
+export async function GET(request: NextRequest) {
+  const serviceToken = request.headers.get('x-service-token');
+  const expectedToken = process.env.AGENT_SERVICE_TOKEN;
+  const isAgentRequest = serviceToken && expectedToken && serviceToken === expectedToken;
+
+  // For agents, skip auth; otherwise only trainers and admins
+  if (!isAgentRequest) {
+    const authResult = await requireAuth(request, ['trainer', 'admin']);
+    if (authResult instanceof NextResponse) {
+      return authResult;
+    }
+  }
+
+  try {
+    const { searchParams } = new URL(request.url);
+    const limit = Math.min(
+      Math.max(parseInt(searchParams.get('limit') || '', 10) || DEFAULT_PAGE_SIZE, 1),
+      MAX_PAGE_SIZE
+    );
+    const after = searchParams.get('after');
+    const userId = searchParams.get('userId');
+
+    const conditions = [eq(visits.status, 'completed'), isNull(evaluations.id)];
+    if (after) {
+      conditions.push(gt(visits.id, after));
+    }
+    if (userId) {
+      conditions.push(eq(visits.userId, userId));
+    }
+
+    const page = await db
+      .select({
+        id: visits.id,
+        userId: visits.userId,
+        completedAt: visits.completedAt,
+        scenario: {
+          title: scenarios.title,
+          description: scenarios.description,
+        },
+        doctor: {
+          name: doctors.name,
+          personalityType: doctors.personalityType,
+        },
+      })
+      .from(visits)
+      .leftJoin(evaluations, eq(evaluations.visitId, visits.id))
+      .leftJoin(scenarios, eq(visits.scenarioId, scenarios.id))
+      .leftJoin(doctors, eq(visits.doctorId, doctors.id))
+      .where(and(...conditions))
+      .orderBy(asc(visits.id))
+      .limit(limit);
+
+    // One query for the transcripts of the whole page
+    const messages = page.length > 0
+      ? await db
+        .select({
+          visitId: visitMessages.visitId,
+          role: visitMessages.role,
+          content: visitMessages.content,
+        })
+        .from(visitMessages)
+        .where(inArray(visitMessages.visitId, page.map((visit) => visit.id)))
+        .orderBy(asc(visitMessages.timestamp))
+      : [];
+
+    const transcripts = new Map<string, { role: string; content: string }[]>();
+    for (const message of messages) {
+      const transcript = transcripts.get(message.visitId) || [];
+      transcript.push({ role: message.role, content: message.content });
+      transcripts.set(message.visitId, transcript);
+    }
+
+    return NextResponse.json({
+      visits: page.map((visit) => ({
+        ...visit,
+        messages: transcripts.get(visit.id) || [],
+      })),
+      nextCursor: page.length === limit ? page[page.length - 1].id : null,
+    });
+  } catch (error) {
+    console.error('Get pending evaluations error:', error);
+    return NextResponse.json(
+      { error: 'Failed to fetch pending evaluations' },
+      { status: 500 }
+    );
+  }
+}
@@ -1,6 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { requireAuth } from '@/lib/auth/require-auth';
 import { RoomServiceClient } from 'livekit-server-sdk';
+import { getAgentVisitPayload } from '@/lib/livekit-agents/visit-payload';
 
 const LIVEKIT_URL = process.env.LIVEKIT_URL!;
 const LIVEKIT_API_KEY = process.env.LIVEKIT_API_KEY!;
@@ -27,6 +28,10 @@ export async function POST(request: NextRequest) {
 
     const roomService = new RoomServiceClient(LIVEKIT_URL, LIVEKIT_API_KEY, LIVEKIT_API_SECRET);
 
+    // Room metadata is readable by every participant, including the rep's browser, so it carries
+    // only ids: the agent resolves the persona and prompts from its cache or the agent endpoint
+    const visit = visitId ? await getAgentVisitPayload(visitId) : null;
+
     // Create or get room
     // LiveKit Cloud will automatically dispatch agent when participant joins
     const room = await roomService.createRoom({
@@ -36,6 +41,11 @@ export async function POST(request: NextRequest) {
       metadata: JSON.stringify({
         visitId,
         agentRequired: true,
+        ...(visit?.doctor ? {
+          doctor_name: visit.doctor.name,
+          doctor_id: visit.doctor.id,
+          doctor_version: visit.doctor.updatedAt,
+        } : {}),
       }),
     });
 
@@ -5,10 +5,24 @@ import { visits, doctors } from '@/lib/db/schema';
 import { eq } from 'drizzle-orm';
 import { spawn } from 'child_process';
 import path from 'path';
+import { getAgentVisitPayload } from '@/lib/livekit-agents/visit-payload';
 
 // Store active agent processes
 const activeAgents = new Map<string, any>();
 
+// Local dispatch endpoint of a long-lived agent worker (agents/run_worker.py with
+// AGENT_DISPATCH_ENABLED=true). When set, visits are handed to warm worker processes
+// instead of spawning a Python process per visit.
+const AGENT_DISPATCH_URL = process.env.AGENT_DISPATCH_URL;
+
+function dispatchHeaders(): Record<string, string> {
+  const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+  if (process.env.AGENT_SERVICE_TOKEN) {
+    headers['x-service-token'] = process.env.AGENT_SERVICE_TOKEN;
+  }
+  return headers;
+}
+
 export async function POST(request: NextRequest) {
   const authResult = await requireAuth(request);
 
@@ -57,6 +71,45 @@ export async function POST(request: NextRequest) {
       return NextResponse.json({ error: 'Visit has no LiveKit room' }, { status: 400 });
     }
 
+    if (AGENT_DISPATCH_URL) {
+      const visitPayload = await getAgentVisitPayload(visitId);
+      const dispatchResponse = await fetch(`${AGENT_DISPATCH_URL}/dispatch`, {
+        method: 'POST',
+        headers: dispatchHeaders(),
+        body: JSON.stringify({
+          visit_id: visitId,
+          room: visit.livekitRoomName,
+          doctor_name: visit.doctor.name,
+          visit: visitPayload,
+        }),
+      });
+
+      if (!dispatchResponse.ok) {
+        const errorText = await dispatchResponse.text();
+        throw new Error(`Agent dispatch failed: ${dispatchResponse.status} ${errorText}`);
+      }
+
+      const { dispatch_id: dispatchId } = await dispatchResponse.json();
+
+      activeAgents.set(visitId, {
+        dispatchId,
+        visitId,
+        roomName: visit.livekitRoomName,
+        doctorName: visit.doctor.name,
+        startedAt: new Date(),
+      });
+
+      console.log(`AI Doctor ${visit.doctor.name} dispatched for visit ${visitId} in room ${visit.livekitRoomName}`);
+
+      return NextResponse.json({
+        message: 'AI Doctor agent dispatched successfully',
+        doctorName: visit.doctor.name,
+        roomName: visit.livekitRoomName,
+        visitId: visitId,
+        dispatchId,
+      });
+    }
+
     // Start Python agent as separate process
     const agentsDir = path.join(process.cwd(), 'agents');
     const agentScript = path.join(agentsDir, 'doctor_agent.py');
@@ -174,8 +227,16 @@ export async function DELETE(request: NextRequest) {
       return NextResponse.json({ error: 'Agent not found' }, { status: 404 });
     }
 
-    // Kill the process
-    agentInfo.process.kill();
+    if (agentInfo.dispatchId) {
+      // Remove the dispatch; the worker process itself stays up for other visits
+      await fetch(
+        `${AGENT_DISPATCH_URL}/dispatch/${encodeURIComponent(agentInfo.roomName)}/${encodeURIComponent(agentInfo.dispatchId)}`,
+        { method: 'DELETE', headers: dispatchHeaders() }
+      );
+    } else {
+      // Kill the process
+      agentInfo.process.kill();
+    }
     activeAgents.delete(visitId);
 
     return NextResponse.json({
@@ -205,7 +266,8 @@ export async function GET(request: NextRequest) {
     roomName: info.roomName,
     doctorName: info.doctorName,
     startedAt: info.startedAt,
-    pid: info.process.pid,
+    pid: info.process?.pid,
+    dispatchId: info.dispatchId,
   }));
 
   return NextResponse.json({ agents });
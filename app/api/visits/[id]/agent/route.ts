@@ -1,7 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { db } from '@/lib/db';
-import { visits, scenarios, doctors } from '@/lib/db/schema';
-import { eq } from 'drizzle-orm';
+import { getAgentVisitPayload } from '@/lib/livekit-agents/visit-payload';
 
 /**
  * Special endpoint for agents to get visit data without authentication.
@@ -26,38 +24,7 @@ export async function GET(
     }
 
     // Get visit with related data
-    const [visit] = await db
-      .select({
-        id: visits.id,
-        userId: visits.userId,
-        status: visits.status,
-        livekitRoomName: visits.livekitRoomName,
-        egressId: visits.egressId,
-        startedAt: visits.startedAt,
-        completedAt: visits.completedAt,
-        duration: visits.duration,
-        createdAt: visits.createdAt,
-        scenario: {
-          id: scenarios.id,
-          title: scenarios.title,
-          description: scenarios.description,
-          difficultyLevel: scenarios.difficultyLevel,
-          promptTemplate: scenarios.promptTemplate,
-        },
-        doctor: {
-          id: doctors.id,
-          name: doctors.name,
-          personalityType: doctors.personalityType,
-          empathyLevel: doctors.empathyLevel,
-          promptTemplate: doctors.promptTemplate,
-          specialty: doctors.specialty,
-        },
-      })
-      .from(visits)
-      .leftJoin(scenarios, eq(visits.scenarioId, scenarios.id))
-      .leftJoin(doctors, eq(visits.doctorId, doctors.id))
-      .where(eq(visits.id, visitId))
-      .limit(1);
+    const visit = await getAgentVisitPayload(visitId);
 
     if (!visit) {
       return NextResponse.json(
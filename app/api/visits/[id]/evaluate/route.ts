@@ -118,12 +118,14 @@ export async function POST(
         metricsJson: evaluationResult.metrics,
         recommendations: evaluationResult.recommendations,
       })
+      .onConflictDoNothing({ target: evaluations.visitId })
       .returning();
 
+    // A concurrent request evaluated the visit while GigaChat was answering
     if (!savedEvaluation) {
       return NextResponse.json(
-        { error: 'Failed to save evaluation' },
-        { status: 500 }
+        { error: 'Visit has already been evaluated' },
+        { status: 409 }
       );
     }
 
@@ -172,8 +174,16 @@ export async function POST(
               'Work on building rapport with healthcare professionals'
             ],
           })
+          .onConflictDoNothing({ target: evaluations.visitId })
           .returning();
 
+        if (!fallbackEvaluation) {
+          return NextResponse.json(
+            { error: 'Visit has already been evaluated' },
+            { status: 409 }
+          );
+        }
+
         return NextResponse.json({
           message: 'Visit evaluation completed (with technical assistance)',
           evaluation: {
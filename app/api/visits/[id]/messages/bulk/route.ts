@@ -0,0 +1,125 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { requireAuth } from '@/lib/auth/require-auth';
+import { db } from '@/lib/db';
+import { visitMessages, visits } from '@/lib/db/schema';
+import { eq } from 'drizzle-orm';
+
+const MAX_BULK_MESSAGES = 200;
+
+function validateMessage(message: any): string | null {
+  if (!message?.role || typeof message.content !== 'string' || !message.content.trim()) {
+    return 'Role and content are required';
+  }
+
+  if (!['user', 'assistant'].includes(message.role)) {
+    return 'Role must be either "user" or "assistant"';
+  }
+
+  return null;
+}
+
+// POST /api/visits/[id]/messages/bulk - Add a batch of messages to visit
+// Used by the LiveKit agent's write-behind journal
+export async function POST(
+  request: NextRequest,
+  { params }: { params: { id: string } }
+) {
+  const visitId = params.id;
+
+  // Check if request is from agent (service token)
+  const serviceToken = request.headers.get('x-service-token');
+  const expectedToken = process.env.AGENT_SERVICE_TOKEN;
+  const isAgentRequest = serviceToken && expectedToken && serviceToken === expectedToken;
+
+  // For agents, skip auth; for users, require auth
+  let user: any = null;
+  if (!isAgentRequest) {
+    const authResult = await requireAuth(request, ['rep', 'trainer']);
+    if (authResult instanceof NextResponse) {
+      return authResult;
+    }
+    user = authResult.user;
+  }
+
+  try {
+    const { messages } = await request.json();
+
+    if (!Array.isArray(messages) || messages.length === 0) {
+      return NextResponse.json(
+        { error: 'Messages array is required' },
+        { status: 400 }
+      );
+    }
+
+    if (messages.length > MAX_BULK_MESSAGES) {
+      return NextResponse.json(
+        { error: `At most ${MAX_BULK_MESSAGES} messages per request` },
+        { status: 400 }
+      );
+    }
+
+    // Invalid messages are reported back and skipped; the valid rest of the batch is saved
+    const rejected: { index: number; error: string }[] = [];
+    const validMessages = messages.filter((message: any, index: number) => {
+      const error = validateMessage(message);
+      if (error) {
+        rejected.push({ index, error });
+      }
+      return !error;
+    });
+
+    if (validMessages.length === 0) {
+      return NextResponse.json(
+        { error: rejected[0].error, rejected },
+        { status: 400 }
+      );
+    }
+
+    // Verify visit exists and belongs to user (for reps)
+    const [visit] = await db
+      .select()
+      .from(visits)
+      .where(eq(visits.id, visitId))
+      .limit(1);
+
+    if (!visit) {
+      return NextResponse.json({ error: 'Visit not found' }, { status: 404 });
+    }
+
+    // Only allow access to own visits for reps (skip for agents)
+    if (!isAgentRequest && user && user.role === 'rep' && visit.userId !== user.id) {
+      return NextResponse.json({ error: 'Access denied' }, { status: 403 });
+    }
+
+    // Messages already saved (journal replays, agent reconnects) hit the unique
+    // (visit_id, message_key) index and are skipped, also under concurrent retries
+    const rows = validMessages.map((message: any) => ({
+      visitId,
+      role: message.role,
+      content: message.content,
+      metadata: message.metadata,
+      messageKey: typeof message.metadata?.messageKey === 'string' ? message.metadata.messageKey : null,
+      // Keep the agent's timestamps so batched messages stay in conversation order
+      ...(message.timestamp ? { timestamp: new Date(message.timestamp) } : {}),
+    }));
+
+    const inserted = await db
+      .insert(visitMessages)
+      .values(rows)
+      .onConflictDoNothing({ target: [visitMessages.visitId, visitMessages.messageKey] })
+      .returning({ id: visitMessages.id });
+
+    return NextResponse.json({
+      inserted: inserted.length,
+      duplicates: validMessages.length - inserted.length,
+      rejected,
+    }, { status: 201 });
+
+  } catch (error) {
+    console.error('Bulk save messages error:', error);
+    return NextResponse.json(
+      { error: 'Failed to save messages' },
+      { status: 500 }
+    );
+  }
+}
@@ -2,7 +2,7 @@ import { NextRequest, NextResponse } from 'next/server';
 import { requireAuth } from '@/lib/auth/require-auth';
 import { db } from '@/lib/db';
 import { visitMessages, visits } from '@/lib/db/schema';
-import { eq, desc } from 'drizzle-orm';
+import { eq, desc, and } from 'drizzle-orm';
 
 // GET /api/visits/[id]/messages - Get messages for a visit
 export async function GET(
@@ -121,6 +121,10 @@ export async function POST(
       return NextResponse.json({ error: 'Access denied' }, { status: 403 });
     }
 
+    // Agent retries and reconnects resend messages with the same messageKey; the unique
+    // (visit_id, message_key) index turns a concurrent or repeated insert into a no-op
+    const messageKey = typeof metadata?.messageKey === 'string' ? metadata.messageKey : null;
+
     // Save message
     const [newMessage] = await db
       .insert(visitMessages)
@@ -129,9 +133,36 @@ export async function POST(
         role,
         content,
         metadata,
+        messageKey,
       })
+      .onConflictDoNothing({ target: [visitMessages.visitId, visitMessages.messageKey] })
       .returning();
 
+    if (!newMessage && messageKey) {
+      // Already saved: return the stored message instead of a duplicate
+      const [existing] = await db
+        .select()
+        .from(visitMessages)
+        .where(and(
+          eq(visitMessages.visitId, visitId),
+          eq(visitMessages.messageKey, messageKey)
+        ))
+        .limit(1);
+
+      if (existing) {
+        return NextResponse.json({
+          message: {
+            id: existing.id,
+            role: existing.role,
+            content: existing.content,
+            timestamp: existing.timestamp,
+            metadata: existing.metadata,
+          },
+          duplicate: true,
+        });
+      }
+    }
+
     if (!newMessage) {
       return NextResponse.json(
         { error: 'Failed to save message' },
@@ -0,0 +1,4 @@
+ALTER TABLE "visit_messages" ADD COLUMN "message_key" text;--> statement-breakpoint
+UPDATE "visit_messages" SET "message_key" = "metadata"->>'messageKey' WHERE "metadata" ? 'messageKey';--> statement-breakpoint
+DELETE FROM "visit_messages" AS "duplicate" USING "visit_messages" AS "kept" WHERE "duplicate"."visit_id" = "kept"."visit_id" AND "duplicate"."message_key" = "kept"."message_key" AND ("duplicate"."timestamp", "duplicate"."id") > ("kept"."timestamp", "kept"."id");--> statement-breakpoint
+CREATE UNIQUE INDEX "visit_messages_visit_id_message_key_idx" ON "visit_messages" USING btree ("visit_id","message_key");
@@ -0,0 +1,2 @@
+DELETE FROM "evaluations" AS "duplicate" USING "evaluations" AS "kept" WHERE "duplicate"."visit_id" = "kept"."visit_id" AND ("duplicate"."created_at", "duplicate"."id") > ("kept"."created_at", "kept"."id");--> statement-breakpoint
+CREATE UNIQUE INDEX "evaluations_visit_id_idx" ON "evaluations" USING btree ("visit_id");
\ No newline at end of file
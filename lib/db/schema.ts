@@ -1,4 +1,4 @@
-import { pgTable, text, integer, timestamp, uuid, boolean, jsonb, pgEnum, varchar } from 'drizzle-orm/pg-core';
+import { pgTable, text, integer, timestamp, uuid, boolean, jsonb, pgEnum, varchar, uniqueIndex } from 'drizzle-orm/pg-core';
 import { relations } from 'drizzle-orm';
 
 // Enums
@@ -91,7 +91,10 @@ export const visitMessages = pgTable('visit_messages', {
   content: text('content').notNull(),
   timestamp: timestamp('timestamp').defaultNow().notNull(),
   metadata: jsonb('metadata'), // Store STT/TTS metadata, audio URLs, etc.
-});
+  messageKey: text('message_key'), // Agent idempotency key; a message is stored once per visit
+}, (table) => [
+  uniqueIndex('visit_messages_visit_id_message_key_idx').on(table.visitId, table.messageKey),
+]);
 
 // Evaluations table
 export const evaluations = pgTable('evaluations', {
@@ -102,7 +105,9 @@ export const evaluations = pgTable('evaluations', {
   metricsJson: jsonb('metrics_json'), // Detailed evaluation metrics
   recommendations: jsonb('recommendations'), // Improvement suggestions
   createdAt: timestamp('created_at').defaultNow().notNull(),
-});
+}, (table) => [
+  uniqueIndex('evaluations_visit_id_idx').on(table.visitId),
+]);
 
 // Relations
 export const companiesRelations = relations(companies, ({ many }) => ({
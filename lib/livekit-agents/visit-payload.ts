@@ -0,0 +1,49 @@
+import { db } from '@/lib/db';
+import { visits, scenarios, doctors } from '@/lib/db/schema';
+import { eq } from 'drizzle-orm';
+
+/**
+ * Visit + scenario + doctor payload consumed by the Python doctor agent.
+ * Served by /api/visits/[id]/agent and embedded into agent job (dispatch) metadata,
+ * so an agent job can start without calling back into the API. Never put it into
+ * room metadata: every participant can read that.
+ */
+export async function getAgentVisitPayload(visitId: string) {
+  const [visit] = await db
+    .select({
+      id: visits.id,
+      userId: visits.userId,
+      status: visits.status,
+      livekitRoomName: visits.livekitRoomName,
+      egressId: visits.egressId,
+      startedAt: visits.startedAt,
+      completedAt: visits.completedAt,
+      duration: visits.duration,
+      createdAt: visits.createdAt,
+      scenario: {
+        id: scenarios.id,
+        title: scenarios.title,
+        description: scenarios.description,
+        difficultyLevel: scenarios.difficultyLevel,
+        promptTemplate: scenarios.promptTemplate,
+      },
+      doctor: {
+        id: doctors.id,
+        name: doctors.name,
+        personalityType: doctors.personalityType,
+        empathyLevel: doctors.empathyLevel,
+        promptTemplate: doctors.promptTemplate,
+        specialty: doctors.specialty,
+        updatedAt: doctors.updatedAt,
+      },
+    })
+    .from(visits)
+    .leftJoin(scenarios, eq(visits.scenarioId, scenarios.id))
+    .leftJoin(doctors, eq(visits.doctorId, doctors.id))
+    .where(eq(visits.id, visitId))
+    .limit(1);
+
+  return visit ?? null;
+}
+
+export type AgentVisitPayload = NonNullable<Awaited<ReturnType<typeof getAgentVisitPayload>>>;
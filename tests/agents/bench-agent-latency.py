@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк задержек и пропускной способности агента врача.
+
+Запускает локальные заглушки GigaChat и Next.js API (agents/mock_services.py) и
+прогоняет N параллельных визитов через GigaChatLLM.chat и путь сохранения сообщений.
+Результат (p50/p95/p99 задержки хода, время до первого токена, RPS, память на сессию)
+выводится в JSON для сравнения между коммитами.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+# Добавляем путь к агентам
+AGENTS_DIR = os.path.join(os.path.dirname(__file__), '../../agents')
+sys.path.insert(0, AGENTS_DIR)
+
+from metrics import latency_summary
+from mock_services import MockServices
+
+REP_LINES = [
+    "Здравствуйте, доктор. Я хотел бы рассказать о новом препарате для лечения гипертонии.",
+    "Препарат прошёл три фазы клинических исследований, в них участвовало более пяти тысяч пациентов.",
+    "Основные противопоказания — беременность и тяжёлая почечная недостаточность.",
+    "В отличие от аналогов, его принимают один раз в сутки, это повышает приверженность лечению.",
+    "Я оставлю вам материалы и результаты исследований. Спасибо за уделённое время.",
+]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=AGENTS_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_visit(doctor_agent, llm, visit_index: int, args, turn_latencies: list, ttfts: list, errors: list):
+    """One simulated visit: N rep turns, each answered by GigaChatLLM."""
+    visit_id = f"bench-visit-{visit_index}"
+    visit = await doctor_agent.get_visit_data(visit_id)
+    doctor = doctor_agent.visit_cache.normalize_doctor(visit.get("doctor"))
+    system_prompt = doctor_agent.build_system_prompt(doctor.get("name") or "Доктор", doctor)
+
+    giga_llm = doctor_agent.GigaChatLLM(visit_id=visit_id, doctor_prompt=system_prompt, streaming=args.stream)
+    chat_ctx = llm.ChatContext()
+    # The agent instructions are in the chat context of a live session too
+    chat_ctx.add_message(role="system", content=system_prompt)
+    if args.speculative:
+        from speculation import SpeculativeGenerator
+
+        giga_llm.speculation = SpeculativeGenerator(
+            giga_llm._speculate,
+            context=lambda: giga_llm._collect_messages(chat_ctx),
+        )
+
+    for turn in range(args.turns):
+        line = REP_LINES[turn % len(REP_LINES)]
+        if args.speculative:
+            # Interim transcript (no final punctuation) at the end of speech, then the
+            # endpointing delay before the turn is committed
+            giga_llm.speculation.on_transcript(line.rstrip("."), is_final=False)
+            giga_llm.speculation.on_end_of_speech()
+            await asyncio.sleep(args.endpointing_ms / 1000.0)
+        chat_ctx.add_message(role="user", content=line)
+        started = time.perf_counter()
+        first_token = None
+        try:
+            # Without --stream the whole reply arrives as one chunk
+            parts = []
+            async with giga_llm.chat(chat_ctx=chat_ctx) as stream:
+                async for chunk in stream:
+                    content = chunk.delta.content if chunk.delta else None
+                    if content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        parts.append(content)
+            chat_ctx.add_message(role="assistant", content="".join(parts))
+        except Exception as e:
+            errors.append(f"{visit_id} turn {turn}: {e}")
+            continue
+        elapsed = time.perf_counter() - started
+        turn_latencies.append(elapsed)
+        ttfts.append(first_token if first_token is not None else elapsed)
+
+    await giga_llm.context_window.aclose()
+    if giga_llm.speculation is not None:
+        await giga_llm.speculation.aclose()
+    return giga_llm
+
+
+async def run_benchmark(args) -> dict:
+    services = MockServices(
+        ttft_ms=args.ttft_ms,
+        jitter_ms=args.jitter_ms,
+        token_delay_ms=args.token_delay_ms,
+        seed=args.seed,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        stall_ms=args.stall_ms,
+        prefill_ms_per_1k=args.prefill_ms_per_1k,
+    )
+    await services.start()
+
+    # Agent modules read their configuration at import time
+    workdir = tempfile.mkdtemp(prefix="shadowmed-bench-")
+    os.environ.update(services.env())
+    os.environ["GIGACHAT_TOKEN_CACHE_DIR"] = workdir
+    os.environ["MESSAGE_JOURNAL_PATH"] = os.path.join(workdir, "journal.jsonl")
+    os.environ.pop("AGENT_SERVICE_TOKEN", None)
+    os.environ["GIGACHAT_RPS_LIMIT"] = str(args.gigachat_rps)
+    os.environ["GIGACHAT_RATE_STATE_DIR"] = workdir
+    os.environ["GIGACHAT_SESSION_CACHE"] = "true" if args.session_cache else "false"
+
+    import doctor_agent
+    from livekit.agents import llm
+    from http_pool import http_pool
+    from message_journal import message_journal
+    from gigachat_auth import gigachat_tokens
+    from gigachat_resilience import gigachat_resilience
+    from rate_limiter import gigachat_rate_limiter
+
+    process = psutil.Process()
+    http_pool.acquire()
+    message_journal.acquire()
+    # The token is fetched before the timed run, as in a warm worker
+    await gigachat_tokens.get_token()
+
+    rss_before = process.memory_info().rss
+    turn_latencies, ttfts, errors = [], [], []
+    started = time.perf_counter()
+    sessions = await asyncio.gather(*[
+        run_visit(doctor_agent, llm, i, args, turn_latencies, ttfts, errors)
+        for i in range(args.visits)
+    ])
+    wall_time = time.perf_counter() - started
+    # Sessions are still referenced here, so RSS includes their state
+    rss_after = process.memory_info().rss
+
+    flush_started = time.perf_counter()
+    await message_journal.flush()
+    flush_time = time.perf_counter() - flush_started
+
+    # Fallback ("one moment") replies are spoken but not saved
+    expected_messages = 2 * len(turn_latencies) - gigachat_resilience.fallbacks_total
+    result = {
+        "benchmark": "agent-latency",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {
+            "visits": args.visits,
+            "turns": args.turns,
+            "stream": args.stream,
+            "ttft_ms": args.ttft_ms,
+            "jitter_ms": args.jitter_ms,
+            "token_delay_ms": args.token_delay_ms,
+            "error_rate": args.error_rate,
+            "stall_rate": args.stall_rate,
+            "gigachat_rps": args.gigachat_rps,
+            "session_cache": args.session_cache,
+            "prefill_ms_per_1k": args.prefill_ms_per_1k,
+            "speculative": args.speculative,
+            "endpointing_ms": args.endpointing_ms if args.speculative else None,
+        },
+        "turn_latency": latency_summary(turn_latencies),
+        "ttft": latency_summary(ttfts),
+        "rps": len(turn_latencies) / wall_time if wall_time else 0.0,
+        "wall_time": wall_time,
+        "errors": len(errors),
+        "memory_per_session_kb": (rss_after - rss_before) / 1024 / max(1, len(sessions)),
+        "rss_mb": rss_after / 1024 / 1024,
+        "persistence": {
+            "expected_messages": expected_messages,
+            "saved_messages": services.counters["saved_messages"],
+            "duplicates": services.counters["duplicates"],
+            "final_flush_time": flush_time,
+        },
+        "mock_calls": dict(services.counters),
+        "http_pool": http_pool.stats(),
+        "gigachat_resilience": gigachat_resilience.stats(),
+        "rate_limiter": gigachat_rate_limiter.stats(),
+        "gigachat_usage": dict(doctor_agent.gigachat_usage),
+    }
+    if args.speculative:
+        result["speculation"] = {
+            key: sum(s.speculation.stats()[key] for s in sessions)
+            for key in ("started", "committed", "discarded")
+        }
+    if errors:
+        result["error_samples"] = errors[:5]
+
+    await message_journal.release()
+    await gigachat_tokens.aclose()
+    await http_pool.release()
+    await services.aclose()
+    return result
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> list:
+    """Return the metrics that regressed by more than max_regression (fraction)."""
+    regressions = []
+    for section in ("turn_latency", "ttft"):
+        for stat in ("p50", "p95", "p99"):
+            old, new = baseline[section][stat], result[section][stat]
+            if old and (new - old) / old > max_regression:
+                regressions.append(f"{section}.{stat}: {old:.4f}s -> {new:.4f}s")
+    old_rps, new_rps = baseline["rps"], result["rps"]
+    if old_rps and (old_rps - new_rps) / old_rps > max_regression:
+        regressions.append(f"rps: {old_rps:.2f} -> {new_rps:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark for the doctor agent")
+    parser.add_argument("--visits", type=int, default=20, help="Concurrent simulated visits")
+    parser.add_argument("--turns", type=int, default=5, help="Rep turns per visit")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="Mock GigaChat time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock completions failing with 503")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of mock completions stalling")
+    parser.add_argument("--stall-ms", type=float, default=5000.0, help="Stall before the first token")
+    parser.add_argument("--gigachat-rps", type=float, default=0.0, help="Shared GigaChat request rate limit (0: off)")
+    parser.add_argument("--session-cache", action=argparse.BooleanOptionalAction, default=True, help="Send X-Session-ID per visit")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0, help="Mock TTFT per 1000 uncached prompt tokens")
+    parser.add_argument("--speculative", action="store_true", help="Start replies on the interim transcript")
+    parser.add_argument("--endpointing-ms", type=float, default=500.0, help="End of speech to turn commit delay")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    parser.add_argument("--baseline", help="Compare with a previous JSON result")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="Allowed regression vs baseline")
+    args = parser.parse_args()
+
+    # Agent logging goes to stderr, stdout carries only the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run_benchmark(args))
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != result["config"]:
+            print("⚠️  Baseline was recorded with a different configuration", file=sys.stderr)
+        regressions = compare(result, baseline, args.max_regression)
+        for line in regressions:
+            print(f"❌ Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()